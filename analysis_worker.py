@@ -0,0 +1,85 @@
+import logging
+import os
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from flowchart_engine import FlowchartEngine
+from results_store import init_results_db
+from topas_runner import RunControl
+
+
+class AnalysisWorker(QThread):
+    """
+    Runs a FlowchartEngine on a background thread so the main window stays responsive.
+
+    The engine opens its own connection to results.db because SQLite connections
+    cannot be shared between threads. Progress is reported through Qt signals, which
+    are delivered on the GUI thread.
+    """
+
+    node_started = pyqtSignal(str, str, int)            # run_id, node_id, iteration
+    node_finished = pyqtSignal(str, str, int)           # run_id, node_id, iteration
+    refinement_finished = pyqtSignal(str, str, str, int, int)  # run_id, node_id, scenario, done, total
+    eta_changed = pyqtSignal(str, float)                # node_id, seconds left for its refinements
+    analysis_finished = pyqtSignal(str)                 # 'finished', 'cancelled' or 'failed'
+    analysis_failed = pyqtSignal(str)                   # error message
+
+    def __init__(self, flowchart, selected_file, output_directory, results_directory, run_id='run_1', resume=False,
+                 parent=None):
+        """With resume=True the flowchart and sample come from the checkpoint of run_id in results.db."""
+        super().__init__(parent)
+        self.flowchart = flowchart
+        self.selected_file = selected_file
+        self.output_directory = output_directory
+        self.results_directory = results_directory
+        self.run_id = run_id
+        self.resume = resume
+        self.run_control = RunControl()
+        self.engine = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self):
+        db_conn = init_results_db(os.path.join(self.results_directory, 'results.db'))
+        status = 'failed'
+        try:
+            if self.resume:
+                self.engine = FlowchartEngine.from_checkpoint(db_conn, self.results_directory, self.run_id,
+                                                              run_control=self.run_control)
+            else:
+                self.engine = FlowchartEngine(
+                    self.flowchart, self.selected_file, self.output_directory, self.results_directory, db_conn,
+                    run_control=self.run_control
+                )
+            if self.engine is None:
+                self.analysis_failed.emit(f'No checkpoint found for {self.run_id}.')
+                return
+            self.engine.on_node_started = self.node_started.emit
+            self.engine.on_node_finished = self._emit_node_finished
+            self.engine.on_refinement = self._emit_refinement
+            if self.resume:
+                if not self.engine.resume(self.run_id):
+                    self.analysis_failed.emit(f'{self.run_id} has nothing left to resume.')
+                else:
+                    status = 'cancelled' if self.engine.cancelled else 'finished'
+            elif not self.engine.run(self.run_id):
+                self.analysis_failed.emit('No starting node found in the flowchart.')
+            else:
+                status = 'cancelled' if self.engine.cancelled else 'finished'
+        except Exception as e:
+            self.logger.error(f"Analysis failed: {e}", exc_info=True)
+            self.analysis_failed.emit(str(e))
+        finally:
+            db_conn.close()
+            self.analysis_finished.emit(status)
+
+    def cancel(self):
+        """Ask the engine to stop; running tc.exe processes are killed straight away."""
+        self.run_control.cancel()
+
+    def _emit_node_finished(self, run_id, node_id, iteration, output_data):
+        self.node_finished.emit(run_id, node_id, iteration)
+
+    def _emit_refinement(self, run_id, node_id, input_file, record, done, total, eta_seconds):
+        scenario = os.path.splitext(os.path.basename(input_file))[0]
+        self.refinement_finished.emit(run_id, node_id, scenario, done, total)
+        self.eta_changed.emit(node_id, eta_seconds)
@@ -0,0 +1,126 @@
+"""
+Headless batch analysis: run one analysis template over many raw files.
+
+Example:
+    python batch_cli.py "test 23" "Samples/*.raw" --samples 4 --max-processes 16
+"""
+
+import argparse
+import copy
+import csv
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from file_handling import parse_config
+from flowchart_engine import FlowchartEngine
+from results_store import init_results_db, create_results_directory
+from topas_runner import set_process_budget, process_budget_settings
+
+
+SUMMARY_COLUMNS = ['sample', 'status', 'elapsed_s', 'results_directory', 'final_structures', 'error']
+
+
+def resolve_template(template):
+    """Accept a path or the name of a template in analysis_templates/ (with or without .json)."""
+    if os.path.isfile(template):
+        return template
+    template_dir = os.path.join(os.getcwd(), 'analysis_templates')
+    for candidate in (template, f"{template}.json"):
+        path = os.path.join(template_dir, candidate)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"Analysis template {template} not found in {template_dir}")
+
+
+def run_sample(flowchart, sample_path, output_directory, results_root, run_id='run_1'):
+    """Run the flowchart on one sample and return its summary row."""
+    started = time.time()
+    row = {'sample': os.path.basename(sample_path), 'status': 'failed', 'results_directory': '',
+           'final_structures': '', 'error': ''}
+    logger = logging.getLogger(f"Batch_{row['sample']}")
+    try:
+        results_directory = create_results_directory(results_root, sample_path)
+        row['results_directory'] = results_directory
+        db_conn = init_results_db(os.path.join(results_directory, 'results.db'))
+        try:
+            # Every sample gets its own copy so that nothing is shared between engines
+            engine = FlowchartEngine(copy.deepcopy(flowchart), sample_path, output_directory,
+                                     results_directory, db_conn, logger=logger)
+            if not engine.run(run_id):
+                raise RuntimeError("No starting node found in the flowchart.")
+            final_output = engine.final_output(run_id) or {}
+            row['final_structures'] = ';'.join(final_output.get('structures_list') or [])
+            row['status'] = 'finished'
+        finally:
+            db_conn.close()
+    except Exception as e:
+        logger.error(f"Analysis of {sample_path} failed: {e}", exc_info=True)
+        row['error'] = str(e)
+    row['elapsed_s'] = round(time.time() - started, 1)
+    return row
+
+
+def write_summary(rows, summary_path):
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_summary(rows):
+    print(f"{'Sample':40} {'Status':10} {'Time (s)':>9}  Final structures")
+    for row in rows:
+        print(f"{row['sample'][:40]:40} {row['status']:10} {row['elapsed_s']:>9}  {row['final_structures'] or row['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run an analysis template over a set of raw files.')
+    parser.add_argument('template', help='Analysis template path or name in analysis_templates/')
+    parser.add_argument('pattern', help='Glob of raw files to analyse, e.g. "Samples/*.raw"')
+    parser.add_argument('--samples', type=int, default=2, help='Number of samples analysed concurrently')
+    parser.add_argument('--max-processes', type=int, default=None,
+                        help='Maximum number of tc.exe processes running at once across all samples '
+                             '(default: max_parallel_processes in config.txt, one per core if auto)')
+    parser.add_argument('--output-dir', default=os.path.join(os.getcwd(), 'results'),
+                        help='Directory for the per-sample results and the summary table')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    with open(resolve_template(args.template), 'r') as f:
+        flowchart = json.load(f)
+
+    samples = sorted(glob.glob(args.pattern))
+    if not samples:
+        print(f"No files match {args.pattern}")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    settings = process_budget_settings(parse_config(os.path.join(os.getcwd(), 'config.txt')))
+    settings['max_processes'] = args.max_processes or settings['max_processes']
+    set_process_budget(**settings)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, args.samples)) as executor:
+        futures = [executor.submit(run_sample, flowchart, os.path.abspath(sample), args.output_dir, args.output_dir)
+                   for sample in samples]
+        for future in as_completed(futures):
+            row = future.result()
+            logging.info(f"{row['sample']}: {row['status']} in {row['elapsed_s']} s")
+            rows.append(row)
+
+    rows.sort(key=lambda row: row['sample'])
+    summary_path = os.path.join(args.output_dir, f"batch_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    write_summary(rows, summary_path)
+    print_summary(rows)
+    print(f"Summary written to {summary_path}")
+    return 0 if all(row['status'] == 'finished' for row in rows) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
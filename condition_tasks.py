@@ -1,10 +1,11 @@
 import os
 import logging
 
-import main_gui
-
 
 class BaseConditionTask:
+    # Keys of the source node's output the condition reads, None for all of them
+    data_keys = None
+
     def __init__(self, node_id, parameters, data, output_directory):
         self.node_id = node_id
         self.parameters = parameters
@@ -13,6 +14,8 @@ class BaseConditionTask:
 
 
 class ListLengthGreaterTask(BaseConditionTask):
+    data_keys = ('structures_list',)
+
     def run(self, condition_param, iterations):
         # Get the structure list and check its length against the parameter
         logging.info(f"GData: {self.data.keys()}")
@@ -25,6 +28,8 @@ class ListLengthGreaterTask(BaseConditionTask):
             return False
 
 class ListLengthLessTask(BaseConditionTask):
+    data_keys = ('structures_list',)
+
     def run(self, condition_param, iterations):
         # Get the structure list and check its length against the parameter
         logging.info(f"LData: {self.data.keys()}")
@@ -37,6 +42,8 @@ class ListLengthLessTask(BaseConditionTask):
             return False
 
 class RWPGradientTask(BaseConditionTask):
+    data_keys = ('structure_list',)
+
     def run(self, condition_param, iterations):
         # Get the structure list and check if the RWP gradient is greater than the parameter
         structure_list = self.data.get('structure_list')
@@ -47,6 +54,8 @@ class RWPGradientTask(BaseConditionTask):
         return False
 
 class ContainsTask(BaseConditionTask):
+    data_keys = ('structure_list',)
+
     def run(self, condition_param, iterations):
         # Get the structure list and check if it contains the parameter
         structure_list = self.data.get('structure_list')
@@ -56,6 +65,8 @@ class ContainsTask(BaseConditionTask):
             return False
 
 class NumberOfRunsGreaterTask(BaseConditionTask):
+    data_keys = ()
+
     def run(self, condition_param, iterations):
         number_of_runs = int(iterations)
         logging.info(f"Number of runs greater than: {number_of_runs}")
@@ -66,6 +77,8 @@ class NumberOfRunsGreaterTask(BaseConditionTask):
             return False
 
 class NumberOfRunsLessTask(BaseConditionTask):
+    data_keys = ()
+
     def run(self, condition_param, iterations):
         number_of_runs = int(iterations)
         logging.info(f"Number of runs less than: {number_of_runs}")
@@ -77,6 +90,8 @@ class NumberOfRunsLessTask(BaseConditionTask):
 
 
 class FinishedTask(BaseConditionTask):
+    data_keys = ('results',)
+
     def run(self, condition_param, iterations):
         # Get the structure list and check its length against the parameter
         results = self.data.get('results', {})
@@ -1,10 +1,12 @@
 import logging
 
+import numpy as np
 from numpy.ma.core import minimum
 
 import tasks
-from exclusion_criteria_tasks import BaseExclusionCriteriaTask, WorstExclusionCriteriaTask, FailingExclusionCriteriaTask, WorstNegativeExclusionCriteriaTask, FailingZScoreExclusionCriteriaTask, AEBExclusionCriteriaTask, WorstCombinedExclusionCriteriaTask, WorstNegativeCombinedExclusionCriteriaTask, FailingZScoreCombinedExclusionCriteriaTask, AEBCombinedExclusionCriteriaTask
+from exclusion_criteria_tasks import BaseExclusionCriteriaTask, WorstExclusionCriteriaTask, FailingExclusionCriteriaTask, WorstNegativeExclusionCriteriaTask, FailingZScoreExclusionCriteriaTask, AEBExclusionCriteriaTask, WorstCombinedExclusionCriteriaTask, WorstNegativeCombinedExclusionCriteriaTask, FailingZScoreCombinedExclusionCriteriaTask, AEBCombinedExclusionCriteriaTask, WorstBatchExclusionCriteriaTask
 from file_handling import parse_config
+from scoring import batch_combined_confidence, worst_columns
 
 
 
@@ -22,12 +24,27 @@ class BaseExclusionTask:
             'Worst Combined': WorstCombinedExclusionCriteriaTask,
             'Worst Negative Combined': WorstNegativeCombinedExclusionCriteriaTask,
             'Failing Z-Score Combined': FailingZScoreCombinedExclusionCriteriaTask,
-            'All Failing Except Best Combined': AEBCombinedExclusionCriteriaTask
+            'All Failing Except Best Combined': AEBCombinedExclusionCriteriaTask,
+            'Worst Batch': WorstBatchExclusionCriteriaTask,
 
 
             # Add new task types here
         }
 
+    def run_criteria(self, criteria_task_class, parsed_data):
+        """
+        Run an exclusion criteria task on parsed_data. Criteria that exclude a single
+        structure ('Worst', 'Worst Negative') name it as a string; the screened data always
+        holds excluded_structure_list as a list, whatever the criteria.
+        """
+        screened_data = criteria_task_class(parameters=self.parameters, logger=self.logger).run(parsed_data)
+        if isinstance(screened_data, dict) and 'excluded_structure_list' in screened_data:
+            excluded_structures = screened_data['excluded_structure_list'] or []
+            if isinstance(excluded_structures, str):
+                excluded_structures = [excluded_structures]
+            screened_data['excluded_structure_list'] = list(excluded_structures)
+        return screened_data
+
     def get_screening_params(self):
         raise NotImplementedError
 
@@ -39,21 +56,18 @@ class BaseExclusionTask:
 
 
 class CrystalliteSizeExclusionTask(BaseExclusionTask):
-    def run(self, parsed_data):
-        self.logger.info(f"Running {self.__class__.__name__} exclusion task.")
-
-        # Retrieve and convert parameters
-        try:
-            min_percentage_weight = float(self.parameters.get('min_weight', 0.1))
-            max_percentage_weight = float(self.parameters.get('max_weight', 8.0))
-            minimum_crystallite_size = float(self.parameters.get('min_crystallite', 20.0))
-            threshold_step = float(self.parameters.get('crystallite_step', 30.0))
-            crystallite_size_start = float(self.parameters.get('crystallite_size_start', 40.0))
-            steps = int(self.parameters.get('steps', 5))  # Number of steps, default to 5
-            exclusion_criteria = self.parameters.get('exclusion_criteria', 'Worst')
-        except (TypeError, ValueError) as e:
-            self.logger.error(f"Invalid parameter value: {e}")
-            return [], list(parsed_data.keys())  # All structures invalid if parameters are missing
+    def get_screening_params(self):
+        """
+        Percentage weight boundaries and crystallite size limits of the screening rules.
+        Raises TypeError or ValueError for parameters that are not numbers.
+        """
+        min_percentage_weight = float(self.parameters.get('min_weight', 0.1))
+        max_percentage_weight = float(self.parameters.get('max_weight', 8.0))
+        minimum_crystallite_size = float(self.parameters.get('min_crystallite', 20.0))
+        threshold_step = float(self.parameters.get('crystallite_step', 30.0))
+        crystallite_size_start = float(self.parameters.get('crystallite_size_start', 40.0))
+        steps = int(self.parameters.get('steps', 5))  # Number of steps, default to 5
+        exclusion_criteria = self.parameters.get('exclusion_criteria', 'Worst')
 
         # Read config once at the beginning
         try:
@@ -75,6 +89,118 @@ class CrystalliteSizeExclusionTask(BaseExclusionTask):
 
         self.logger.info(f"Calculated boundaries: {boundaries}")
 
+        return {
+            'min_percentage_weight': min_percentage_weight,
+            'max_percentage_weight': max_percentage_weight,
+            'minimum_crystallite_size': minimum_crystallite_size,
+            'crystallite_size_start': crystallite_size_start,
+            'threshold_step': threshold_step,
+            'max_crystallite_size': crystallite_size_max_config * 0.95,
+            'boundaries': boundaries,
+            'exclusion_criteria': exclusion_criteria,
+        }
+
+    def screen(self, table):
+        """
+        Apply the percentage weight and crystallite size rules to every sample of a
+        scoring.SampleTable at once. Returns boolean (valid, invalid) masks of the table's shape.
+        """
+        params = self.get_screening_params()
+        percentage_weight = table.values['pw']
+        crystallite_size = table.values['cs']
+        boundaries = np.asarray(params['boundaries'])
+
+        # Structures without a percentage weight or crystallite size are invalid
+        measured = ~np.isnan(percentage_weight) & ~np.isnan(crystallite_size)
+
+        # First weight band each structure falls into, as in run()
+        in_band = (boundaries[:-1] <= percentage_weight[..., None]) & (percentage_weight[..., None] <= boundaries[1:])
+        has_band = in_band.any(axis=-1)
+        band = in_band.argmax(axis=-1)
+        min_cs = params['crystallite_size_start'] + params['threshold_step'] * band
+        size_ok = has_band & (min_cs <= crystallite_size) & (crystallite_size <= params['max_crystallite_size'])
+
+        valid = table.present & measured & (percentage_weight >= params['min_percentage_weight']) & (
+            (percentage_weight > params['max_percentage_weight']) | size_ok)
+        invalid = table.present & ~valid
+        return valid, invalid
+
+    def run_batch(self, table):
+        """
+        Screen many samples in one pass, e.g. a whole production day.
+
+        table is a scoring.SampleTable of samples x structures (see SampleTable.from_samples).
+        The screening rules and the 'Worst' and 'Failing' criteria are applied to the whole
+        table with array operations; other criteria run per sample through their task.
+
+        Returns {sample name: {'valid_structures', 'invalid_structures',
+        'excluded_structure_list', 'structures_list'}} with the lists in table order.
+        """
+        self.logger.info(f"Running {self.__class__.__name__} on {len(table)} samples.")
+        valid, invalid = self.screen(table)
+        exclusion_criteria = self.parameters.get('exclusion_criteria', 'Worst')
+        names = np.asarray(table.structure_names, dtype=object)
+
+        if exclusion_criteria == 'Worst':
+            confidences, scored = batch_combined_confidence(table, table.present, all_metrics=True)
+            worst = worst_columns(confidences, scored, table.positions)
+            excluded = np.zeros(table.present.shape, dtype=bool)
+            rows = np.flatnonzero(worst >= 0)
+            excluded[rows, worst[rows]] = True
+            kept = table.present & ~excluded
+        elif exclusion_criteria == 'Failing':
+            excluded = invalid
+            kept = valid
+        else:
+            excluded = kept = None
+
+        results = {}
+        for row, sample_name in enumerate(table.sample_names):
+            result = {
+                'valid_structures': list(names[valid[row]]),
+                'invalid_structures': list(names[invalid[row]]),
+            }
+            if kept is None:
+                criteria_task_class = self.exclusion_criteria_classes.get(exclusion_criteria)
+                parsed_data = table.parsed_data(row)
+                parsed_data.update(result)
+                try:
+                    screened_data = self.run_criteria(criteria_task_class, parsed_data)
+                except (IndexError, KeyError, ValueError) as e:
+                    # e.g. no structure could be scored; leave the sample unchanged
+                    self.logger.error(f"{exclusion_criteria} criteria failed for {sample_name}: {e}")
+                    screened_data = {'structures_list': [name + '.str' for name in names[table.present[row]]]}
+                result['excluded_structure_list'] = list(screened_data.get('excluded_structure_list') or [])
+                result['structures_list'] = screened_data.get('structures_list', [])
+            else:
+                result['excluded_structure_list'] = list(names[excluded[row]])
+                structures_list = [name + '.str' for name in names[kept[row]]]
+                if not structures_list and exclusion_criteria == 'Worst':
+                    # Nothing left, keep the sample's structures as the Worst criteria does
+                    structures_list = [name + '.str' for name in names[table.present[row]]]
+                result['structures_list'] = structures_list
+            results[sample_name] = result
+
+        self.logger.info(f"Screened {len(results)} samples with the {exclusion_criteria} criteria.")
+        return results
+
+    def run(self, parsed_data):
+        self.logger.info(f"Running {self.__class__.__name__} exclusion task.")
+
+        # Retrieve and convert parameters
+        try:
+            screening_params = self.get_screening_params()
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Invalid parameter value: {e}")
+            return [], list(parsed_data.keys())  # All structures invalid if parameters are missing
+
+        min_percentage_weight = screening_params['min_percentage_weight']
+        max_percentage_weight = screening_params['max_percentage_weight']
+        crystallite_size_start = screening_params['crystallite_size_start']
+        threshold_step = screening_params['threshold_step']
+        boundaries = screening_params['boundaries']
+        exclusion_criteria = screening_params['exclusion_criteria']
+
         valid_structures = []
         invalid_structures = []
 
@@ -112,7 +238,7 @@ class CrystalliteSizeExclusionTask(BaseExclusionTask):
                 if lower_bound <= percentage_weight <= upper_bound:
                     # Calculate minimum crystallite size for this step
                     min_cs = crystallite_size_start + (threshold_step * i)
-                    max_cs = (crystallite_size_max_config*0.95)
+                    max_cs = screening_params['max_crystallite_size']
 
                     self.logger.info(
                         f"{structure_name}: Percentage weight {percentage_weight} is between {lower_bound} and {upper_bound}")
@@ -145,9 +271,7 @@ class CrystalliteSizeExclusionTask(BaseExclusionTask):
 
 
         exclusion_criteria_task_class = self.exclusion_criteria_classes.get(exclusion_criteria)
-        exclusion_criterial_task = exclusion_criteria_task_class(parameters=self.parameters, logger=self.logger)
-
-        screened_data = exclusion_criterial_task.run(parsed_data)
+        screened_data = self.run_criteria(exclusion_criteria_task_class, parsed_data)
 
         return screened_data
 
@@ -208,12 +332,18 @@ class RWPExclusionTask(BaseExclusionTask):
                        'excluded_structure_list', 'rwp_all']
         structure_keys = [k for k in parsed_data.keys() if k not in ignore_keys]
         self.logger.info(f"Structure keys to process: {structure_keys}")
+        # Refinements stopped because they could no longer change the result, see tasks.SpeculativePruner
+        not_evaluated = set(self.parameters.get('not_evaluated_structures') or ())
 
         for structure_name in structure_keys:
             self.logger.info(f"Evaluating structure: {structure_name}")
             data = parsed_data.get(structure_name, {})
             self.logger.info(f"Data for {structure_name}: {data}")
 
+            if structure_name in not_evaluated:
+                self.logger.info(f"{structure_name}: Refinement stopped early -> Not evaluated")
+                continue
+
             # 6. Grab the 'RWP' entry, which may itself be a dict or float
             rwp_structure_data = data.get('RWP', None)
             if rwp_structure_data is None:
@@ -329,9 +459,8 @@ class RWPExclusionTask(BaseExclusionTask):
 
         # 11. Log before and after calling the exclusion_criteria task
         self.logger.info(f"Initializing exclusion criteria task: {exclusion_criteria}")
-        exclusion_criterial_task = exclusion_criteria_task_class(parameters=self.parameters, logger=self.logger)
         self.logger.info("Running exclusion criteria task")
-        screened_data = exclusion_criterial_task.run(parsed_data)
+        screened_data = self.run_criteria(exclusion_criteria_task_class, parsed_data)
 
         self.logger.info("Exclusion criteria task complete.")
         return screened_data
@@ -4,6 +4,11 @@ import re
 import json
 import shutil
 import configparser
+from dataclasses import dataclass, field, asdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from structure_library import get_structure_library
 
 
 
@@ -100,7 +105,7 @@ def save_template(template, template_path, selected_structures):
 
 def get_all_structure_files(structures_dir):
     """Get a list of all structure files in the structure database directory."""
-    return [filename for filename in os.listdir(structures_dir) if filename.endswith('.str')]
+    return get_structure_library(structures_dir).structure_files()
 
 def update_all_structures_template(structures_dir):
     """Update the all_structures.json file with the current list of structures."""
@@ -133,9 +138,23 @@ def get_structure_content_in_content(content, structure_name):
         logging.info(f"Structure {structure_name} not found in the content.")
         return None
 
+CRYSTALLITE_SIZE_REGEX = re.compile(r'(?:cs_\w+|csl_\w+|@)\s*,?\s*([\d.]+)')
+
+# The crystallite size parse_crystallite_size reads, followed by the limits TOPAS keeps it within
+CRYSTALLITE_SIZE_LIMITS_REGEX = re.compile(
+    CRYSTALLITE_SIZE_REGEX.pattern + r'`?\s*(?:min\s*=\s*([-\d.eE+]+)\s*;\s*)?(?:max\s*=\s*([-\d.eE+]+)\s*;)?')
+
+def parse_crystallite_size_limits(content):
+    """(min, max) the refined crystallite size stays within, 0 and inf where the structure sets no limit."""
+    cs_match = CRYSTALLITE_SIZE_LIMITS_REGEX.search(content)
+    if cs_match is None:
+        return 0.0, float('inf')
+    minimum = _to_float(cs_match.group(2)) if cs_match.group(2) else None
+    maximum = _to_float(cs_match.group(3)) if cs_match.group(3) else None
+    return max(minimum or 0.0, 0.0), maximum if maximum is not None else float('inf')
+
 def parse_crystallite_size(content):
-    regex = re.compile(r'(?:cs_\w+|csl_\w+|@)\s*,?\s*([\d.]+)')
-    cs_match = regex.search(content)
+    cs_match = CRYSTALLITE_SIZE_REGEX.search(content)
     if cs_match:
         return float(cs_match.group(1))
     else:
@@ -161,6 +180,164 @@ def parse_RWP(content):
         return None
 
 
+SECTION_MARKER_REGEX = re.compile(r'/\*(.+?)_(START|END)\*/')
+ZERO_ERROR_REGEX = re.compile(r'Zero_Error\(\s*[^,]*,\s*([-\d.eE+]+)')
+BKG_REGEX = re.compile(r'bkg\s+@?([^\n]*)')
+SCALE_REGEX = re.compile(r'scale\s+(?:!?[A-Za-z_]\w*\s+)?([-\d.eE+]+)')
+R_BRAGG_REGEX = re.compile(r'r_bragg\s+([\d.]+)')
+LATTICE_REGEX = re.compile(r'^\s*(a|b|c|al|be|ga)\s+(?:!?[A-Za-z_]\w*\s+)?([-\d.]+)', re.MULTILINE)
+
+
+def _to_float(token):
+    try:
+        return float(token.strip().rstrip('`'))
+    except ValueError:
+        return None
+
+
+@dataclass
+class StructureRecord:
+    """Refined values of one structure section of a TOPAS .out file."""
+    name: str
+    span: Tuple[int, int]
+    crystallite_size: Optional[float] = None
+    percentage_weight: Optional[float] = None
+    scale: Optional[float] = None
+    r_bragg: Optional[float] = None
+    lattice: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class OutputFileRecord:
+    """Everything PyTOPAS reads from one TOPAS .out file, parsed in a single scan."""
+    path: str
+    rwp: Optional[float] = None
+    zero_error: Optional[float] = None
+    background: List[float] = field(default_factory=list)
+    structures: Dict[str, StructureRecord] = field(default_factory=dict)
+
+    def structure(self, structure_name):
+        """Look up a structure by marker name, accepting names with or without the .str extension."""
+        record = self.structures.get(structure_name)
+        if record is None and not structure_name.endswith('.str'):
+            record = self.structures.get(structure_name + '.str')
+        return record
+
+    def structure_names(self):
+        return list(self.structures.keys())
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        structures = {
+            name: StructureRecord(**dict(values, span=tuple(values['span'])))
+            for name, values in data.get('structures', {}).items()
+        }
+        return cls(path=data.get('path', ''), rwp=data.get('rwp'), zero_error=data.get('zero_error'),
+                   background=list(data.get('background', [])), structures=structures)
+
+
+def index_structure_sections(content):
+    """
+    Map every structure name to the (start, end) span of its section in one scan.
+
+    The span is the text between /*<name>_START*/ and /*<name>_END*/, matching
+    get_structure_content_in_content (first occurrence of each marker wins).
+    """
+    starts = {}
+    ends = {}
+    for match in SECTION_MARKER_REGEX.finditer(content):
+        name, kind = match.group(1), match.group(2)
+        if kind == 'START':
+            starts.setdefault(name, match.end())
+        else:
+            ends.setdefault(name, match.start())
+    return {name: (start, ends[name]) for name, start in starts.items() if name in ends}
+
+
+def parse_output_content(content, path=''):
+    """Parse the content of a TOPAS .out file into an OutputFileRecord."""
+    spans = index_structure_sections(content)
+    header_end = min((start for start, _ in spans.values()), default=len(content))
+    header = content[:header_end]
+
+    record = OutputFileRecord(path=path)
+    rwp_match = re.search(r'r_wp\s+([\d.]+)', content)
+    record.rwp = float(rwp_match.group(1)) if rwp_match else None
+    zero_match = ZERO_ERROR_REGEX.search(header)
+    record.zero_error = _to_float(zero_match.group(1)) if zero_match else None
+    bkg_match = BKG_REGEX.search(header)
+    if bkg_match:
+        record.background = [value for value in (_to_float(t) for t in bkg_match.group(1).split()) if value is not None]
+
+    for name, (start, end) in spans.items():
+        section = content[start:end]
+        structure = StructureRecord(name=name, span=(start, end))
+        structure.crystallite_size = parse_crystallite_size(section)
+        structure.percentage_weight = parse_percentage_weight(section)
+        scale_match = SCALE_REGEX.search(section)
+        structure.scale = _to_float(scale_match.group(1)) if scale_match else None
+        r_bragg_match = R_BRAGG_REGEX.search(section)
+        structure.r_bragg = float(r_bragg_match.group(1)) if r_bragg_match else None
+        for parameter, value in LATTICE_REGEX.findall(section):
+            if parameter not in structure.lattice and _to_float(value) is not None:
+                structure.lattice[parameter] = _to_float(value)
+        record.structures[name] = structure
+    return record
+
+
+def apply_output_record(content, record):
+    """
+    Put the refined values of an OutputFileRecord back into the .inp content it was refined
+    from: the values parse_output_content reads (zero error, background, and the scale,
+    crystallite size and lattice parameters of every structure) replace the starting ones.
+    """
+    # (start, end) -> value; the parsers may read one number twice (e.g. '@' before the scale)
+    edits = {}
+
+    def replace(match, group, value, offset=0):
+        if match is not None and value is not None:
+            # Positional notation, the parsers do not read exponents
+            edits[(offset + match.start(group), offset + match.end(group))] = format(Decimal(repr(float(value))), 'f')
+
+    spans = index_structure_sections(content)
+    header_end = min((start for start, _ in spans.values()), default=len(content))
+    header = content[:header_end]
+    replace(ZERO_ERROR_REGEX.search(header), 1, record.zero_error)
+    bkg_match = BKG_REGEX.search(header)
+    if bkg_match:
+        tokens = [token for token in re.finditer(r'\S+', bkg_match.group(1)) if _to_float(token.group()) is not None]
+        for token, value in zip(tokens, record.background):
+            replace(token, 0, value, bkg_match.start(1))
+
+    for name, (start, end) in spans.items():
+        structure = record.structure(name)
+        if structure is None:
+            continue
+        section = content[start:end]
+        replace(CRYSTALLITE_SIZE_REGEX.search(section), 1, structure.crystallite_size, start)
+        replace(SCALE_REGEX.search(section), 1, structure.scale, start)
+        seen = set()
+        for match in LATTICE_REGEX.finditer(section):
+            if match.group(1) not in seen:
+                seen.add(match.group(1))
+                replace(match, 2, structure.lattice.get(match.group(1)), start)
+
+    # Back to front, so that the spans still to replace do not move
+    for (start, end), value in sorted(edits.items(), reverse=True):
+        content = content[:start] + value + content[end:]
+    return content
+
+
+def parse_output_file(file_path):
+    """Read and parse a TOPAS .out file. Returns None if the file does not exist."""
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r') as f:
+        return parse_output_content(f.read(), file_path)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,737 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from file_handling import parse_config
+from workspace import create_workspace, remove_workspace, collect_workspaces, keep_workspaces
+from results_store import (
+    reading, save_node_output, load_node_output, save_checkpoint, load_checkpoint, NodeOutputCache
+)
+from topas_runner import RunControl, RunCancelled, ensure_process_budget, process_budget_settings
+from tasks import CrystalliteSizeTask, StartTask, RWPAdditionTask, RWPRemovalTask, RWPTask, RWPMissingTask
+
+from condition_tasks import ListLengthGreaterTask, ListLengthLessTask, RWPGradientTask, ContainsTask, NumberOfRunsGreaterTask, NumberOfRunsLessTask, FinishedTask
+
+
+class FlowchartEngine:
+    """
+    Executes an analysis flowchart for one sample without any GUI.
+
+    The engine is driven by MainGUI as well as by the batch command line, and stores
+    every node output in the results.db of the analysis.
+
+    Progress is reported through optional callbacks:
+        on_node_started(run_id, node_id, iteration)
+        on_node_finished(run_id, node_id, iteration, output_data)
+        on_refinement(run_id, node_id, input_file, record, done, total, eta_seconds)
+    """
+
+    def __init__(self, flowchart, selected_file, output_directory, results_directory, db_conn, logger=None,
+                 run_control=None, refinement_archive=None):
+        self.flowchart = flowchart
+        self.selected_file = selected_file
+        self.output_directory = output_directory
+        self.results_directory = results_directory
+        self.db_conn = db_conn  # SQLite connection for results
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.run_control = run_control or RunControl()
+        # Replays resolve refinements from a previous run instead of running tc.exe, see replay.py
+        self.refinement_archive = refinement_archive
+        self.on_node_started = None
+        self.on_node_finished = None
+        self.on_refinement = None
+
+        self.config = parse_config(os.path.join(os.getcwd(), 'config.txt'))
+        # Independent branches of the flowchart run at the same time, up to this many nodes
+        try:
+            self.max_parallel_nodes = max(1, int(self.config.get('max_parallel_nodes', 4)))
+        except ValueError:
+            self.max_parallel_nodes = 4
+        # Recent node outputs, so following a node does not read its output back from results.db
+        try:
+            self.output_cache = NodeOutputCache(int(self.config.get('node_output_cache_size', 256)))
+        except ValueError:
+            self.output_cache = NodeOutputCache()
+        self.iterations = {}  # (run_id, node_id) -> last iteration handed out
+        self.completed_iterations = {}  # (run_id, node_id) -> last iteration whose output is saved
+        self.iterations_lock = threading.Lock()
+        # run_id under which the scheduler state is checkpointed after every node, see resume()
+        self.checkpoint_run_id = None
+
+        # Node and connection lookups, built once instead of scanning the flowchart on every hop
+        self.nodes_by_id = {}
+        self.outgoing = {}  # node_id -> connections leaving the node, in flowchart order
+        self.incoming = {}  # node_id -> connections entering the node, in flowchart order
+        self.build_index()
+
+        # Staging dictionary for partial dependencies
+        self.node_data_staging = {}  # (run_id, node_id) -> {'data':{}, 'received_deps':set(), 'expected_deps': int}
+
+        # Mapping of task types to their corresponding classes
+        self.task_classes = {
+            'Crystallite Size': CrystalliteSizeTask,
+            'Start': StartTask,
+            'RWP Addition': RWPAdditionTask,
+            'RWP Removal': RWPRemovalTask,
+            'RWP': RWPTask,
+            'RWP Missing': RWPMissingTask,
+            # Add new task types here
+        }
+
+        self.condition_classes = {
+            'List length (greater than equal to)': ListLengthGreaterTask,
+            'List length (less than equal to)': ListLengthLessTask,
+            'RWP gradient': RWPGradientTask,
+            'Contains': ContainsTask,
+            'Number of runs (greater than equal to)': NumberOfRunsGreaterTask,
+            'Number of runs (less than equal to)': NumberOfRunsLessTask,
+            'Finished': FinishedTask,
+            # Add new task types here
+        }
+
+    def build_index(self):
+        """(Re)build the node and adjacency maps, call again after editing the flowchart."""
+        self.nodes_by_id = {}
+        for node in self.flowchart.get('nodes', []):
+            # The first definition wins, as with the previous linear lookups
+            self.nodes_by_id.setdefault(node['id'], node)
+        self.outgoing = {}
+        self.incoming = {}
+        for conn in self.flowchart.get('connections', []):
+            self.outgoing.setdefault(conn['from'], []).append(conn)
+            self.incoming.setdefault(conn['to'], []).append(conn)
+
+    def get_node(self, node_id):
+        return self.nodes_by_id.get(node_id)
+
+    def cancel(self):
+        """Stop the analysis: no new node or refinement starts and running tc.exe processes are killed."""
+        self.logger.info("Cancelling analysis")
+        self.run_control.cancel()
+
+    @property
+    def cancelled(self):
+        return self.run_control.cancelled
+
+    def run(self, run_id='run_1'):
+        """Run the flowchart from its starting node. Returns False if there is no starting node."""
+        starting_node = self.get_starting_node()
+        if not starting_node:
+            self.logger.error("No starting node found in the flowchart.")
+            return False
+        # Concurrent nodes share one tc.exe budget. The GUI and the batch and sweep CLIs set
+        # it before every analysis; only a bare engine sizes it from config.txt here
+        ensure_process_budget(**process_budget_settings(self.config))
+        self.checkpoint_run_id = run_id
+        self.process_runs([{'run_id': run_id, 'node': starting_node, 'iteration': 1}])
+        return True
+
+    @classmethod
+    def from_checkpoint(cls, db_conn, results_directory, run_id='run_1', **kwargs):
+        """Build an engine for the flowchart and sample of a checkpointed run, or None if there is none."""
+        checkpoint = load_checkpoint(db_conn, run_id)
+        if checkpoint is None:
+            return None
+        state = checkpoint[1]
+        return cls(state['flowchart'], state['selected_file'], state['output_directory'], results_directory,
+                   db_conn, **kwargs)
+
+    def resume(self, run_id='run_1'):
+        """
+        Continue an interrupted or cancelled run from its last checkpoint.
+
+        Finished nodes are not run again; nodes that were running when the analysis
+        stopped start over, reusing the refinements they had already stored.
+        Returns False if the run has no checkpoint or already finished.
+        """
+        checkpoint = load_checkpoint(self.db_conn, run_id)
+        if checkpoint is None or checkpoint[0] == 'finished':
+            self.logger.error(f"No unfinished analysis to resume for {run_id}")
+            return False
+        state = checkpoint[1]
+
+        with self.iterations_lock:
+            self.completed_iterations = {(r, n): iteration for r, n, iteration in state['iterations']}
+            self.iterations = dict(self.completed_iterations)
+        self.node_data_staging = {
+            (entry['run_id'], entry['node_id']): {
+                'data': entry['data'],
+                'received_deps': set(entry['received_deps']),
+                'expected_deps': entry['expected_deps'],
+            }
+            for entry in state['staging']
+        }
+        processed_nodes = {tuple(key) for key in state['processed_nodes']}
+        runs = [run for run in map(self.restore_queued_run, state['pending']) if run is not None]
+        waiting_runs = [run for run in map(self.restore_queued_run, state['waiting']) if run is not None]
+        self.logger.info(f"Resuming {run_id} with {len(runs)} queued and {len(waiting_runs)} waiting nodes")
+
+        # Keep the budget the caller set, see run
+        ensure_process_budget(**process_budget_settings(self.config))
+        self.checkpoint_run_id = run_id
+        self.process_runs(runs, processed_nodes, waiting_runs)
+        return True
+
+    def restore_queued_run(self, entry):
+        node = self.get_node(entry['node_id'])
+        if node is None:
+            self.logger.error(f"Node {entry['node_id']} of the checkpoint is not in the flowchart")
+            return None
+        run = {key: value for key, value in entry.items() if key != 'node_id'}
+        run['node'] = dict(node)
+        return run
+
+    def checkpoint_state(self, pending, waiting_runs, processed_nodes):
+        """Everything process_runs needs to continue later, as JSON-serialisable data."""
+        def queued_run(run):
+            entry = {key: value for key, value in run.items() if key != 'node'}
+            entry['node_id'] = run['node']['id']
+            return entry
+
+        with self.iterations_lock:
+            iterations = [[r, n, iteration] for (r, n), iteration in self.completed_iterations.items()]
+        return {
+            'flowchart': self.flowchart,
+            'selected_file': self.selected_file,
+            'output_directory': self.output_directory,
+            'pending': [queued_run(run) for run in pending],
+            'waiting': [queued_run(run) for run in waiting_runs],
+            'processed_nodes': [list(key) for key in processed_nodes],
+            'staging': [
+                {'run_id': r, 'node_id': n, 'data': info['data'], 'received_deps': sorted(info['received_deps']),
+                 'expected_deps': info['expected_deps']}
+                for (r, n), info in self.node_data_staging.items()
+            ],
+            'iterations': iterations,
+        }
+
+    def save_checkpoint(self, status, pending, waiting_runs, processed_nodes):
+        if self.checkpoint_run_id is None:
+            return
+        save_checkpoint(self.db_conn, self.checkpoint_run_id, status,
+                        self.checkpoint_state(pending, waiting_runs, processed_nodes))
+
+    def get_starting_node(self):
+        # Assuming 'node_1' is the starting node
+        return self.get_node('node_1')
+
+    def dependencies_met(self, current_run, processed_nodes):
+        """Return (met, available_dependencies) for a queued node."""
+        run_id = current_run['run_id']
+        node = current_run['node']
+        incoming_params = node.get('incoming_params', {})
+        allow_partial_dependencies = node.get('allow_partial_dependencies', False)
+
+        dependencies_met = False
+        available_dependencies = []
+
+        if allow_partial_dependencies:
+            # Node can proceed if any dependency is met
+            for source_node_id in incoming_params.keys():
+                if (run_id, source_node_id) in processed_nodes:
+                    available_dependencies.append(source_node_id)
+            if available_dependencies:
+                dependencies_met = True
+        else:
+            # Node requires all dependencies to be met
+            dependencies_met = True
+            for source_node_id in incoming_params.keys():
+                if (run_id, source_node_id) not in processed_nodes:
+                    dependencies_met = False
+                    break
+        return dependencies_met, available_dependencies
+
+    def process_runs(self, runs, processed_nodes=None, waiting_runs=None):
+        """
+        Execute queued nodes until the flowchart is finished.
+
+        Nodes whose dependencies are met run concurrently, up to ``max_parallel_nodes``
+        at a time; all of their tc.exe processes share the global process budget.
+        Connections are followed on this thread as each node finishes, after which the
+        scheduler state is checkpointed to results.db.
+        """
+        run_queue = deque(runs)
+        completed_runs = set()
+        processed_nodes = set(processed_nodes or ())
+        waiting_runs = list(waiting_runs or ())
+        running = {}  # future -> queued run being executed
+        self.save_checkpoint('running', run_queue, waiting_runs, processed_nodes)
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_nodes) as executor:
+            while run_queue or waiting_runs or running:
+                if self.cancelled:
+                    if not running:
+                        self.logger.info("Analysis cancelled, not processing the remaining nodes.")
+                        break
+                elif not run_queue and not running:
+                    # Check waiting_runs for nodes that can now be processed
+                    for i, waiting_run in enumerate(waiting_runs):
+                        if self.dependencies_met(waiting_run, processed_nodes)[0]:
+                            run_queue.append(waiting_runs.pop(i))
+                            break
+                    else:
+                        self.logger.error("No nodes can be processed due to unmet dependencies.")
+                        break
+
+                # Start every ready node while there is room
+                while run_queue and len(running) < self.max_parallel_nodes and not self.cancelled:
+                    current_run = run_queue.popleft()
+                    run_id = current_run['run_id']
+                    node = current_run['node']
+                    node_id = node['id']
+                    task_type = node.get('task_type')
+                    parameters = node.get('parameters', {})
+                    incoming_params = node.get('incoming_params', {})
+                    allow_partial_dependencies = node.get('allow_partial_dependencies', False)
+
+                    unique_execution_id = f"{run_id}_{node_id}"
+                    self.logger.info(f"Processing {unique_execution_id}")
+
+                    # If we have merged_data (from try_queue_node), use it directly
+                    required_data = current_run.get('merged_data', None)
+
+                    if required_data is None:
+                        # Fall back to old logic if merged_data not provided
+                        dependencies_met, available_dependencies = self.dependencies_met(current_run, processed_nodes)
+                        if not dependencies_met:
+                            waiting_runs.append(current_run)
+                            continue
+
+                        # Prepare incoming_params_to_use based on partial dependencies
+                        if allow_partial_dependencies:
+                            incoming_params_to_use = {dep: incoming_params[dep] for dep in available_dependencies}
+                        else:
+                            incoming_params_to_use = incoming_params
+
+                        # Retrieve and merge data from upstream nodes if no merged_data was provided
+                        required_data = {}
+                        for source_node_id, data_keys in incoming_params_to_use.items():
+                            source_output = self.load_node_output(run_id, source_node_id, keys=data_keys)
+                            if source_output is not None:
+                                for data_key in data_keys:
+                                    if data_key in required_data:
+                                        existing = required_data[data_key]
+                                        new_val = source_output.get(data_key)
+                                        required_data[data_key] = self.merge_values(existing, new_val)
+                                    else:
+                                        required_data[data_key] = source_output.get(data_key)
+                            else:
+                                self.logger.error(f"Required data from node {source_node_id} not available for node {node_id}")
+                                return
+
+                    # Now run the task with required_data
+                    future = executor.submit(self.process_task, run_id, node_id, task_type, parameters, {}, node,
+                                             required_data=required_data)
+                    running[future] = current_run
+
+                if not running:
+                    continue
+
+                # Follow the connections of whichever node finishes first
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished_run = running.pop(future)
+                    run_id, node_id = finished_run['run_id'], finished_run['node']['id']
+                    try:
+                        future.result()
+                    except RunCancelled:
+                        self.logger.info(f"{run_id}_{node_id} was cancelled.")
+                        # Run it again on resume
+                        run_queue.appendleft(finished_run)
+                        continue
+                    processed_nodes.add((run_id, node_id))
+                    self.handle_outgoing_connections(run_id, node_id, processed_nodes, run_queue)
+                # Nodes still running start over on resume, ahead of the queue
+                self.save_checkpoint('running', list(running.values()) + list(run_queue), waiting_runs,
+                                     processed_nodes)
+
+                if not run_queue and not waiting_runs and not running:
+                    # If no next runs were added, and no outgoing connections were valid, finish the run
+                    completed_runs.add(run_id)
+
+        status = 'cancelled' if self.cancelled else 'finished'
+        if status == 'finished' and (run_queue or waiting_runs):
+            # Stopped on unmet dependencies, keep it resumable
+            status = 'running'
+        self.save_checkpoint(status, run_queue, waiting_runs, processed_nodes)
+        if status == 'finished' and self.checkpoint_run_id is not None and not self.keep_workspaces():
+            # Workspaces left behind by executions that crashed or were interrupted before a resume
+            collect_workspaces(self.results_directory, self.checkpoint_run_id)
+        self.logger.info(f"Node output cache stats: {self.output_cache.stats()}")
+
+    def keep_workspaces(self):
+        # Read when needed, like the tasks read their options from config.txt
+        return keep_workspaces(parse_config(os.path.join(os.getcwd(), 'config.txt')))
+
+    def merge_values(self, existing, new_val):
+        # If both are lists, extend them
+        if isinstance(existing, list) and isinstance(new_val, list):
+            existing.extend(new_val)
+            return existing
+        # If one is list and other not
+        if isinstance(existing, list) and not isinstance(new_val, list):
+            existing.append(new_val)
+            return existing
+        if not isinstance(existing, list) and isinstance(new_val, list):
+            return [existing] + new_val
+        # If neither are lists, put them both in a list
+        if not isinstance(existing, list) and not isinstance(new_val, list):
+            return [existing, new_val]
+
+    def handle_outgoing_connections(self, run_id, node_id, processed_nodes, run_queue):
+        for conn in self.outgoing.get(node_id, []):
+            condition = conn.get('condition')
+            condition_param = conn.get('condition_param')
+            to_node_id = conn['to']
+            logging.info(f"Processing connection from {node_id} to {to_node_id}")
+
+            # Get the target node
+            to_node = self.get_node(to_node_id)
+            if not to_node:
+                continue
+            logging.info(f"Found target node: {to_node_id}")
+            to_node_parameters = to_node.get('parameters', {})
+
+            # Check condition
+            if self.check_condition(
+                    condition=condition,
+                    condition_param=condition_param,
+                    run_id=run_id,
+                    from_node_id=node_id,
+                    to_node_id=to_node_id,
+                    parameters=to_node_parameters
+            ):
+                logging.info(f"Condition met for connection from {node_id} to {to_node_id}")
+                # Update downstream dependencies and try to queue node if ready
+                self.update_downstream_dependencies(run_id, to_node_id, node_id, run_queue)
+
+    def update_downstream_dependencies(self, run_id, to_node_id, from_node_id, run_queue):
+        self.logger.info(f"update_downstream_dependencies called for {to_node_id} with dep {from_node_id}")
+        try:
+            # Retrieve the node definition
+            to_node = self.get_node(to_node_id)
+            logging.info(f"Updating downstream dependencies for node: {to_node_id}")
+            if not to_node:
+                return
+
+            expected_deps = to_node.get('expected_deps', 0)
+            if expected_deps == 0:
+                # If no expected dependencies, we can potentially queue immediately
+                # But let's handle this in a separate method
+                self.try_queue_node(run_id, to_node_id, run_queue)
+                return
+
+            # Initialize staging entry if not present
+            staging_key = (run_id, to_node_id)
+            if staging_key not in self.node_data_staging:
+                self.node_data_staging[staging_key] = {
+                    'data': {},
+                    'received_deps': set(),
+                    'expected_deps': expected_deps
+                }
+
+            # Mark the from_node_id as a received dependency
+            self.node_data_staging[staging_key]['received_deps'].add(from_node_id)
+            self.try_queue_node(run_id, to_node_id, run_queue)
+        except Exception as e:
+            self.logger.error(f"Error in update_downstream_dependencies: {e}", exc_info=True)
+
+        # At this stage, we are only recording the arrival of a dependency.
+        # We will handle the data merging and final check in the next step.
+
+    def try_queue_node(self, run_id, to_node_id, run_queue):
+        self.logger.info(f"Attempting to queue node {to_node_id}")
+        try:
+            staging_key = (run_id, to_node_id)
+            self.logger.info(f"Attempting to queue node: {to_node_id} for run: {run_id}")
+            if staging_key not in self.node_data_staging:
+                # If we have no staging info, it might mean no deps required
+                self.logger.info("No staging info found, checking if node expects zero dependencies.")
+                to_node = self.get_node(to_node_id)
+                if to_node and to_node.get('expected_deps', 0) == 0:
+                    # No dependencies means we can directly queue
+                    self.logger.info(f"Node {to_node_id} has no dependencies, queueing directly.")
+                    to_node_copy = dict(to_node)
+                    run_queue.append({'run_id': run_id, 'node': to_node_copy})
+                return
+
+            staging_info = self.node_data_staging[staging_key]
+            expected_deps = staging_info['expected_deps']
+            received_count = len(staging_info['received_deps'])
+
+            self.logger.info(f"For node {to_node_id}: expected_deps={expected_deps}, received_count={received_count}")
+        except Exception as e:
+            self.logger.error(f"Error in try_queue_node: {e}", exc_info=True)
+            raise
+        # Check if all expected dependencies have been received
+        if received_count == expected_deps:
+            to_node = self.get_node(to_node_id)
+            if not to_node:
+                self.logger.error(f"No node definition found for {to_node_id}. Cannot queue.")
+                return
+
+            incoming_params = to_node.get('incoming_params', {})
+            merged_data = {}
+
+            # Merge data from all upstream dependencies
+            for from_node_id in staging_info['received_deps']:
+                self.logger.info(f"Merging data from dependency {from_node_id} for node {to_node_id}")
+                if from_node_id not in incoming_params:
+                    self.logger.warning(
+                        f"No incoming_params defined for dependency {from_node_id}. Skipping data merge.")
+                    continue
+
+                # Load the keys this node takes from from_node_id
+                data_keys = incoming_params[from_node_id]
+                source_output = self.load_node_output(run_id, from_node_id, keys=data_keys)
+                if source_output is None:
+                    self.logger.error(f"Source output for {from_node_id} is None. Cannot merge data.")
+                    return  # Early return or consider skipping this dependency
+
+                self.logger.info(f"Expected data keys from {from_node_id}: {data_keys}")
+                for data_key in data_keys:
+                    try:
+                        new_val = source_output.get(data_key)
+                        if data_key in merged_data:
+                            merged_data[data_key] = self.merge_values(merged_data[data_key], new_val)
+                        else:
+                            merged_data[data_key] = new_val
+                    except Exception as e:
+                        self.logger.error(f"Error merging data key '{data_key}' from {from_node_id}: {e}")
+                        return
+
+            to_node_copy = dict(to_node)
+            self.logger.info(f"All dependencies met for {to_node_id}. Queuing with merged data: {merged_data.keys()}")
+            run_queue.append({
+                'run_id': run_id,
+                'node': to_node_copy,
+                'merged_data': merged_data
+            })
+
+            # Once queued, remove from staging to avoid re-queuing in the future
+            del self.node_data_staging[staging_key]
+        else:
+            self.logger.info(f"Not all dependencies met for {to_node_id}. Waiting.")
+
+    def process_task(self, run_id, node_id, task_type, parameters, incoming_params, node, required_data=None):
+        # Get the task class
+        task_class = self.task_classes.get(task_type)
+        logging.info(f"Processing task: {task_type} for node {node_id}")
+        if not task_class:
+            self.logger.error(f"No task class found for task type: {task_type}")
+            return
+
+        iteration = self.next_iteration(run_id, node_id)
+
+        if required_data is None:
+            # If required_data not passed, run existing logic to get it if needed
+            required_data = {}
+            # In a scenario where all dependencies are required and we got here,
+            # we already handled merging in process_runs if partial dependencies are allowed.
+            # If partial dependencies are not allowed, just retrieve data as before.
+            for source_node_id, data_keys in incoming_params.items():
+                source_output = self.load_node_output(run_id, source_node_id, keys=data_keys)
+                if source_output is not None:
+                    for data_key in data_keys:
+                        if data_key in required_data:
+                            existing = required_data[data_key]
+                            new_val = source_output.get(data_key)
+                            required_data[data_key] = self.merge_values(existing, new_val)
+                        else:
+                            required_data[data_key] = source_output.get(data_key)
+                else:
+                    self.logger.error(f"Required data from node {source_node_id} not available for node {node_id}")
+                    return
+
+        # Add input file paths and other required data
+        required_data['input_file'] = self.selected_file
+        required_data['input_directory'] = os.path.dirname(self.selected_file)
+        required_data['output_directory'] = self.output_directory
+        required_data['run_id'] = run_id
+        required_data['iteration'] = iteration
+
+        logging.info(f"Required data for task: {required_data}")
+
+        # Give this execution its own scratch workspace so runs never share input/output folders
+        workspace_dir = create_workspace(self.results_directory, run_id, node_id, iteration)
+
+        # Instantiate and run the task
+        task = task_class(
+            node_id=node_id,
+            parameters=parameters,
+            data=required_data,
+            output_directory=self.output_directory,
+            db_conn=self.db_conn,
+            workspace_dir=workspace_dir,
+            run_control=self.run_control,
+            progress_callback=self.refinement_progress_callback(run_id, node_id),
+            refinement_archive=self.refinement_archive
+        )
+        if self.on_node_started is not None:
+            self.on_node_started(run_id, node_id, iteration)
+        try:
+            task.run()
+        finally:
+            if not self.keep_workspaces():
+                remove_workspace(workspace_dir)
+
+        # Add iteration count to output data
+        task.output_data['iteration'] = iteration
+
+        # Save the output data
+        self.save_node_output(run_id, node_id, iteration, task.output_data)
+        with self.iterations_lock:
+            key = (run_id, node_id)
+            self.completed_iterations[key] = max(iteration, self.completed_iterations.get(key, 0))
+        if self.on_node_finished is not None:
+            self.on_node_finished(run_id, node_id, iteration, task.output_data)
+
+    def refinement_progress_callback(self, run_id, node_id):
+        if self.on_refinement is None:
+            return None
+
+        def progress(input_file, record, done, total, eta_seconds):
+            self.on_refinement(run_id, node_id, input_file, record, done, total, eta_seconds)
+        return progress
+
+    def next_iteration(self, run_id, node_id):
+        """Reserve the next iteration of a node, so that concurrent executions never share one."""
+        with self.iterations_lock:
+            key = (run_id, node_id)
+            if key not in self.iterations:
+                # Determine the last iteration using the database
+                with reading(self.db_conn) as conn:
+                    row = conn.execute(
+                        "SELECT MAX(iteration) FROM results WHERE run_id=? AND node_id=?",
+                        (run_id, node_id),
+                    ).fetchone()
+                self.iterations[key] = row[0] if row and row[0] is not None else 0
+            self.iterations[key] += 1
+            return self.iterations[key]
+
+    def save_node_output(self, run_id, node_id, iteration, output_data):
+        save_node_output(self.db_conn, run_id, node_id, iteration, output_data)
+        self.output_cache.put(run_id, node_id, iteration, output_data)
+
+    def load_node_output(self, run_id, node_id, iteration=None, keys=None):
+        """Output of a node (latest iteration by default); with keys, only those keys are read."""
+        output_data = self.output_cache.get(run_id, node_id, iteration, keys)
+        if output_data is not None:
+            return output_data
+        try:
+            output_data = load_node_output(self.db_conn, run_id, node_id, iteration, keys)
+            if output_data is not None and keys is None and iteration is not None:
+                self.output_cache.put(run_id, node_id, iteration, output_data)
+        except (json.JSONDecodeError, sqlite3.Error) as e:
+            self.logger.error(f"Failed to load the output of node {node_id}: {e}")
+            return None
+        if output_data is None:
+            if iteration is None:
+                self.logger.error(f"No data found for node {node_id} in run {run_id}")
+            else:
+                self.logger.error(
+                    f"No data found for node {node_id} at iteration {iteration} in run {run_id}"
+                )
+        return output_data
+
+    def check_condition(self, condition, condition_param, run_id, from_node_id, to_node_id, parameters):
+        logging.info(f"Checking condition: {condition} with parameter: {condition_param}")
+
+        if not condition:
+            # No condition means always proceed
+            return True
+
+        # Initialize condition_class using self.condition_classes
+        condition_class = self.condition_classes.get(condition)
+
+        if not condition_class:
+            self.logger.error(f"No condition class found for condition type: {condition}")
+            return False  # Ensure a boolean is returned
+
+        # Get the output data from the source node, only the keys the condition reads
+        keys = None
+        if condition_class.data_keys is not None:
+            keys = ['iteration', *condition_class.data_keys]
+        from_node_output = self.load_node_output(run_id, from_node_id, keys=keys)
+        if from_node_output is None:
+            self.logger.error(f"Cannot check condition because data from node {from_node_id} is missing")
+            return False
+
+        # Get the iteration count
+        iteration = from_node_output.get('iteration', 0)
+
+        # Implement actual condition checking logic
+        self.logger.info(f"Checking condition: {condition} with parameter: {condition_param} at iteration {iteration}")
+
+        data = {key: value for key, value in from_node_output.items() if value is not None}
+        logging.info(f"Data dictionary: {data}")
+
+        self.logger.info(f"Condition class: {condition_class}")
+
+        try:
+            conditiontask = condition_class(
+                node_id=to_node_id,  # Pass 'to_node_id' here
+                parameters=parameters,
+                data=data,  # Pass the assembled data dictionary
+                output_directory=self.output_directory
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to instantiate condition class: {e}")
+            return False
+
+        try:
+            return conditiontask.run(condition_param, iteration)
+        except Exception as e:
+            self.logger.error(f"Condition check failed: {e}")
+            return False
+
+    def get_all_keys_from_run(self, run_id, node_id, iteration=None):
+        """
+        Retrieve all keys from a node's output data.
+
+        :param run_id: ID of the run
+        :param node_id: ID of the node
+        :param iteration: Iteration number (optional). If None, fetches the latest iteration.
+        :return: List of keys or empty list if data not found.
+        """
+        output_data = self.load_node_output(run_id, node_id, iteration)
+        if output_data is not None:
+            return list(output_data.keys())
+        else:
+            self.logger.error(f"Data not found for run {run_id}, node {node_id}, iteration {iteration}")
+            return []
+
+    # Additional method to retrieve specific information
+    def get_data_from_run(self, run_id, node_id, iteration, key_name):
+        """
+        Retrieve specific information from a run by providing run_id, node_id, iteration, and key_name.
+
+        :param run_id: ID of the run
+        :param node_id: ID of the node
+        :param iteration: Iteration number
+        :param key_name: Key name of the data to retrieve
+        :return: Value associated with key_name or None if not found
+        """
+        output_data = self.load_node_output(run_id, node_id, iteration, keys=[key_name])
+        if output_data is not None:
+            return output_data.get(key_name)
+        else:
+            self.logger.error(f"Data not found for run {run_id}, node {node_id}, iteration {iteration}")
+            return None
+
+    def final_output(self, run_id='run_1'):
+        """Return the most recently saved node output of a run, or None if nothing ran."""
+        with reading(self.db_conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT node_id, iteration FROM results WHERE run_id=? ORDER BY id DESC LIMIT 1",
+                (run_id,),
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        return self.load_node_output(run_id, row[0], row[1])
@@ -3,24 +3,20 @@
 import os
 import json
 import logging
-<<<<<<< HEAD
 import shutil
-import sqlite3
-=======
->>>>>>> parent of 7fddfdf (Merge branch 'main' of https://github.com/ItchyMichi/PyTOPAS)
 from collections import defaultdict
-from datetime import datetime
 from PyQt5.QtWidgets import (
     QWidget, QMainWindow, QFileDialog, QTreeWidget, QTreeWidgetItem,
-    QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QAction, QApplication, QMessageBox
+    QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QAction, QApplication, QMessageBox, QInputDialog, QSpinBox
 )
 from PyQt5.QtCore import Qt
 from template_editor import TemplateEditor
 from structure_template_editor import StructureTemplateEditor
 from structure_database_viewer import StructureDatabaseViewer
-from tasks import CrystalliteSizeTask, StartTask, RWPAdditionTask, RWPRemovalTask, RWPTask, RWPMissingTask
-
-from condition_tasks import ListLengthGreaterTask, ListLengthLessTask, RWPGradientTask, ContainsTask, NumberOfRunsGreaterTask, NumberOfRunsLessTask, FinishedTask
+from analysis_worker import AnalysisWorker
+from file_handling import parse_config
+from results_store import init_results_db, create_results_directory, load_checkpoint, unfinished_runs
+from topas_runner import set_process_budget, process_budget_settings
 
 class MainGUI(QMainWindow):
     def __init__(self):
@@ -32,32 +28,9 @@ class MainGUI(QMainWindow):
         self.selected_template = ''
         self.flowchart = None
         self.results_directory = ''  # Directory to store results
-        self.db_conn = None  # SQLite connection for results
-
-        # NEW: Staging dictionary for partial dependencies
-        self.node_data_staging = {}  # (run_id, node_id) -> {'data':{}, 'received_deps':set(), 'expected_deps': int}
-
-        # Mapping of task types to their corresponding classes
-        self.task_classes = {
-            'Crystallite Size': CrystalliteSizeTask,
-            'Start': StartTask,
-            'RWP Addition': RWPAdditionTask,
-            'RWP Removal': RWPRemovalTask,
-            'RWP': RWPTask,
-            'RWP Missing': RWPMissingTask,
-            # Add new task types here
-        }
-
-        self.condition_classes = {
-            'List length (greater than equal to)': ListLengthGreaterTask,
-            'List length (less than equal to)': ListLengthLessTask,
-            'RWP gradient': RWPGradientTask,
-            'Contains': ContainsTask,
-            'Number of runs (greater than equal to)': NumberOfRunsGreaterTask,
-            'Number of runs (less than equal to)': NumberOfRunsLessTask,
-            'Finished': FinishedTask,
-            # Add new task types here
-        }
+        self.worker = None  # Background thread running the current analysis
+        self.job_item = None  # Job queue entry of the current analysis
+        self.node_items = {}  # node_id -> job queue entry of that node
 
         # Initialize logger
         logging.basicConfig(level=logging.INFO)
@@ -137,6 +110,17 @@ class MainGUI(QMainWindow):
         template_layout.addWidget(select_template_btn)
         main_layout.addLayout(template_layout)
 
+        # Number of tc.exe processes all refinements share, 0 sizes it from the machine
+        processes_layout = QHBoxLayout()
+        processes_layout.addWidget(QLabel('Parallel TOPAS processes'))
+        self.max_processes_spin = QSpinBox()
+        self.max_processes_spin.setRange(0, 256)
+        self.max_processes_spin.setSpecialValueText('Auto')
+        self.max_processes_spin.setValue(self.process_budget_settings()['max_processes'] or 0)
+        self.max_processes_spin.valueChanged.connect(self.apply_process_budget)
+        processes_layout.addWidget(self.max_processes_spin)
+        main_layout.addLayout(processes_layout)
+
         # Job queue
         self.job_queue = QTreeWidget()
         self.job_queue.setHeaderLabels(['Job', 'Status'])
@@ -146,12 +130,16 @@ class MainGUI(QMainWindow):
         btn_layout = QHBoxLayout()
         start_analysis_btn = QPushButton('Start Analysis')
         start_analysis_btn.clicked.connect(self.start_analysis)
+        self.cancel_analysis_btn = QPushButton('Cancel Analysis')
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.setEnabled(False)
         clear_jobs_btn = QPushButton('Clear Job List')
         clear_jobs_btn.clicked.connect(self.clear_jobs)
         load_job_btn = QPushButton('Load Unfinished Job')
         load_job_btn.clicked.connect(self.load_job)
 
         btn_layout.addWidget(start_analysis_btn)
+        btn_layout.addWidget(self.cancel_analysis_btn)
         btn_layout.addWidget(clear_jobs_btn)
         btn_layout.addWidget(load_job_btn)
         main_layout.addLayout(btn_layout)
@@ -199,6 +187,9 @@ class MainGUI(QMainWindow):
             self.selected_template = template_path
 
     def start_analysis(self):
+        if self.worker is not None and self.worker.isRunning():
+            QMessageBox.warning(self, 'Analysis', 'An analysis is already running.')
+            return
         if self.selected_file and self.output_directory and self.selected_template:
             # Load the analysis template (flowchart)
             try:
@@ -211,526 +202,148 @@ class MainGUI(QMainWindow):
             # Prepare results directory
             self.prepare_results_directory()
 
-            # Start processing from the first node
-            starting_node = self.get_starting_node()
-            if starting_node:
-                self.process_runs([{'run_id': 'run_1', 'node': starting_node, 'iteration': 1}])
-                QMessageBox.information(self, 'Analysis', 'Analysis started.')
-            else:
-                QMessageBox.warning(self, 'Analysis', 'No starting node found in the flowchart.')
+            # Start processing from the first node on a background thread
+            self.start_worker(
+                f'{os.path.basename(self.selected_file)} ({os.path.basename(self.selected_template)})',
+                AnalysisWorker(
+                    self.flowchart, self.selected_file, self.output_directory, self.results_directory, parent=self
+                )
+            )
         else:
             QMessageBox.warning(self, 'Missing Information',
                                 'Please select file, output directory, and analysis template.')
 
+    def process_budget_settings(self):
+        return process_budget_settings(parse_config(os.path.join(os.getcwd(), 'config.txt')))
+
+    def apply_process_budget(self):
+        # Re-read config.txt at every analysis start; the spin box overrides its max_parallel_processes.
+        # Changes while an analysis runs apply to it straight away
+        settings = self.process_budget_settings()
+        settings['max_processes'] = self.max_processes_spin.value() or None
+        set_process_budget(**settings)
+
+    def start_worker(self, job_name, worker):
+        self.apply_process_budget()
+        self.job_item = QTreeWidgetItem([job_name, 'Running'])
+        self.job_queue.addTopLevelItem(self.job_item)
+        self.job_item.setExpanded(True)
+        self.node_items = {}
+
+        self.worker = worker
+        self.worker.node_started.connect(self.on_node_started)
+        self.worker.node_finished.connect(self.on_node_finished)
+        self.worker.refinement_finished.connect(self.on_refinement_finished)
+        self.worker.eta_changed.connect(self.on_eta_changed)
+        self.worker.analysis_failed.connect(self.on_analysis_failed)
+        self.worker.analysis_finished.connect(self.on_analysis_finished)
+        self.worker.start()
+        self.cancel_analysis_btn.setEnabled(True)
+
+    def cancel_analysis(self):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.cancel()
+            if self.job_item is not None:
+                self.job_item.setText(1, 'Cancelling')
+            self.cancel_analysis_btn.setEnabled(False)
+
+    def node_item(self, node_id):
+        item = self.node_items.get(node_id)
+        if item is None:
+            item = QTreeWidgetItem([node_id, ''])
+            self.job_item.addChild(item)
+            self.node_items[node_id] = item
+        return item
+
+    def on_node_started(self, run_id, node_id, iteration):
+        self.node_item(node_id).setText(1, f'Running (iteration {iteration})')
+        self.job_item.setText(1, f'Running {node_id}')
+
+    def on_node_finished(self, run_id, node_id, iteration):
+        self.node_item(node_id).setText(1, f'Finished (iteration {iteration})')
+
+    def on_refinement_finished(self, run_id, node_id, scenario, done, total):
+        self.node_item(node_id).setText(1, f'Refinements {done}/{total}')
+
+    def on_eta_changed(self, node_id, eta_seconds):
+        minutes, seconds = divmod(int(eta_seconds), 60)
+        self.job_item.setText(1, f'Running {node_id}, about {minutes}:{seconds:02d} left')
+
+    def on_analysis_failed(self, message):
+        QMessageBox.critical(self, 'Analysis', f'Analysis failed:\n{message}')
+
+    def on_analysis_finished(self, status):
+        if self.job_item is not None:
+            self.job_item.setText(1, status.capitalize())
+        self.cancel_analysis_btn.setEnabled(False)
+
+    def closeEvent(self, event):
+        # Do not leave tc.exe processes behind when the window is closed mid-analysis
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.cancel()
+            self.worker.wait()
+        super().closeEvent(event)
+
     def prepare_results_directory(self):
         # Create a unique results directory based on input file name and current time
-        input_filename = os.path.splitext(os.path.basename(self.selected_file))[0]
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        results_dir_name = f"{input_filename}_{timestamp}"
-        self.results_directory = os.path.join(os.getcwd(), 'results', results_dir_name)
-        os.makedirs(self.results_directory, exist_ok=True)
-
-        # Initialize SQLite database
-        db_path = os.path.join(self.results_directory, 'results.db')
-        self.db_conn = sqlite3.connect(db_path)
-        cursor = self.db_conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                run_id TEXT,
-                node_id TEXT,
-                iteration INTEGER,
-                result_data TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(run_id, node_id, iteration)
-            );
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS phase_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                result_id INTEGER NOT NULL,
-                phase_name TEXT NOT NULL,
-                weight_percent REAL NOT NULL,
-                cryst_size REAL NOT NULL,
-                FOREIGN KEY(result_id) REFERENCES results(id)
-            );
-            """
-        )
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_node ON results(node_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_run_node ON results(run_id, node_id);")
-        self.db_conn.commit()
-
-    def get_starting_node(self):
-        nodes = self.flowchart.get('nodes', [])
-        # Assuming 'node_1' is the starting node
-        starting_node = next((node for node in nodes if node['id'] == 'node_1'), None)
-        return starting_node
-
-    def process_runs(self, runs):
-        run_queue = runs
-        completed_runs = set()
-        processed_nodes = set()
-        waiting_runs = []
-
-        while run_queue or waiting_runs:
-            if run_queue:
-                current_run = run_queue.pop(0)
-            else:
-                # Check waiting_runs for nodes that can now be processed
-                current_run = None
-                for i, waiting_run in enumerate(waiting_runs):
-                    run_id = waiting_run['run_id']
-                    node = waiting_run['node']
-                    node_id = node['id']
-                    incoming_params = node.get('incoming_params', {})
-                    allow_partial_dependencies = node.get('allow_partial_dependencies', False)
-
-                    dependencies_met = False
-                    available_dependencies = []
-
-                    if allow_partial_dependencies:
-                        # Node can proceed if any dependency is met
-                        for source_node_id in incoming_params.keys():
-                            if (run_id, source_node_id) in processed_nodes:
-                                available_dependencies.append(source_node_id)
-                        if available_dependencies:
-                            dependencies_met = True
-                    else:
-                        # Node requires all dependencies to be met
-                        dependencies_met = True
-                        for source_node_id in incoming_params.keys():
-                            if (run_id, source_node_id) not in processed_nodes:
-                                dependencies_met = False
-                                break
-
-                    if dependencies_met:
-                        current_run = waiting_runs.pop(i)
-                        break
-
-                if current_run is None:
-                    self.logger.error("No nodes can be processed due to unmet dependencies.")
-                    break
-
-            run_id = current_run['run_id']
-            node = current_run['node']
-            node_id = node['id']
-            task_type = node.get('task_type')
-            parameters = node.get('parameters', {})
-            incoming_params = node.get('incoming_params', {})
-            allow_partial_dependencies = node.get('allow_partial_dependencies', False)
-
-            unique_execution_id = f"{run_id}_{node_id}"
-            self.logger.info(f"Processing {unique_execution_id}")
-
-            # If we have merged_data (from try_queue_node), use it directly
-            required_data = current_run.get('merged_data', None)
-
-            if required_data is None:
-                # Fall back to old logic if merged_data not provided
-                dependencies_met = False
-                available_dependencies = []
-
-                if allow_partial_dependencies:
-                    # Node can proceed if any dependency is met
-                    for source_node_id in incoming_params.keys():
-                        if (run_id, source_node_id) in processed_nodes:
-                            available_dependencies.append(source_node_id)
-                    if available_dependencies:
-                        dependencies_met = True
-                else:
-                    # Node requires all dependencies to be met
-                    dependencies_met = True
-                    for source_node_id in incoming_params.keys():
-                        if (run_id, source_node_id) not in processed_nodes:
-                            dependencies_met = False
-                            break
-
-                if not dependencies_met:
-                    waiting_runs.append(current_run)
-                    continue
-
-                # Prepare incoming_params_to_use based on partial dependencies
-                if allow_partial_dependencies:
-                    incoming_params_to_use = {dep: incoming_params[dep] for dep in available_dependencies}
-                else:
-                    incoming_params_to_use = incoming_params
-
-                # Retrieve and merge data from upstream nodes if no merged_data was provided
-                required_data = {}
-                for source_node_id, data_keys in incoming_params_to_use.items():
-                    source_output = self.load_node_output(run_id, source_node_id)
-                    if source_output:
-                        for data_key in data_keys:
-                            if data_key in required_data:
-                                existing = required_data[data_key]
-                                new_val = source_output.get(data_key)
-                                required_data[data_key] = self.merge_values(existing, new_val)
-                            else:
-                                required_data[data_key] = source_output.get(data_key)
-                    else:
-                        self.logger.error(f"Required data from node {source_node_id} not available for node {node_id}")
-                        return
-
-            # Now run the task with required_data
-            self.process_task(run_id, node_id, task_type, parameters, {}, node, required_data=required_data)
-            processed_nodes.add((run_id, node_id))
-            self.handle_outgoing_connections(run_id, node_id, processed_nodes, run_queue)
-
-            if not run_queue and not waiting_runs:
-                # If no next runs were added, and no outgoing connections were valid, finish the run
-                completed_runs.add(run_id)
-
-    def merge_values(self, existing, new_val):
-        # If both are lists, extend them
-        if isinstance(existing, list) and isinstance(new_val, list):
-            existing.extend(new_val)
-            return existing
-        # If one is list and other not
-        if isinstance(existing, list) and not isinstance(new_val, list):
-            existing.append(new_val)
-            return existing
-        if not isinstance(existing, list) and isinstance(new_val, list):
-            return [existing] + new_val
-        # If neither are lists, put them both in a list
-        if not isinstance(existing, list) and not isinstance(new_val, list):
-            return [existing, new_val]
-
-    def handle_outgoing_connections(self, run_id, node_id, processed_nodes, run_queue):
-        # Get outgoing connections
-        outgoing_connections = [
-            conn for conn in self.flowchart.get('connections', [])
-            if conn['from'] == node_id
-        ]
-
-        for conn in outgoing_connections:
-            condition = conn.get('condition')
-            condition_param = conn.get('condition_param')
-            to_node_id = conn['to']
-            logging.info(f"Processing connection from {node_id} to {to_node_id}")
-
-            # Get the target node
-            to_node = next((n for n in self.flowchart.get('nodes', []) if n['id'] == to_node_id), None)
-            if not to_node:
-                continue
-            logging.info(f"Found target node: {to_node_id}")
-            to_node_parameters = to_node.get('parameters', {})
-
-            # Check condition
-            if self.check_condition(
-                    condition=condition,
-                    condition_param=condition_param,
-                    run_id=run_id,
-                    from_node_id=node_id,
-                    to_node_id=to_node_id,
-                    parameters=to_node_parameters
-            ):
-                logging.info(f"Condition met for connection from {node_id} to {to_node_id}")
-                # Update downstream dependencies and try to queue node if ready
-                self.update_downstream_dependencies(run_id, to_node_id, node_id, run_queue)
-
-    def update_downstream_dependencies(self, run_id, to_node_id, from_node_id, run_queue):
-        self.logger.info(f"update_downstream_dependencies called for {to_node_id} with dep {from_node_id}")
-        try:
-            # Retrieve the node definition
-            to_node = next((n for n in self.flowchart.get('nodes', []) if n['id'] == to_node_id), None)
-            logging.info(f"Updating downstream dependencies for node: {to_node_id}")
-            if not to_node:
-                return
-
-            expected_deps = to_node.get('expected_deps', 0)
-            if expected_deps == 0:
-                # If no expected dependencies, we can potentially queue immediately
-                # But let's handle this in a separate method
-                self.try_queue_node(run_id, to_node_id, run_queue)
-                return
+        self.results_directory = create_results_directory(os.path.join(os.getcwd(), 'results'), self.selected_file)
 
-            # Initialize staging entry if not present
-            staging_key = (run_id, to_node_id)
-            if staging_key not in self.node_data_staging:
-                self.node_data_staging[staging_key] = {
-                    'data': {},
-                    'received_deps': set(),
-                    'expected_deps': expected_deps
-                }
-
-            # Mark the from_node_id as a received dependency
-            self.node_data_staging[staging_key]['received_deps'].add(from_node_id)
-            self.try_queue_node(run_id, to_node_id, run_queue)
-        except Exception as e:
-            self.logger.error(f"Error in update_downstream_dependencies: {e}", exc_info=True)
-
-        # At this stage, we are only recording the arrival of a dependency.
-        # We will handle the data merging and final check in the next step.
-
-    def try_queue_node(self, run_id, to_node_id, run_queue):
-        self.logger.info(f"Attempting to queue node {to_node_id}")
-        try:
-            staging_key = (run_id, to_node_id)
-            self.logger.info(f"Attempting to queue node: {to_node_id} for run: {run_id}")
-            if staging_key not in self.node_data_staging:
-                # If we have no staging info, it might mean no deps required
-                self.logger.info("No staging info found, checking if node expects zero dependencies.")
-                to_node = next((n for n in self.flowchart.get('nodes', []) if n['id'] == to_node_id), None)
-                if to_node and to_node.get('expected_deps', 0) == 0:
-                    # No dependencies means we can directly queue
-                    self.logger.info(f"Node {to_node_id} has no dependencies, queueing directly.")
-                    to_node_copy = dict(to_node)
-                    run_queue.append({'run_id': run_id, 'node': to_node_copy})
-                return
-
-            staging_info = self.node_data_staging[staging_key]
-            expected_deps = staging_info['expected_deps']
-            received_count = len(staging_info['received_deps'])
-
-            self.logger.info(f"For node {to_node_id}: expected_deps={expected_deps}, received_count={received_count}")
-        except Exception as e:
-            self.logger.error(f"Error in try_queue_node: {e}", exc_info=True)
-            raise
-        # Check if all expected dependencies have been received
-        if received_count == expected_deps:
-            to_node = next((n for n in self.flowchart.get('nodes', []) if n['id'] == to_node_id), None)
-            if not to_node:
-                self.logger.error(f"No node definition found for {to_node_id}. Cannot queue.")
-                return
+        # Create the results database; the analysis worker opens its own connection to it
+        init_results_db(os.path.join(self.results_directory, 'results.db')).close()
 
-            incoming_params = to_node.get('incoming_params', {})
-            merged_data = {}
-
-            # Merge data from all upstream dependencies
-            for from_node_id in staging_info['received_deps']:
-                self.logger.info(f"Merging data from dependency {from_node_id} for node {to_node_id}")
-                if from_node_id not in incoming_params:
-                    self.logger.warning(
-                        f"No incoming_params defined for dependency {from_node_id}. Skipping data merge.")
-                    continue
-
-                # Load output of the from_node_id
-                source_output = self.load_node_output(run_id, from_node_id)
-                if source_output is None:
-                    self.logger.error(f"Source output for {from_node_id} is None. Cannot merge data.")
-                    return  # Early return or consider skipping this dependency
-
-                data_keys = incoming_params[from_node_id]
-                self.logger.info(f"Expected data keys from {from_node_id}: {data_keys}")
-                for data_key in data_keys:
-                    try:
-                        new_val = source_output.get(data_key)
-                        if data_key in merged_data:
-                            merged_data[data_key] = self.merge_values(merged_data[data_key], new_val)
-                        else:
-                            merged_data[data_key] = new_val
-                    except Exception as e:
-                        self.logger.error(f"Error merging data key '{data_key}' from {from_node_id}: {e}")
-                        return
-
-            to_node_copy = dict(to_node)
-            self.logger.info(f"All dependencies met for {to_node_id}. Queuing with merged data: {merged_data.keys()}")
-            run_queue.append({
-                'run_id': run_id,
-                'node': to_node_copy,
-                'merged_data': merged_data
-            })
-
-            # Once queued, remove from staging to avoid re-queuing in the future
-            del self.node_data_staging[staging_key]
+    def clear_jobs(self):
+        if self.worker is not None and self.worker.isRunning():
+            # Keep the entry of the analysis that is still running
+            for index in reversed(range(self.job_queue.topLevelItemCount())):
+                if self.job_queue.topLevelItem(index) is not self.job_item:
+                    self.job_queue.takeTopLevelItem(index)
         else:
-            self.logger.info(f"Not all dependencies met for {to_node_id}. Waiting.")
-
-    def process_task(self, run_id, node_id, task_type, parameters, incoming_params, node, required_data=None):
-        # Get the task class
-        task_class = self.task_classes.get(task_type)
-        logging.info(f"Processing task: {task_type} for node {node_id}")
-        if not task_class:
-            self.logger.error(f"No task class found for task type: {task_type}")
-            return
-
-        # Determine the next iteration using the database
-        cursor = self.db_conn.cursor()
-        cursor.execute(
-            "SELECT MAX(iteration) FROM results WHERE run_id=? AND node_id=?",
-            (run_id, node_id),
-        )
-        row = cursor.fetchone()
-        last_iter = row[0] if row and row[0] is not None else 0
-        iteration = last_iter + 1
-
-        if required_data is None:
-            # If required_data not passed, run existing logic to get it if needed
-            required_data = {}
-            # In a scenario where all dependencies are required and we got here,
-            # we already handled merging in process_runs if partial dependencies are allowed.
-            # If partial dependencies are not allowed, just retrieve data as before.
-            for source_node_id, data_keys in incoming_params.items():
-                source_output = self.load_node_output(run_id, source_node_id)
-                if source_output:
-                    for data_key in data_keys:
-                        if data_key in required_data:
-                            existing = required_data[data_key]
-                            new_val = source_output.get(data_key)
-                            required_data[data_key] = self.merge_values(existing, new_val)
-                        else:
-                            required_data[data_key] = source_output.get(data_key)
-                else:
-                    self.logger.error(f"Required data from node {source_node_id} not available for node {node_id}")
-                    return
-
-        # Add input file paths and other required data
-        required_data['input_file'] = self.selected_file
-        required_data['input_directory'] = os.path.dirname(self.selected_file)
-        required_data['output_directory'] = self.output_directory
-        required_data['iteration'] = iteration
-
-        logging.info(f"Required data for task: {required_data}")
-
-        # Instantiate and run the task
-        task = task_class(
-            node_id=node_id,
-            parameters=parameters,
-            data=required_data,
-            output_directory=self.output_directory,
-            db_conn=self.db_conn
-        )
-        task.run()
-
-        # Add iteration count to output data
-        task.output_data['iteration'] = iteration
+            self.job_queue.clear()
+            self.job_item = None
+            self.node_items = {}
 
-        # Save the output data
-        self.save_node_output(run_id, node_id, iteration, task.output_data)
-
-    def save_node_output(self, run_id, node_id, iteration, output_data):
-        cursor = self.db_conn.cursor()
-        output_json = json.dumps(output_data)
-        cursor.execute(
-            "INSERT INTO results (run_id, node_id, iteration, result_data) VALUES (?, ?, ?, ?);",
-            (run_id, node_id, iteration, output_json),
+    def load_job(self):
+        # Resume an interrupted or cancelled analysis from the checkpoint in its results.db
+        if self.worker is not None and self.worker.isRunning():
+            QMessageBox.warning(self, 'Analysis', 'An analysis is already running.')
+            return
+        results_directory = QFileDialog.getExistingDirectory(
+            self, 'Select Results Directory of the Unfinished Job', os.path.join(os.getcwd(), 'results')
         )
-        result_id = cursor.lastrowid
-
-        phases = output_data.get('phases')
-        if phases is None:
-            phases = output_data.get('results')
-
-        if isinstance(phases, dict):
-            for name, vals in phases.items():
-                if not isinstance(vals, dict):
-                    continue
-                weight = vals.get('percentage_weight') or vals.get('weight_percent')
-                size = vals.get('crystallite_size') or vals.get('cryst_size')
-                if weight is None or size is None:
-                    continue
-                cursor.execute(
-                    "INSERT INTO phase_results (result_id, phase_name, weight_percent, cryst_size) VALUES (?, ?, ?, ?);",
-                    (result_id, name, weight, size),
-                )
-
-        self.db_conn.commit()
-
-    def load_node_output(self, run_id, node_id, iteration=None):
-        cursor = self.db_conn.cursor()
-        if iteration is None:
-            cursor.execute(
-                "SELECT result_data, iteration FROM results WHERE run_id=? AND node_id=? ORDER BY iteration DESC LIMIT 1",
-                (run_id, node_id),
-            )
-        else:
-            cursor.execute(
-                "SELECT result_data FROM results WHERE run_id=? AND node_id=? AND iteration=?",
-                (run_id, node_id, iteration),
-            )
-
-        row = cursor.fetchone()
-        if not row:
-            if iteration is None:
-                self.logger.error(f"No data found for node {node_id} in run {run_id}")
-            else:
-                self.logger.error(
-                    f"No data found for node {node_id} at iteration {iteration} in run {run_id}"
-                )
-            return None
-
-        result_json = row[0]
-        try:
-            output_data = json.loads(result_json)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Failed to parse result JSON for node {node_id}: {e}")
-            return None
-        return output_data
-
-    def check_condition(self, condition, condition_param, run_id, from_node_id, to_node_id, parameters):
-        logging.info(f"Checking condition: {condition} with parameter: {condition_param}")
-
-        if not condition:
-            # No condition means always proceed
-            return True
-
-        # Get the output data from the source node
-        from_node_output = self.load_node_output(run_id, from_node_id)
-        if from_node_output is None:
-            self.logger.error(f"Cannot check condition because data from node {from_node_id} is missing")
-            return False
-
-        # Get the iteration count
-        iteration = from_node_output.get('iteration', 0)
-
-        # Implement actual condition checking logic
-        self.logger.info(f"Checking condition: {condition} with parameter: {condition_param} at iteration {iteration}")
-
-        # Retrieve all keys from the source node
-        keys = self.get_all_keys_from_run(run_id, from_node_id, iteration)
-        logging.info(f"Keys found in node {from_node_id} for run {run_id}: {keys}")
-        if not keys:
-            self.logger.error(f"No keys found in node {from_node_id} for run {run_id}")
-            return False
-
-        # Initialize the data dictionary
-        data = {}
-
-        # Iterate over each key and fetch its value
-        for key in keys:
-            value = self.get_data_from_run(run_id, from_node_id, iteration, key)
-            if value is not None:
-                data[key] = value
-            else:
-                self.logger.warning(f"Key '{key}' not found in node {from_node_id} output.")
-
-        logging.info(f"Data dictionary: {data}")
-
-        # Initialize condition_class using self.condition_classes
-        condition_class = self.condition_classes.get(condition)
-
-        if not condition_class:
-            self.logger.error(f"No condition class found for condition type: {condition}")
-            return False  # Ensure a boolean is returned
-
-        self.logger.info(f"Condition class: {condition_class}")
+        if not results_directory:
+            return
+        db_path = os.path.join(results_directory, 'results.db')
+        if not os.path.isfile(db_path):
+            QMessageBox.warning(self, 'Load Job', f'No results.db found in {results_directory}.')
+            return
 
+        db_conn = init_results_db(db_path)
         try:
-            conditiontask = condition_class(
-                node_id=to_node_id,  # Pass 'to_node_id' here
-                parameters=parameters,
-                data=data,  # Pass the assembled data dictionary
-                output_directory=self.output_directory
+            run_ids = unfinished_runs(db_conn)
+            if not run_ids:
+                QMessageBox.information(self, 'Load Job', 'This analysis has no unfinished runs.')
+                return
+            run_id = run_ids[0]
+            if len(run_ids) > 1:
+                run_id, ok = QInputDialog.getItem(self, 'Load Job', 'Run to resume:', run_ids, 0, False)
+                if not ok:
+                    return
+            state = load_checkpoint(db_conn, run_id)[1]
+        finally:
+            db_conn.close()
+
+        self.results_directory = results_directory
+        self.selected_file = state['selected_file']
+        self.output_directory = state['output_directory']
+        self.flowchart = state['flowchart']
+        self.file_label.setText(os.path.basename(self.selected_file))
+        self.start_worker(
+            f'{os.path.basename(self.selected_file)} ({run_id}, resumed)',
+            AnalysisWorker(
+                self.flowchart, self.selected_file, self.output_directory, self.results_directory, run_id=run_id,
+                resume=True, parent=self
             )
-        except Exception as e:
-            self.logger.error(f"Failed to instantiate condition class: {e}")
-            return False
-
-        try:
-            return conditiontask.run(condition_param, iteration)
-        except Exception as e:
-            self.logger.error(f"Condition check failed: {e}")
-            return False
-
-    def clear_jobs(self):
-        self.job_queue.clear()
-
-    def load_job(self):
-        # Placeholder for loading an unfinished job
-        QMessageBox.information(self, 'Load Job', 'Function to load an unfinished job.')
+        )
 
     def new_analysis(self):
         # Placeholder for creating a new analysis
@@ -739,37 +352,3 @@ class MainGUI(QMainWindow):
     def open_template_editor(self):
         self.template_editor = TemplateEditor(self)
         self.template_editor.show()
-
-    def get_all_keys_from_run(self, run_id, node_id, iteration=None):
-        """
-        Retrieve all keys from a node's output data.
-
-        :param run_id: ID of the run
-        :param node_id: ID of the node
-        :param iteration: Iteration number (optional). If None, fetches the latest iteration.
-        :return: List of keys or empty list if data not found.
-        """
-        output_data = self.load_node_output(run_id, node_id, iteration)
-        if output_data is not None:
-            return list(output_data.keys())
-        else:
-            self.logger.error(f"Data not found for run {run_id}, node {node_id}, iteration {iteration}")
-            return []
-
-    # Additional method to retrieve specific information
-    def get_data_from_run(self, run_id, node_id, iteration, key_name):
-        """
-        Retrieve specific information from a run by providing run_id, node_id, iteration, and key_name.
-
-        :param run_id: ID of the run
-        :param node_id: ID of the node
-        :param iteration: Iteration number
-        :param key_name: Key name of the data to retrieve
-        :return: Value associated with key_name or None if not found
-        """
-        output_data = self.load_node_output(run_id, node_id, iteration)
-        if output_data is not None:
-            return output_data.get(key_name)
-        else:
-            self.logger.error(f"Data not found for run {run_id}, node {node_id}, iteration {iteration}")
-            return None
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import asynccontextmanager
+
+
+XDD_REGEX = re.compile(r'xdd\s+"([^"]+)"')
+INCLUDE_REGEX = re.compile(r'#include\s+"([^"]+)"')
+
+
+def topas_version_fingerprint(tc_executable, config=None):
+    """Return a string identifying the TOPAS installation used for refinements.
+
+    An explicit ``topas_version`` entry in config.txt wins. Otherwise the size and
+    modification time of tc.exe are used so that upgrading TOPAS invalidates the cache.
+    """
+    config = config or {}
+    if config.get('topas_version'):
+        return str(config['topas_version'])
+    try:
+        stat = os.stat(tc_executable)
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+    except OSError:
+        return 'unknown'
+
+
+class RefinementCache:
+    """
+    Persistent, content-addressed store of TOPAS .out files.
+
+    The key of a refinement is a hash of the generated .inp text, the bytes of every
+    raw/xdd and #include file it references and the TOPAS version. Entries are evicted least recently
+    used first once the total size of the cache exceeds ``max_size_bytes``.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, cache_dir, max_size_bytes=2 * 1024 ** 3, topas_version='unknown'):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.topas_version = topas_version
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._data_hashes = {}  # (path, size, mtime) -> sha256 of the file bytes
+        self._in_flight = {}  # key -> [lock held while it is refined, number of holders and waiters]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.out")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        # Drop entries whose files were removed behind our back
+        return {key: entry for key, entry in index.items() if os.path.exists(self._entry_path(key))}
+
+    def _save_index(self):
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _hash_data_file(self, path):
+        stat = os.stat(path)
+        stamp = (path, stat.st_size, stat.st_mtime)
+        digest = self._data_hashes.get(stamp)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self._data_hashes[stamp] = digest
+        return digest
+
+    def key_for(self, input_file):
+        """Compute the cache key of a generated .inp file."""
+        with open(input_file, 'r') as f:
+            content = f.read()
+        return self.key_for_content(content, os.path.dirname(input_file))
+
+    def key_for_content(self, content, base_dir=''):
+        sha = hashlib.sha256()
+        sha.update(self.topas_version.encode('utf-8'))
+        sha.update(b'\0')
+        sha.update(content.encode('utf-8'))
+        for data_file in XDD_REGEX.findall(content) + INCLUDE_REGEX.findall(content):
+            data_path = data_file if os.path.isabs(data_file) else os.path.join(base_dir, data_file)
+            sha.update(b'\0')
+            if os.path.exists(data_path):
+                sha.update(self._hash_data_file(data_path).encode('ascii'))
+            else:
+                sha.update(b'missing:' + data_file.encode('utf-8'))
+        return sha.hexdigest()
+
+    @asynccontextmanager
+    async def claim(self, key):
+        """
+        Hold ``key`` while it is refined. Concurrent refinements of the same input, e.g.
+        by the runs of a parameter sweep, wait for the first one and can then restore
+        its result instead of starting another tc.exe. Refinements run on the shared
+        event loop, so waiting takes no thread.
+        """
+        with self.lock:
+            entry = self._in_flight.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._in_flight[key]
+
+    def restore(self, key, destination):
+        """Copy a cached .out file to ``destination``. Returns True on a hit."""
+        with self.lock:
+            entry = self.index.get(key)
+            cached_path = self._entry_path(key)
+            if entry is None or not os.path.exists(cached_path):
+                self.index.pop(key, None)
+                self.misses += 1
+                return False
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(cached_path, destination)
+            entry['last_used'] = time.time()
+            self.hits += 1
+            self._save_index()
+        self.logger.info(f"Restored cached refinement {key[:12]} to {destination}")
+        return True
+
+    def store(self, key, out_file):
+        """Add a freshly refined .out file to the cache and evict old entries if needed."""
+        if not os.path.exists(out_file):
+            return
+        with self.lock:
+            cached_path = self._entry_path(key)
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            tmp_path = cached_path + '.tmp'
+            shutil.copyfile(out_file, tmp_path)
+            os.replace(tmp_path, cached_path)
+            self.index[key] = {'size': os.path.getsize(cached_path), 'last_used': time.time()}
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        total_size = sum(entry['size'] for entry in self.index.values())
+        if total_size <= self.max_size_bytes:
+            return
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+            total_size -= entry['size']
+            del self.index[key]
+            self.logger.info(f"Evicted cached refinement {key[:12]}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.index),
+                'size_bytes': sum(entry['size'] for entry in self.index.values()),
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_refinement_cache(cache_dir, max_size_bytes, topas_version):
+    """Return the process-wide cache for ``cache_dir``, creating it on first use."""
+    key = (os.path.abspath(cache_dir), topas_version)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = RefinementCache(cache_dir, max_size_bytes=max_size_bytes, topas_version=topas_version)
+            _caches[key] = cache
+        cache.max_size_bytes = max_size_bytes
+        return cache
+
+
+def refinement_cache_from_config(config, root_dir, tc_executable):
+    """Build the refinement cache described by config.txt, or None when it is disabled."""
+    if str(config.get('refinement_cache', 'true')).strip().lower() not in ('true', '1', 'yes'):
+        return None
+    cache_dir = config.get('refinement_cache_dir', 'refinement_cache')
+    if not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(root_dir, cache_dir)
+    try:
+        max_size_bytes = int(float(config.get('refinement_cache_max_mb', 2048)) * 1024 * 1024)
+    except ValueError:
+        max_size_bytes = 2048 * 1024 * 1024
+    return get_refinement_cache(cache_dir, max_size_bytes, topas_version_fingerprint(tc_executable, config))
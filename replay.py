@@ -0,0 +1,257 @@
+"""
+Offline what-if replay of exclusion and condition parameters.
+
+The flowchart of an analysis is executed again against the refinements stored in the
+results.db of a previous run: every scenario a task would refine is looked up by the
+structures it contains instead of being run through tc.exe, so only the exclusion and
+condition logic runs. Scenarios that were never refined are flagged.
+
+Parameters are given as name=value1,value2,... and every combination is replayed:
+    min_weight=0.1,0.2          every node that has a min_weight parameter
+    node_3:confidence=0.7,0.8   one node
+    node_3->node_4=5,7          the condition parameter of one connection
+
+Example:
+    python replay.py "results/Sample_20250101_120000" "test 23" --param min_weight=0.1,0.2 --param node_3:confidence=0.7,0.8
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from batch_cli import resolve_template
+from file_handling import OutputFileRecord
+from flowchart_engine import FlowchartEngine
+from results_store import init_results_db, load_node_output
+from tasks import remove_suffix
+
+
+def structure_key(structures):
+    """Identify a refinement by the structures it contains, with or without the .str extension."""
+    return frozenset(remove_suffix(os.path.basename(structure), '.str') for structure in structures)
+
+
+class RefinementArchive:
+    """
+    Refinements stored in a results.db, looked up by the set of structures refined.
+
+    A refinement of the same node is preferred, since nodes can use different start.inp
+    headers; otherwise any refinement of the same structures is used. The most recent
+    refinement wins.
+    """
+
+    def __init__(self, db_conn, run_id=None):
+        self.by_node = {}        # (node_id, structure key) -> OutputFileRecord
+        self.by_structures = {}  # structure key -> OutputFileRecord
+        query = "SELECT node_id, structures, record FROM refinements"
+        arguments = ()
+        if run_id is not None:
+            query += " WHERE run_id=?"
+            arguments = (run_id,)
+        for node_id, structures, record in db_conn.execute(query + " ORDER BY id", arguments):
+            record = OutputFileRecord.from_dict(json.loads(record))
+            key = structure_key(json.loads(structures))
+            self.by_node[(node_id, key)] = record
+            self.by_structures[key] = record
+
+    @classmethod
+    def from_results(cls, results_directory, run_id=None):
+        db_path = os.path.join(results_directory, 'results.db')
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError(f"No results.db in {results_directory}")
+        db_conn = sqlite3.connect(db_path)
+        try:
+            return cls(db_conn, run_id)
+        finally:
+            db_conn.close()
+
+    def __len__(self):
+        return len(self.by_structures)
+
+    def lookup(self, node_id, iteration, scenario, structures):
+        """Return the stored OutputFileRecord for a scenario, or None if it was never refined."""
+        key = structure_key(structures)
+        record = self.by_node.get((node_id, key))
+        if record is None:
+            record = self.by_structures.get(key)
+        return record
+
+
+class ReplaySession:
+    """One replay's view of an archive, remembering the scenarios it could not resolve."""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.missing = []
+        self.lock = threading.Lock()
+
+    def lookup(self, node_id, iteration, scenario, structures):
+        record = self.archive.lookup(node_id, iteration, scenario, structures)
+        if record is None:
+            with self.lock:
+                self.missing.append({'node_id': node_id, 'iteration': iteration, 'scenario': scenario,
+                                     'structures': list(structures)})
+        return record
+
+
+def recorded_final_structures(results_directory, run_id='run_1'):
+    """structures_list of the last node output of the original run."""
+    db_conn = sqlite3.connect(os.path.join(results_directory, 'results.db'))
+    try:
+        row = db_conn.execute(
+            "SELECT node_id, iteration FROM results WHERE run_id=? ORDER BY id DESC LIMIT 1", (run_id,)
+        ).fetchone()
+        if not row:
+            return []
+        output_data = load_node_output(db_conn, run_id, row[0], row[1], keys=['structures_list'])
+    finally:
+        db_conn.close()
+    return (output_data or {}).get('structures_list') or []
+
+
+def parse_parameter(text):
+    """'name=v1,v2' -> ('name', ['v1', 'v2'])"""
+    name, separator, values = text.partition('=')
+    if not separator or not name.strip():
+        raise ValueError(f"Expected name=value1,value2,... but got {text}")
+    return name.strip(), [value.strip() for value in values.split(',')]
+
+
+def parameter_grid(parameters):
+    """Every combination of {name: [values]} as a list of {name: value}."""
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+
+def apply_parameters(flowchart, parameter_set):
+    """Return a copy of the flowchart with the parameters of one grid point filled in."""
+    flowchart = copy.deepcopy(flowchart)
+    for name, value in parameter_set.items():
+        if '->' in name:
+            source, target = (part.strip() for part in name.split('->', 1))
+            targets = [conn for conn in flowchart.get('connections', [])
+                       if conn.get('from') == source and conn.get('to') == target]
+            for conn in targets:
+                conn['condition_param'] = value
+        elif ':' in name:
+            node_id, key = (part.strip() for part in name.split(':', 1))
+            targets = [node for node in flowchart.get('nodes', []) if node.get('id') == node_id]
+            for node in targets:
+                node.setdefault('parameters', {})[key] = value
+        else:
+            targets = [node for node in flowchart.get('nodes', []) if name in node.get('parameters', {})]
+            for node in targets:
+                node['parameters'][name] = value
+        if not targets:
+            raise ValueError(f"Parameter {name} does not match any node or connection of the flowchart")
+    return flowchart
+
+
+def replay(flowchart, archive, parameter_set, selected_file='', run_id='run_1', max_node_runs=500, logger=None):
+    """
+    Run the flowchart with one parameter set against the archive and return its summary.
+
+    Node outputs go to a throw-away in-memory database. Replays whose flowchart keeps
+    looping (e.g. because refinements are missing) are stopped after max_node_runs nodes.
+    """
+    started = time.time()
+    session = ReplaySession(archive)
+    summary = {'parameters': parameter_set, 'status': 'failed', 'node_runs': 0, 'final_structures': [],
+               'missing_refinements': session.missing, 'error': ''}
+    with tempfile.TemporaryDirectory(prefix='replay_') as scratch_dir:
+        db_conn = init_results_db(':memory:')
+        try:
+            engine = FlowchartEngine(apply_parameters(flowchart, parameter_set), selected_file, scratch_dir,
+                                     scratch_dir, db_conn, logger=logger, refinement_archive=session)
+
+            def on_node_started(run_id, node_id, iteration):
+                summary['node_runs'] += 1
+                if summary['node_runs'] > max_node_runs:
+                    engine.cancel()
+
+            engine.on_node_started = on_node_started
+            if not engine.run(run_id):
+                raise RuntimeError("No starting node found in the flowchart.")
+            final_output = engine.final_output(run_id) or {}
+            summary['final_structures'] = final_output.get('structures_list') or []
+            summary['status'] = 'stopped' if engine.cancelled else 'finished'
+        except Exception as e:
+            (logger or logging).error(f"Replay of {parameter_set} failed: {e}")
+            summary['error'] = str(e)
+        finally:
+            db_conn.close()
+    summary['elapsed_s'] = round(time.time() - started, 2)
+    return summary
+
+
+def compare_structures(recorded, replayed):
+    """(added, removed) structures of a replay relative to the recorded run."""
+    recorded_names = {remove_suffix(name, '.str') for name in recorded}
+    replayed_names = {remove_suffix(name, '.str') for name in replayed}
+    return sorted(replayed_names - recorded_names), sorted(recorded_names - replayed_names)
+
+
+def print_report(recorded, summaries):
+    print(f"Recorded final structures: {', '.join(recorded) or '-'}")
+    for summary in summaries:
+        added, removed = compare_structures(recorded, summary['final_structures'])
+        parameters = ', '.join(f"{name}={value}" for name, value in summary['parameters'].items()) or 'as recorded'
+        print(f"\n[{summary['status']}] {parameters} ({summary['node_runs']} nodes, {summary['elapsed_s']} s)")
+        print(f"  final structures: {', '.join(summary['final_structures']) or '-'}")
+        if summary['status'] == 'finished':
+            print(f"  added: {', '.join(added) or '-'}   removed: {', '.join(removed) or '-'}")
+        if summary['missing_refinements']:
+            print(f"  {len(summary['missing_refinements'])} scenarios were never refined, the result is incomplete:")
+            for missing in summary['missing_refinements']:
+                print(f"    {missing['node_id']} iteration {missing['iteration']}: {missing['scenario']} "
+                      f"({len(missing['structures'])} structures)")
+        if summary['error']:
+            print(f"  error: {summary['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay exclusion and condition parameters on stored refinements.')
+    parser.add_argument('results_directory', help='Results directory of the analysis (holding results.db)')
+    parser.add_argument('template', help='Analysis template path or name in analysis_templates/')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2',
+                        help='Parameter values to replay, may be repeated; see the module docstring')
+    parser.add_argument('--run-id', default='run_1', help='Run whose refinements and final result are replayed')
+    parser.add_argument('--sample', default='', help='Raw file of the analysis, only used to fill in start.inp')
+    parser.add_argument('--max-node-runs', type=int, default=500,
+                        help='Stop a replay after this many node executions')
+    parser.add_argument('--output', help='Write the replay summaries to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='Log every node and exclusion decision')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    with open(resolve_template(args.template), 'r') as f:
+        flowchart = json.load(f)
+
+    archive = RefinementArchive.from_results(args.results_directory, args.run_id)
+    print(f"Loaded {len(archive)} stored refinements from {args.results_directory}")
+
+    parameters = dict(parse_parameter(text) for text in args.param)
+    summaries = [
+        replay(flowchart, archive, parameter_set, args.sample, args.run_id, args.max_node_runs)
+        for parameter_set in parameter_grid(parameters)
+    ]
+
+    print_report(recorded_final_structures(args.results_directory, args.run_id), summaries)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\nSummaries written to {args.output}")
+    return 0 if all(summary['status'] == 'finished' for summary in summaries) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,608 @@
+import os
+import copy
+import json
+import math
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+# Read connections kept open per results.db
+READ_POOL_SIZE = 4
+
+
+class ConnectionPool:
+    """
+    Read-only connections to one results.db, each used by one thread at a time.
+
+    With WAL journaling readers do not block each other or the writer, so queries of
+    parallel tasks no longer queue up behind the lock of the shared write connection.
+    Connections are opened on demand, up to ``size``; further readers wait for one.
+    """
+
+    def __init__(self, db_path, size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON;")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                conn = None
+                if len(self.opened) < self.size:
+                    conn = self._connect()
+                    self.opened.append(conn)
+            if conn is None:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        with self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+            self.idle = queue.LifoQueue()
+
+
+class ResultsConnection(sqlite3.Connection):
+    """SQLite connection that can be shared by the threads of one analysis, one statement batch at a time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+        self.pool = None  # ConnectionPool for queries, see reading()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        super().close()
+
+
+def connection_lock(db_conn):
+    """Return the lock serialising access to ``db_conn`` (a no-op for plain connections)."""
+    lock = getattr(db_conn, 'lock', None)
+    return lock if lock is not None else nullcontext()
+
+
+@contextmanager
+def reading(db_conn):
+    """Connection to query results.db on: a pooled reader if there is one, else ``db_conn`` under its lock."""
+    pool = getattr(db_conn, 'pool', None)
+    if pool is None:
+        with connection_lock(db_conn):
+            yield db_conn
+    else:
+        with pool.connection() as conn:
+            yield conn
+
+
+@contextmanager
+def transaction(db_conn):
+    """
+    Run a group of writes on ``db_conn`` as one transaction: committed once at the end,
+    rolled back if anything fails. Transactions do not nest.
+    """
+    with connection_lock(db_conn):
+        try:
+            yield db_conn
+        except BaseException:
+            db_conn.rollback()
+            raise
+        db_conn.commit()
+
+
+def create_node_output_tables(cursor, parent_table='results'):
+    """
+    Create the tables holding node outputs, one row per value, and their phases; rows
+    belong to a row of ``parent_table``. results.result_data only holds outputs of older
+    analyses.
+    """
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS phase_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            result_id INTEGER NOT NULL,
+            phase_name TEXT NOT NULL,
+            weight_percent REAL NOT NULL,
+            cryst_size REAL NOT NULL,
+            FOREIGN KEY(result_id) REFERENCES {parent_table}(id)
+        );
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS node_lists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            result_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            FOREIGN KEY(result_id) REFERENCES {parent_table}(id)
+        );
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS node_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            result_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            structure TEXT NOT NULL,
+            metric TEXT,
+            value REAL,
+            data TEXT,
+            FOREIGN KEY(result_id) REFERENCES {parent_table}(id)
+        );
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS node_scalars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            result_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value,
+            FOREIGN KEY(result_id) REFERENCES {parent_table}(id)
+        );
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_phase_results_result ON phase_results(result_id);")
+    for table in ('node_lists', 'node_metrics', 'node_scalars'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_result_key ON {table}(result_id, key);")
+
+
+def init_results_db(db_path, read_pool_size=READ_POOL_SIZE):
+    """Open (and create if needed) the results.db of an analysis."""
+    # Nodes of one analysis run on several threads; writes are guarded by connection_lock
+    db_conn = sqlite3.connect(db_path, factory=ResultsConnection, check_same_thread=False)
+    if db_path != ':memory:':
+        # Readers run alongside the writer, and a commit no longer waits for the disk
+        # twice; a power cut can lose the last commits but never corrupts the database
+        db_conn.execute("PRAGMA journal_mode=WAL;")
+        db_conn.execute("PRAGMA synchronous=NORMAL;")
+    cursor = db_conn.cursor()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT,
+            node_id TEXT,
+            iteration INTEGER,
+            result_data TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(run_id, node_id, iteration)
+        );
+        """
+    )
+    create_node_output_tables(cursor)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS refinements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT,
+            node_id TEXT,
+            iteration INTEGER,
+            scenario TEXT,
+            rwp REAL,
+            structures TEXT,
+            record TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sweep_runs (
+            run_id TEXT PRIMARY KEY,
+            template TEXT,
+            parameters TEXT,
+            status TEXT,
+            final_structures TEXT,
+            elapsed_s REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            run_id TEXT PRIMARY KEY,
+            status TEXT,
+            state TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_node ON results(node_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_run_node ON results(run_id, node_id);")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_refinements_run_node ON refinements(run_id, node_id, iteration);"
+    )
+    db_conn.commit()
+    if db_path != ':memory:' and read_pool_size > 0:
+        db_conn.pool = ConnectionPool(db_path, read_pool_size)
+    return db_conn
+
+
+def create_results_directory(results_root, selected_file):
+    """
+    Create a unique results directory based on input file name and current time.
+
+    Files with the same name started within the same second (e.g. from different folders
+    by parallel batch workers) get a numbered suffix instead of sharing a directory.
+    """
+    input_filename = os.path.splitext(os.path.basename(selected_file))[0]
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base_directory = os.path.join(results_root, f"{input_filename}_{timestamp}")
+    os.makedirs(results_root, exist_ok=True)
+    results_directory = base_directory
+    suffix = 1
+    while True:
+        try:
+            # Creating the directory claims the name, so concurrent callers never share one
+            os.mkdir(results_directory)
+            return results_directory
+        except FileExistsError:
+            suffix += 1
+            results_directory = f"{base_directory}_{suffix}"
+
+
+def phase_rows(output_data):
+    """(phase_name, weight_percent, cryst_size) of every phase of a node output that has both values."""
+    phases = output_data.get('phases')
+    if phases is None:
+        phases = output_data.get('results')
+    if not isinstance(phases, dict):
+        return []
+
+    rows = []
+    for name, vals in phases.items():
+        if not isinstance(vals, dict):
+            continue
+        weight = vals.get('percentage_weight') or vals.get('weight_percent')
+        size = vals.get('crystallite_size') or vals.get('cryst_size')
+        if weight is None or size is None:
+            continue
+        rows.append((name, weight, size))
+    return rows
+
+
+def _scalar_row(value):
+    """
+    (kind, value) of a node output value stored in node_scalars; anything else is kept as JSON,
+    as are NaN and infinities, which SQLite reads back as NULL from a REAL column.
+    """
+    if value is None:
+        return 'null', None
+    if isinstance(value, bool):
+        return 'bool', int(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        return 'json', json.dumps(value)
+    if isinstance(value, (int, float, str)):
+        return type(value).__name__, value
+    return 'json', json.dumps(value)
+
+
+def _scalar_value(kind, value):
+    if kind == 'null':
+        return None
+    if kind == 'bool':
+        return bool(value)
+    if kind == 'json':
+        return json.loads(value)
+    return value
+
+
+def node_output_rows(output_data):
+    """
+    Split a node output into rows of node_lists, node_metrics and node_scalars.
+
+    Lists of names go to node_lists. Dicts keyed by structure (e.g. 'results') go to
+    node_metrics, one row per float value; other values (and NaN, which SQLite cannot
+    store as REAL) are kept there as JSON, as are entries that are not dicts. Everything else goes to node_scalars.
+    """
+    lists, metrics, scalars = [], [], []
+    for key, value in output_data.items():
+        if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+            lists.extend((key, position, item) for position, item in enumerate(value))
+        elif isinstance(value, dict) and value:
+            for structure, entry in value.items():
+                if not isinstance(entry, dict) or not entry:
+                    metrics.append((key, structure, None, None, json.dumps(entry)))
+                    continue
+                for metric, metric_value in entry.items():
+                    if isinstance(metric_value, float) and not math.isnan(metric_value):
+                        metrics.append((key, structure, metric, metric_value, None))
+                    else:
+                        metrics.append((key, structure, metric, None, json.dumps(metric_value)))
+        else:
+            scalars.append((key, *_scalar_row(value)))
+    return lists, metrics, scalars
+
+
+def save_node_output(db_conn, run_id, node_id, iteration, output_data):
+    """Store a node output and its phases in one transaction; returns the id of the results row."""
+    with transaction(db_conn):
+        cursor = db_conn.execute(
+            "INSERT INTO results (run_id, node_id, iteration) VALUES (?, ?, ?);",
+            (run_id, node_id, iteration),
+        )
+        result_id = cursor.lastrowid
+        insert_node_output_rows(db_conn, result_id, output_data)
+    return result_id
+
+
+def insert_node_output_rows(db_conn, result_id, output_data):
+    """Insert the typed rows and phases of one node output; the caller commits."""
+    lists, metrics, scalars = node_output_rows(output_data)
+    db_conn.executemany(
+        "INSERT INTO node_lists (result_id, key, position, value) VALUES (?, ?, ?, ?);",
+        [(result_id, *row) for row in lists],
+    )
+    db_conn.executemany(
+        "INSERT INTO node_metrics (result_id, key, structure, metric, value, data) VALUES (?, ?, ?, ?, ?, ?);",
+        [(result_id, *row) for row in metrics],
+    )
+    db_conn.executemany(
+        "INSERT INTO node_scalars (result_id, key, kind, value) VALUES (?, ?, ?, ?);",
+        [(result_id, *row) for row in scalars],
+    )
+    db_conn.executemany(
+        "INSERT INTO phase_results (result_id, phase_name, weight_percent, cryst_size) VALUES (?, ?, ?, ?);",
+        [(result_id, name, weight, size) for name, weight, size in phase_rows(output_data)],
+    )
+
+
+def _select_keys(conn, query, result_id, keys):
+    if keys is None:
+        return conn.execute(query + " ORDER BY id", (result_id,)).fetchall()
+    placeholders = ', '.join('?' * len(keys))
+    return conn.execute(query + f" AND key IN ({placeholders}) ORDER BY id", (result_id, *keys)).fetchall()
+
+
+def load_node_output(db_conn, run_id, node_id, iteration=None, keys=None):
+    """
+    Return the output of a node, its latest iteration by default, or None if it has none.
+
+    keys: only read these keys of the output (missing keys are left out), so callers
+    that need a few fields do not load every structure's metrics.
+    """
+    if keys is not None:
+        keys = list(keys)
+    with reading(db_conn) as conn:
+        if iteration is None:
+            row = conn.execute(
+                "SELECT id, result_data FROM results WHERE run_id=? AND node_id=? ORDER BY iteration DESC LIMIT 1",
+                (run_id, node_id),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT id, result_data FROM results WHERE run_id=? AND node_id=? AND iteration=?",
+                (run_id, node_id, iteration),
+            ).fetchone()
+        if not row:
+            return None
+        result_id, result_data = row
+        if result_data is not None:
+            # Stored as one JSON document by an older version
+            output_data = json.loads(result_data)
+            return output_data if keys is None else {key: output_data[key] for key in keys if key in output_data}
+        return read_node_output_rows(conn, result_id, keys)
+
+
+def read_node_output_rows(conn, result_id, keys=None):
+    """Reassemble the node output stored in typed rows under ``result_id``, optionally only some keys."""
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return {}
+    output_data = {}
+    for key, kind, value in _select_keys(
+            conn, "SELECT key, kind, value FROM node_scalars WHERE result_id=?", result_id, keys):
+        output_data[key] = _scalar_value(kind, value)
+    for key, value in _select_keys(
+            conn, "SELECT key, value FROM node_lists WHERE result_id=?", result_id, keys):
+        output_data.setdefault(key, []).append(value)
+    for key, structure, metric, value, data in _select_keys(
+            conn, "SELECT key, structure, metric, value, data FROM node_metrics WHERE result_id=?", result_id,
+            keys):
+        value = value if data is None else json.loads(data)
+        if metric is None:
+            output_data.setdefault(key, {})[structure] = value
+        else:
+            output_data.setdefault(key, {}).setdefault(structure, {})[metric] = value
+    return output_data
+
+
+class NodeOutputCache:
+    """
+    Bounded in-memory LRU cache of node outputs keyed by (run_id, node_id, iteration).
+
+    The engine fills it when it saves an output, so conditions and dependency merges
+    following a node read it back without going to results.db. Cached outputs are
+    copied on the way out so callers can modify what they get.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (run_id, node_id, iteration) -> output data
+        self.latest = {}  # (run_id, node_id) -> highest cached iteration
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, run_id, node_id, iteration, output_data):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            key = (run_id, node_id, iteration)
+            self.entries[key] = copy.deepcopy(output_data)
+            self.entries.move_to_end(key)
+            if iteration >= self.latest.get((run_id, node_id), iteration):
+                self.latest[(run_id, node_id)] = iteration
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, run_id, node_id, iteration=None, keys=None):
+        """Copy of a cached output (or of some of its keys), None on a miss."""
+        with self.lock:
+            if iteration is None:
+                iteration = self.latest.get((run_id, node_id))
+            output_data = self.entries.get((run_id, node_id, iteration))
+            if output_data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end((run_id, node_id, iteration))
+            if keys is not None:
+                output_data = {key: output_data[key] for key in keys if key in output_data}
+            return copy.deepcopy(output_data)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+            }
+
+
+def save_refinement_record(db_conn, run_id, node_id, iteration, scenario, record):
+    """Store the parsed OutputFileRecord of one refinement scenario (e.g. all_structures_Quartz)."""
+    with transaction(db_conn):
+        db_conn.execute(
+            "INSERT INTO refinements (run_id, node_id, iteration, scenario, rwp, structures, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?);",
+            (run_id, node_id, iteration, scenario, record.rwp,
+             json.dumps(record.structure_names()), json.dumps(record.to_dict())),
+        )
+
+
+def save_sweep_run(db_conn, run_id, template, parameters, status, final_structures=None, elapsed_s=None):
+    """Record which parameters a run of a parameter sweep used and how it ended."""
+    with transaction(db_conn):
+        db_conn.execute(
+            "INSERT OR REPLACE INTO sweep_runs (run_id, template, parameters, status, final_structures, elapsed_s) "
+            "VALUES (?, ?, ?, ?, ?, ?);",
+            (run_id, template, json.dumps(parameters), status, json.dumps(final_structures or []), elapsed_s),
+        )
+
+
+def save_checkpoint(db_conn, run_id, status, state):
+    """Store the scheduler state of a run ('running', 'cancelled' or 'finished')."""
+    with transaction(db_conn):
+        db_conn.execute(
+            "INSERT OR REPLACE INTO checkpoints (run_id, status, state, timestamp) "
+            "VALUES (?, ?, ?, CURRENT_TIMESTAMP);",
+            (run_id, status, json.dumps(state)),
+        )
+
+
+def load_checkpoint(db_conn, run_id):
+    """Return (status, state) of the last checkpoint of a run, or None if it has none."""
+    with reading(db_conn) as conn:
+        row = conn.execute("SELECT status, state FROM checkpoints WHERE run_id=?", (run_id,)).fetchone()
+    if not row:
+        return None
+    return row[0], json.loads(row[1])
+
+
+def unfinished_runs(db_conn):
+    """run_ids whose analysis was interrupted or cancelled, most recent first."""
+    with reading(db_conn) as conn:
+        rows = conn.execute(
+            "SELECT run_id FROM checkpoints WHERE status != 'finished' ORDER BY timestamp DESC"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _benchmark(nodes=500, phases=40, readers=4, queries=2000):
+    """Compare node output writes and parallel reads with and without WAL, batching and the read pool."""
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    output_data = {'phases': {f'Phase_{i}': {'percentage_weight': 1.0 + i, 'crystallite_size': 50.0 + i}
+                              for i in range(phases)}}
+
+    def save_row_by_row(db_conn, run_id, node_id, iteration, output_data):
+        # How nodes were stored before: one execute per phase, rollback journal, commit per node
+        cursor = db_conn.execute(
+            "INSERT INTO results (run_id, node_id, iteration, result_data) VALUES (?, ?, ?, ?);",
+            (run_id, node_id, iteration, json.dumps(output_data)),
+        )
+        result_id = cursor.lastrowid
+        for name, weight, size in phase_rows(output_data):
+            db_conn.execute(
+                "INSERT INTO phase_results (result_id, phase_name, weight_percent, cryst_size) VALUES (?, ?, ?, ?);",
+                (result_id, name, weight, size),
+            )
+        db_conn.commit()
+
+    def query(conn, iteration):
+        return conn.execute(
+            "SELECT phase_results.weight_percent FROM phase_results JOIN results ON results.id = phase_results.result_id "
+            "WHERE results.run_id=? AND results.node_id=? AND results.iteration=?",
+            ('run_1', 'node_1', iteration % nodes + 1),
+        ).fetchall()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for label, wal in (('row by row, rollback journal', False), ('executemany, WAL, read pool', True)):
+            db_path = os.path.join(scratch_dir, f'{wal}.db')
+            db_conn = init_results_db(db_path, read_pool_size=readers if wal else 0)
+            if not wal:
+                db_conn.execute("PRAGMA journal_mode=DELETE;")
+                db_conn.execute("PRAGMA synchronous=FULL;")
+            save = save_node_output if wal else save_row_by_row
+
+            started = time.perf_counter()
+            for iteration in range(1, nodes + 1):
+                with connection_lock(db_conn):
+                    save(db_conn, 'run_1', 'node_1', iteration, output_data)
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {nodes / elapsed:,.0f} nodes/s, {nodes * (phases + 1) / elapsed:,.0f} inserts/s")
+
+            def read(iteration):
+                with reading(db_conn) as conn:
+                    return query(conn, iteration)
+
+            def write():
+                for iteration in range(nodes + 1, 2 * nodes + 1):
+                    with connection_lock(db_conn):
+                        save(db_conn, 'run_1', 'node_1', iteration, output_data)
+
+            # Readers querying while a node keeps writing, as parallel tasks do
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=readers + 1) as executor:
+                writer = executor.submit(write)
+                list(executor.map(read, range(queries)))
+                writer.result()
+            elapsed = time.perf_counter() - started
+            print(f"{'':{len(label)}}  {queries / elapsed:,.0f} queries/s from {readers} threads during writes")
+            db_conn.close()
+
+
+if __name__ == '__main__':
+    _benchmark()
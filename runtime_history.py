@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from refinement_cache import XDD_REGEX, INCLUDE_REGEX
+
+
+START_X_REGEX = re.compile(r'\bstart_X\s+([-+]?\d+(?:\.\d*)?)')
+FINISH_X_REGEX = re.compile(r'\bfinish_X\s+([-+]?\d+(?:\.\d*)?)')
+MARKER_REGEX = re.compile(r'/\*.+?_START\*/')
+STR_REGEX = re.compile(r'^\s*str\b', re.MULTILINE)
+
+# What a refinement's runtime is predicted from
+FEATURES = ('structures', 'inp_kb', 'raw_kb', 'x_range')
+
+
+def _file_kb(path):
+    try:
+        return os.path.getsize(path) / 1024
+    except OSError:
+        return 0.0
+
+
+def refinement_features(input_file, structures=None):
+    """
+    Features of the refinement of an .inp file: number of structures, size of the input
+    (with its #include files), size of the raw data file and the refined 2-theta range
+    (0 when the file does not limit it).
+    """
+    with open(input_file, 'r', errors='replace') as f:
+        text = f.read()
+    base_dir = os.path.dirname(input_file)
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+    inp_kb = len(text) / 1024 + sum(_file_kb(resolve(path)) for path in INCLUDE_REGEX.findall(text))
+    raw_kb = sum(_file_kb(resolve(path)) for path in XDD_REGEX.findall(text))
+    if structures is None:
+        structures = len(MARKER_REGEX.findall(text)) or len(STR_REGEX.findall(text))
+    start_x = START_X_REGEX.search(text)
+    finish_x = FINISH_X_REGEX.search(text)
+    x_range = float(finish_x.group(1)) - float(start_x.group(1)) if start_x and finish_x else 0.0
+    return {'structures': structures, 'inp_kb': inp_kb, 'raw_kb': raw_kb, 'x_range': x_range}
+
+
+class RuntimeHistory:
+    """
+    Runtimes of past TOPAS refinements and a least-squares model predicting new ones.
+
+    The model is refit on the most recent ``MAX_SAMPLES`` runtimes every ``REFIT_EVERY``
+    new samples. Until ``MIN_SAMPLES`` runtimes are known, ``predict`` returns None.
+    """
+
+    MAX_SAMPLES = 500
+    MIN_SAMPLES = 10
+    REFIT_EVERY = 10
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.db_conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runtimes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                structures INTEGER,
+                inp_kb REAL,
+                raw_kb REAL,
+                x_range REAL,
+                seconds REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        self.db_conn.commit()
+        self.coefficients = None
+        self.floor = 0.0
+        self._unfitted = 0
+        self._fit()
+
+    def record(self, features, seconds):
+        """Remember how long a refinement with these features took."""
+        with self.lock:
+            self.db_conn.execute(
+                "INSERT INTO runtimes (structures, inp_kb, raw_kb, x_range, seconds) VALUES (?, ?, ?, ?, ?);",
+                (*(features[name] for name in FEATURES), seconds),
+            )
+            self.db_conn.commit()
+            self._unfitted += 1
+            refit = self.coefficients is None or self._unfitted >= self.REFIT_EVERY
+        if refit:
+            self._fit()
+
+    def _fit(self):
+        with self.lock:
+            rows = self.db_conn.execute(
+                f"SELECT {', '.join(FEATURES)}, seconds FROM runtimes ORDER BY id DESC LIMIT ?", (self.MAX_SAMPLES,)
+            ).fetchall()
+            self._unfitted = 0
+        if len(rows) < self.MIN_SAMPLES:
+            return
+        data = np.array(rows, dtype=float)
+        design = np.column_stack([np.ones(len(data)), data[:, :-1]])
+        coefficients, *_ = np.linalg.lstsq(design, data[:, -1], rcond=None)
+        with self.lock:
+            self.coefficients = coefficients
+            # Never predict less than the quickest refinement seen
+            self.floor = float(data[:, -1].min())
+
+    def predict(self, features):
+        """Predicted runtime in seconds, None while there is too little history."""
+        coefficients = self.coefficients
+        if coefficients is None:
+            return None
+        estimate = coefficients[0] + sum(c * features[name] for c, name in zip(coefficients[1:], FEATURES))
+        return max(float(estimate), self.floor)
+
+
+def relative_cost(features):
+    """Rough ordering key for refinements without history: bigger models on more data take longer."""
+    return max(features['structures'], 1) * max(features['inp_kb'] + features['raw_kb'], 1.0)
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def runtime_history_from_config(config, root_dir):
+    """Return the process-wide runtime history described by config.txt, or None when disabled."""
+    db_path = str(config.get('runtime_history', 'runtime_history.db')).strip()
+    if not db_path:
+        return None
+    if not os.path.isabs(db_path):
+        db_path = os.path.join(root_dir, db_path)
+    db_path = os.path.abspath(db_path)
+    with _histories_lock:
+        history = _histories.get(db_path)
+        if history is None:
+            history = RuntimeHistory(db_path)
+            _histories[db_path] = history
+        return history
@@ -0,0 +1,399 @@
+import numpy as np
+from scipy.stats import norm
+
+
+# One row per scored structure, NaN where a value is missing
+SCORE_DTYPE = np.dtype([('pw', 'f8'), ('rwp', 'f8'), ('cs', 'f8')])
+
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ScoreTable:
+    """Percentage weight, RWP and crystallite size of the structures taking part in a ranking."""
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values  # structured array of SCORE_DTYPE, aligned with names
+
+    @classmethod
+    def from_parsed_data(cls, parsed_data, structure_names):
+        """
+        Collect the scorable structures of ``parsed_data``, in ``structure_names`` order.
+
+        A structure is scored when it has a percentage weight and at least one of RWP
+        and crystallite size; all others are left out, as the criteria always did.
+        """
+        names = []
+        rows = []
+        for name in structure_names:
+            data = parsed_data.get(name)
+            if not isinstance(data, dict):
+                continue
+            pw = _number(data.get('percentage_weight'))
+            rwp = _number(data.get('RWP'))
+            cs = _number(data.get('crystallite_size'))
+            if pw is None or (rwp is None and cs is None):
+                continue
+            names.append(name)
+            rows.append((pw, np.nan if rwp is None else rwp, np.nan if cs is None else cs))
+        return cls(names, np.array(rows, dtype=SCORE_DTYPE))
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _location_scale(values, guarded):
+    """Mean and sample standard deviation; unguarded statistics are NaN when undefined."""
+    count = len(values)
+    undefined = 0.0 if guarded else np.nan
+    mean = values.mean() if count > 0 else undefined
+    std = values.std(ddof=1) if count > 1 else undefined
+    return mean, std
+
+
+def _z(values, mean, std):
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - mean) / std
+
+
+def combined_z_scores(table, separate_distributions=False, all_metrics=True, rwp_sign=-1.0):
+    """
+    Combined z-score of every structure in ``table``: the percentage weight z-score plus
+    the metric z-score. RWP scores ``rwp_sign`` times its z-score (lower RWP is better
+    by default) and crystallite size scores minus its absolute z-score.
+
+    separate_distributions: standardise RWP and crystallite size against their own
+        distributions (the 'Combined' criteria). Otherwise both are standardised against
+        the distribution of each structure's primary metric, RWP if it has one.
+    all_metrics: average the RWP and crystallite size scores of structures that have
+        both; otherwise only the primary metric counts. Always on for separate distributions.
+    """
+    pw = table.values['pw']
+    rwp = table.values['rwp']
+    cs = table.values['cs']
+    has_rwp = ~np.isnan(rwp)
+    has_cs = ~np.isnan(cs)
+
+    pw_z = _z(pw, *_location_scale(pw, separate_distributions))
+
+    if separate_distributions:
+        rwp_z = rwp_sign * _z(rwp, *_location_scale(rwp[has_rwp], True))
+        cs_z = -np.abs(_z(cs, *_location_scale(cs[has_cs], True)))
+        all_metrics = True
+    else:
+        primary_mean, primary_std = _location_scale(np.where(has_rwp, rwp, cs), False)
+        rwp_z = rwp_sign * _z(rwp, primary_mean, primary_std)
+        cs_z = -np.abs(_z(cs, primary_mean, primary_std))
+
+    metric_z = np.where(has_rwp, rwp_z, cs_z)
+    if all_metrics:
+        metric_z = np.where(has_rwp & has_cs, (rwp_z + cs_z) / 2.0, metric_z)
+    return pw_z + metric_z
+
+
+def combined_confidence(table, **options):
+    """norm.cdf of the combined z-scores, see combined_z_scores for the options."""
+    return norm.cdf(combined_z_scores(table, **options))
+
+
+def _spread_bounds(dist_lower, dist_upper):
+    """
+    Bounds (mean_lo, mean_hi, std_lo, std_hi) of the mean and sample standard deviation of
+    a distribution whose values lie in [dist_lower, dist_upper].
+    """
+    count = len(dist_lower)
+    with np.errstate(invalid='ignore', over='ignore'):
+        mean_lo = dist_lower.mean()
+        mean_hi = dist_upper.mean()
+        # The sum of squares is never below that of the known values around their own mean,
+        # and never above the sum of squares around any fixed point
+        known = dist_lower == dist_upper
+        ss_lo = ((dist_lower[known] - dist_lower[known].mean()) ** 2).sum() if known.sum() > 1 else 0.0
+        centre = (mean_lo + mean_hi) / 2.0
+        ss_hi = np.maximum((dist_lower - centre) ** 2, (dist_upper - centre) ** 2).sum()
+    std_hi = np.sqrt(ss_hi / (count - 1)) if not np.isnan(ss_hi) else np.inf
+    return mean_lo, mean_hi, np.sqrt(ss_lo / (count - 1)), std_hi
+
+
+def _ratio_bounds(num_lo, num_hi, std_lo, std_hi):
+    """Bounds of num / std for num in [num_lo, num_hi], std in [std_lo, std_hi]; _z scores 0 when std is 0."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lo = np.where(num_lo >= 0, num_lo / std_hi, num_lo / std_lo)
+        hi = np.where(num_hi >= 0, num_hi / std_lo, num_hi / std_hi)
+    lo = np.where(np.isnan(lo), -np.inf, lo)
+    hi = np.where(np.isnan(hi), np.inf, hi)
+    if std_lo == 0:
+        lo, hi = np.minimum(lo, 0.0), np.maximum(hi, 0.0)
+    return lo, hi
+
+
+def _z_bounds(lower, upper, spread, in_distribution):
+    """
+    Bounds of the z-scores of values in [lower, upper] against a distribution with the given
+    _spread_bounds. in_distribution marks the values that are part of the distribution,
+    whose z-scores never exceed Samuelson's (n - 1) / sqrt(n) for n values.
+    """
+    mean_lo, mean_hi, std_lo, std_hi, count = spread
+    if count < 2:
+        return np.full(len(lower), -np.inf), np.full(len(lower), np.inf)
+    z_lo, z_hi = _ratio_bounds(lower - mean_hi, upper - mean_lo, std_lo, std_hi)
+    limit = (count - 1) / np.sqrt(count)
+    return np.where(in_distribution, np.maximum(z_lo, -limit), z_lo), np.where(in_distribution, np.minimum(z_hi, limit), z_hi)
+
+
+class ScoreBounds:
+    """
+    Bounds of the combined_z_scores of structures whose values are only known to lie
+    between the values of two ScoreTables of the same structures (equal where a value is
+    known, NaN in both where it is missing).
+
+    Unknown values move the means and standard deviations every structure is standardised
+    against; the bounds hold for every way they can, but are not tight.
+    """
+
+    def __init__(self, lower, upper, separate_distributions=False, all_metrics=True, rwp_sign=-1.0):
+        self.names = lower.names
+        self.pw = (lower.values['pw'], upper.values['pw'])
+        self.rwp = (lower.values['rwp'], upper.values['rwp'])
+        cs = (lower.values['cs'], upper.values['cs'])
+        self.rwp_sign = rwp_sign
+        has_rwp = ~np.isnan(self.rwp[0])
+        has_cs = ~np.isnan(cs[0])
+
+        def spread(dist_lower, dist_upper):
+            if len(dist_lower) < 2:
+                return np.nan, np.nan, np.nan, np.nan, len(dist_lower)
+            return (*_spread_bounds(dist_lower, dist_upper), len(dist_lower))
+
+        self.pw_spread = spread(*self.pw)
+        if separate_distributions:
+            self.rwp_spread = spread(self.rwp[0][has_rwp], self.rwp[1][has_rwp])
+            cs_spread = spread(cs[0][has_cs], cs[1][has_cs])
+            cs_in_distribution = has_cs
+            all_metrics = True
+        else:
+            self.rwp_spread = cs_spread = spread(np.where(has_rwp, self.rwp[0], cs[0]),
+                                                 np.where(has_rwp, self.rwp[1], cs[1]))
+            cs_in_distribution = ~has_rwp
+
+        # Weight of the RWP and crystallite size scores in every structure's metric score
+        both = has_rwp & has_cs if all_metrics else np.zeros(len(self.names), dtype=bool)
+        self.rwp_weight = np.where(both, 0.5, np.where(has_rwp, 1.0, 0.0))
+        self.cs_weight = np.where(both, 0.5, np.where(has_rwp, 0.0, 1.0))
+
+        self.pw_z = _z_bounds(*self.pw, self.pw_spread, np.ones(len(self.names), dtype=bool))
+        rwp_z = _z_bounds(*self.rwp, self.rwp_spread, has_rwp)
+        self.rwp_z = (rwp_sign * rwp_z[0], rwp_sign * rwp_z[1]) if rwp_sign >= 0 else \
+            (rwp_sign * rwp_z[1], rwp_sign * rwp_z[0])
+        cs_z = _z_bounds(*cs, cs_spread, cs_in_distribution)
+        # Crystallite size scores -|z|
+        largest = np.maximum(np.abs(cs_z[0]), np.abs(cs_z[1]))
+        smallest = np.where((cs_z[0] <= 0) & (cs_z[1] >= 0), 0.0, np.minimum(np.abs(cs_z[0]), np.abs(cs_z[1])))
+        self.cs_z = (-largest, -smallest)
+
+    def _term(self, weight, bounds, end):
+        # A term with weight 0 does not count, whatever its (possibly infinite) bounds
+        with np.errstate(invalid='ignore'):
+            return np.where(weight > 0, weight * bounds[end], 0.0)
+
+    def z_scores(self):
+        """(lower, upper) bounds of every structure's combined z-score."""
+        return tuple(self.pw_z[end] + self._term(self.rwp_weight, self.rwp_z, end)
+                     + self._term(self.cs_weight, self.cs_z, end) for end in (0, 1))
+
+    def margins(self, worst):
+        """
+        Lower bounds of how much higher every structure scores than structure ``worst``.
+        Means cancel out of the difference of two percentage weight or RWP scores, which
+        makes these bounds tighter than the difference of the z_scores bounds.
+        """
+        def difference(values, spread, sign=1.0):
+            lower, upper = values
+            if sign >= 0:
+                num_lo, num_hi = sign * (lower - upper[worst]), sign * (upper - lower[worst])
+            else:
+                num_lo, num_hi = sign * (upper - lower[worst]), sign * (lower - upper[worst])
+            if spread[4] < 2:
+                return np.full(len(lower), -np.inf)
+            return _ratio_bounds(num_lo, num_hi, spread[2], spread[3])[0]
+
+        margin = difference(self.pw, self.pw_spread)
+        same_weight = self.rwp_weight == self.rwp_weight[worst]
+        with np.errstate(invalid='ignore'):
+            rwp_margin = np.where(
+                same_weight,
+                self.rwp_weight * difference(self.rwp, self.rwp_spread, self.rwp_sign),
+                self._term(self.rwp_weight, self.rwp_z, 0) - self._term(self.rwp_weight, self.rwp_z, 1)[worst])
+        margin = margin + np.where(same_weight & (self.rwp_weight == 0), 0.0, rwp_margin)
+        margin = margin + self._term(self.cs_weight, self.cs_z, 0) - self._term(self.cs_weight, self.cs_z, 1)[worst]
+        return margin
+
+
+# Combined z-scores outside this range have norm.cdf confidences that round to the same
+# value for nearby scores, so rankings there can come down to ties
+_SAFE_Z = (-30.0, 5.0)
+_SAFE_MARGIN = 1e-6
+
+
+def certain_lowest(lower, upper, **options):
+    """
+    Index of the structure that scores lowest with combined_confidence for every value
+    between the ScoreTables lower and upper (see ScoreBounds), None when that is uncertain.
+    """
+    if len(lower) < 2:
+        return None
+    bounds = ScoreBounds(lower, upper, **options)
+    z_lo, z_hi = bounds.z_scores()
+    worst = int(np.argmin(z_hi))
+    if not (_SAFE_Z[0] < z_lo[worst] and z_hi[worst] < _SAFE_Z[1]):
+        return None
+    margins = np.delete(bounds.margins(worst), worst)
+    return worst if np.all(margins > _SAFE_MARGIN) else None
+
+
+def rank(names, scores):
+    """Return [(name, score)] from best to worst; ties keep their input order."""
+    order = np.argsort(-scores, kind='stable')
+    return [(names[i], float(scores[i])) for i in order]
+
+
+class SampleTable:
+    """Percentage weight, RWP and crystallite size of many samples against one list of structures."""
+
+    def __init__(self, sample_names, structure_names, values, present=None, positions=None):
+        self.sample_names = sample_names
+        self.structure_names = structure_names
+        self.values = values  # SCORE_DTYPE array of shape (samples, structures), NaN where missing
+        # Structures that belong to each sample, by default those with at least one value
+        if present is None:
+            present = ~(np.isnan(values['pw']) & np.isnan(values['rwp']) & np.isnan(values['cs']))
+        self.present = present
+        # Where each structure comes in its own sample, which the per-sample criteria break ties by;
+        # by default the table's column order
+        if positions is None:
+            positions = np.broadcast_to(np.arange(len(structure_names)), present.shape)
+        self.positions = positions
+
+    @classmethod
+    def from_samples(cls, samples, structure_names=None):
+        """
+        Build the table from {sample name: parsed_data}. The structures default to every
+        structure found in any sample, in the order they are first seen.
+        """
+        if structure_names is None:
+            structure_names = list(dict.fromkeys(
+                name for parsed_data in samples.values()
+                for name, data in parsed_data.items() if isinstance(data, dict)
+            ))
+        columns = {name: column for column, name in enumerate(structure_names)}
+        values = np.full((len(samples), len(structure_names)), np.nan, dtype=SCORE_DTYPE)
+        present = np.zeros(values.shape, dtype=bool)
+        positions = np.zeros(values.shape, dtype=int)
+        for row, parsed_data in enumerate(samples.values()):
+            for position, (name, data) in enumerate(parsed_data.items()):
+                column = columns.get(name)
+                if column is None or not isinstance(data, dict):
+                    continue
+                present[row, column] = True
+                positions[row, column] = position
+                for field, key in (('pw', 'percentage_weight'), ('rwp', 'RWP'), ('cs', 'crystallite_size')):
+                    value = _number(data.get(key))
+                    if value is not None:
+                        values[field][row, column] = value
+        return cls(list(samples.keys()), structure_names, values, present, positions)
+
+    def parsed_data(self, row):
+        """Return one sample as the {structure: {...}} dict the per-sample tasks expect, in sample order."""
+        parsed_data = {}
+        columns = np.flatnonzero(self.present[row])
+        for column in columns[np.argsort(self.positions[row][columns], kind='stable')]:
+            data = {}
+            for field, key in (('pw', 'percentage_weight'), ('rwp', 'RWP'), ('cs', 'crystallite_size')):
+                value = self.values[field][row, column]
+                if not np.isnan(value):
+                    data[key] = float(value)
+            parsed_data[self.structure_names[column]] = data
+        return parsed_data
+
+    def __len__(self):
+        return len(self.sample_names)
+
+
+def _row_location_scale(values, mask, guarded):
+    """_location_scale of every row, over the entries selected by mask."""
+    count = mask.sum(axis=-1)
+    undefined = 0.0 if guarded else np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, values, 0.0).sum(axis=-1) / count
+        deviation = np.where(mask, values - mean[..., None], 0.0)
+        std = np.sqrt((deviation * deviation).sum(axis=-1) / (count - 1))
+    mean = np.where(count > 0, mean, undefined)
+    std = np.where(count > 1, std, undefined)
+    return mean[..., None], std[..., None]
+
+
+def _row_z(values, mean, std):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = (values - mean) / std
+    return np.where(std == 0, 0.0, z)
+
+
+def batch_combined_z_scores(table, candidates, separate_distributions=False, all_metrics=True, rwp_sign=-1.0):
+    """
+    combined_z_scores of every sample in a SampleTable, each sample scored over its own
+    candidates (boolean mask of the table's shape). Structures that are not candidates or
+    cannot be scored get NaN; the second return value marks the scored ones.
+    """
+    pw = table.values['pw']
+    rwp = table.values['rwp']
+    cs = table.values['cs']
+    has_rwp = ~np.isnan(rwp)
+    has_cs = ~np.isnan(cs)
+    scored = candidates & ~np.isnan(pw) & (has_rwp | has_cs)
+
+    pw_z = _row_z(pw, *_row_location_scale(pw, scored, separate_distributions))
+
+    if separate_distributions:
+        rwp_z = rwp_sign * _row_z(rwp, *_row_location_scale(rwp, scored & has_rwp, True))
+        cs_z = -np.abs(_row_z(cs, *_row_location_scale(cs, scored & has_cs, True)))
+        all_metrics = True
+    else:
+        primary = np.where(has_rwp, rwp, cs)
+        primary_mean, primary_std = _row_location_scale(primary, scored, False)
+        rwp_z = rwp_sign * _row_z(rwp, primary_mean, primary_std)
+        cs_z = -np.abs(_row_z(cs, primary_mean, primary_std))
+
+    metric_z = np.where(has_rwp, rwp_z, cs_z)
+    if all_metrics:
+        metric_z = np.where(has_rwp & has_cs, (rwp_z + cs_z) / 2.0, metric_z)
+    return np.where(scored, pw_z + metric_z, np.nan), scored
+
+
+def batch_combined_confidence(table, candidates, **options):
+    """norm.cdf of batch_combined_z_scores; returns (confidences, scored)."""
+    z_scores, scored = batch_combined_z_scores(table, candidates, **options)
+    return norm.cdf(z_scores), scored
+
+
+def worst_columns(scores, scored, positions=None):
+    """
+    Column of the lowest scored structure of every sample, -1 for samples with nothing
+    scored. Ties and NaN scores resolve as rank() does: the last of the tied entries in
+    ``positions`` order (SampleTable.positions, by default column order), with NaN below
+    every number.
+    """
+    key = np.where(np.isnan(scores), -np.inf, scores)
+    key = np.where(scored, key, np.inf)
+    if positions is None:
+        positions = np.broadcast_to(np.arange(key.shape[-1]), key.shape)
+    tied = scored & (key == key.min(axis=-1, keepdims=True))
+    last = np.argmax(np.where(tied, positions, -1), axis=-1)
+    return np.where(scored.any(axis=-1), last, -1)
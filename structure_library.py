@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+
+
+class StructureLibrary:
+    """
+    In-memory index of a structure database directory.
+
+    The directory tree is walked once and every structure name is mapped to its path;
+    file contents are read on first use and kept until the file's mtime or size changes.
+    The tree is only walked again when one of its directories changes, i.e. when
+    structures are added, removed or renamed.
+    """
+
+    def __init__(self, structures_dir):
+        self.structures_dir = structures_dir
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.RLock()
+        self.paths = {}            # structure name -> path of the first match in os.walk order
+        self.top_level = []        # .str names directly in structures_dir, in os.listdir order
+        self._dir_mtimes = {}      # directory -> mtime when it was scanned
+        self._contents = {}        # path -> (mtime, size, content)
+        self._scan()
+
+    def _scan(self):
+        paths = {}
+        dir_mtimes = {}
+        for root, dirs, files in os.walk(self.structures_dir):
+            dir_mtimes[root] = os.stat(root).st_mtime
+            for file_name in files:
+                paths.setdefault(file_name, os.path.join(root, file_name))
+        self.paths = paths
+        self._dir_mtimes = dir_mtimes
+        self.top_level = [name for name in os.listdir(self.structures_dir) if name.endswith('.str')
+                          and os.path.isfile(os.path.join(self.structures_dir, name))] \
+            if os.path.isdir(self.structures_dir) else []
+        # Forget contents of files that are no longer part of the library
+        live_paths = set(paths.values())
+        self._contents = {path: entry for path, entry in self._contents.items() if path in live_paths}
+        self.logger.info(f"Indexed {len(paths)} files in {self.structures_dir}")
+
+    def _is_stale(self):
+        if not self._dir_mtimes:
+            return os.path.isdir(self.structures_dir)
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self):
+        """Walk the directory again if any of its folders changed since the last scan."""
+        with self.lock:
+            if self._is_stale():
+                self._scan()
+
+    def path(self, structure_name):
+        """Return the path of a structure file, or None if it is not in the library."""
+        self.refresh()
+        return self.paths.get(structure_name)
+
+    def _read(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._contents.pop(path, None)
+            return None
+        entry = self._contents.get(path)
+        if entry is None or entry[0] != stat.st_mtime or entry[1] != stat.st_size:
+            with open(path, 'r') as structure_file:
+                entry = (stat.st_mtime, stat.st_size, structure_file.read())
+            self._contents[path] = entry
+        return entry[2]
+
+    def content(self, structure_name):
+        """Return the text of a structure file, or None if it is not in the library."""
+        return self.contents([structure_name]).get(structure_name)
+
+    def contents(self, structure_names):
+        """Return {structure name: content} for the names found in the library."""
+        with self.lock:
+            if self._is_stale():
+                self._scan()
+            structure_contents = {}
+            for structure_name in structure_names:
+                if structure_name in structure_contents:
+                    continue
+                path = self.paths.get(structure_name)
+                content = self._read(path) if path else None
+                if content is not None:
+                    structure_contents[structure_name] = content
+            return structure_contents
+
+    def structure_files(self):
+        """List the .str files directly in the library directory."""
+        self.refresh()
+        return list(self.top_level)
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_structure_library(structures_dir):
+    """Return the process-wide library for ``structures_dir``, creating it on first use."""
+    key = os.path.abspath(structures_dir)
+    with _libraries_lock:
+        library = _libraries.get(key)
+        if library is None:
+            library = StructureLibrary(key)
+            _libraries[key] = library
+        return library
@@ -0,0 +1,134 @@
+"""
+Parameter sweep: run one analysis template on one sample for every point of a parameter grid.
+
+Every grid point gets its own run_id in a single results.db and the runs execute
+concurrently. They share the global tc.exe budget and the refinement cache, so a scenario
+that is the same for several grid points is refined only once (refinement_cache in
+config.txt must be enabled for that). Parameters use the same syntax as replay.py.
+
+Example:
+    python sweep.py "test 23" Samples/cem1.raw --param polynomial=3,6,10 --param node_3:confidence=0.7,0.8 --runs 4
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch_cli import resolve_template
+from file_handling import parse_config
+from flowchart_engine import FlowchartEngine
+from replay import parse_parameter, parameter_grid, apply_parameters
+from results_store import init_results_db, create_results_directory, save_sweep_run
+from topas_runner import set_process_budget, process_budget_settings
+
+
+SUMMARY_COLUMNS = ['run_id', 'parameters', 'status', 'elapsed_s', 'final_structures', 'error']
+
+
+def run_grid_point(flowchart, template, parameter_set, run_id, sample_path, output_directory, results_directory,
+                   db_conn):
+    """Run the flowchart with one parameter set as ``run_id`` and return its summary row."""
+    started = time.time()
+    row = {'run_id': run_id, 'parameters': json.dumps(parameter_set), 'status': 'failed', 'final_structures': '',
+           'error': ''}
+    logger = logging.getLogger(f"Sweep_{run_id}")
+    final_structures = []
+    try:
+        engine = FlowchartEngine(apply_parameters(flowchart, parameter_set), sample_path, output_directory,
+                                 results_directory, db_conn, logger=logger)
+        if not engine.run(run_id):
+            raise RuntimeError("No starting node found in the flowchart.")
+        final_output = engine.final_output(run_id) or {}
+        final_structures = final_output.get('structures_list') or []
+        row['final_structures'] = ';'.join(final_structures)
+        row['status'] = 'finished'
+    except Exception as e:
+        logger.error(f"Run {run_id} with {parameter_set} failed: {e}", exc_info=True)
+        row['error'] = str(e)
+    row['elapsed_s'] = round(time.time() - started, 1)
+    save_sweep_run(db_conn, run_id, template, parameter_set, row['status'], final_structures, row['elapsed_s'])
+    return row
+
+
+def write_summary(rows, summary_path):
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_summary(rows):
+    print(f"{'Run':10} {'Status':10} {'Time (s)':>9}  Parameters -> final structures")
+    for row in rows:
+        print(f"{row['run_id']:10} {row['status']:10} {row['elapsed_s']:>9}  {row['parameters']} -> "
+              f"{row['final_structures'] or row['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run an analysis template for every point of a parameter grid.')
+    parser.add_argument('template', help='Analysis template path or name in analysis_templates/')
+    parser.add_argument('sample', help='Raw file to analyse')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2',
+                        help='Parameter values to sweep, may be repeated: name (every node), '
+                             'node_id:name (one node) or from->to (condition parameter of a connection)')
+    parser.add_argument('--runs', type=int, default=4, help='Number of grid points run concurrently')
+    parser.add_argument('--max-processes', type=int, default=None,
+                        help='Maximum number of tc.exe processes running at once across all runs '
+                             '(default: max_parallel_processes in config.txt, one per core if auto)')
+    parser.add_argument('--output-dir', default=os.path.join(os.getcwd(), 'results'),
+                        help='Directory in which the results directory of the sweep is created')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    template_path = resolve_template(args.template)
+    with open(template_path, 'r') as f:
+        flowchart = json.load(f)
+
+    grid = parameter_grid(dict(parse_parameter(text) for text in args.param))
+    for parameter_set in grid:
+        # Fail before anything runs if a parameter does not exist in the template
+        apply_parameters(flowchart, parameter_set)
+
+    config = parse_config(os.path.join(os.getcwd(), 'config.txt'))
+    if str(config.get('refinement_cache', 'true')).strip().lower() not in ('true', '1', 'yes'):
+        logging.warning("refinement_cache is disabled in config.txt, runs will not share refinements")
+
+    sample_path = os.path.abspath(args.sample)
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_directory = create_results_directory(args.output_dir, sample_path)
+    settings = process_budget_settings(config)
+    settings['max_processes'] = args.max_processes or settings['max_processes']
+    set_process_budget(**settings)
+
+    template = os.path.splitext(os.path.basename(template_path))[0]
+    db_conn = init_results_db(os.path.join(results_directory, 'results.db'))
+    rows = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.runs)) as executor:
+            futures = [
+                executor.submit(run_grid_point, flowchart, template, parameter_set, f"sweep_{index:03d}",
+                                sample_path, args.output_dir, results_directory, db_conn)
+                for index, parameter_set in enumerate(grid, start=1)
+            ]
+            for future in as_completed(futures):
+                row = future.result()
+                logging.info(f"{row['run_id']}: {row['status']} in {row['elapsed_s']} s")
+                rows.append(row)
+    finally:
+        db_conn.close()
+
+    rows.sort(key=lambda row: row['run_id'])
+    summary_path = os.path.join(results_directory, 'sweep_summary.csv')
+    write_summary(rows, summary_path)
+    print_summary(rows)
+    print(f"Results stored in {os.path.join(results_directory, 'results.db')}, summary in {summary_path}")
+    return 0 if all(row['status'] == 'finished' for row in rows) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,10 +1,13 @@
+import asyncio
+import copy
 import os
+import json
 import logging
-import re
 import shutil
 import subprocess
+import time
 from ast import parse
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from numpy.random import logistic
 
@@ -13,11 +16,146 @@ def remove_suffix(text, suffix):
     """Return *text* without the specified *suffix* if it ends with it."""
     return text[:-len(suffix)] if suffix and text.endswith(suffix) else text
 
-from file_handling import parse_config, get_structure_content_in_content, parse_crystallite_size, parse_percentage_weight
+from file_handling import parse_config, parse_output_file, OutputFileRecord, SECTION_MARKER_REGEX, index_structure_sections, \
+    apply_output_record, parse_crystallite_size_limits
+from results_store import save_refinement_record, reading
 from exclusion_tasks import CrystalliteSizeExclusionTask, RWPExclusionTask
+from exclusion_criteria_tasks import WorstNegativeExclusionCriteriaTask
+from refinement_cache import refinement_cache_from_config
+from runtime_history import runtime_history_from_config, refinement_features, relative_cost
+from scoring import ScoreTable, certain_lowest
+from structure_library import get_structure_library
+from topas_runner import event_loop, process_slot, process_budget, RunControl, RunCancelled, RefinementTimeout, RefinementPruned, \
+    kill_process_tree, parse_progress_line
+
+# Threads used to write the .inp files of one task
+SCENARIO_WRITE_WORKERS = 8
+# Criteria whose decision is the single extreme-ranked candidate, see BaseTask.speculative_pruner
+SPECULATIVE_CRITERIA = ('Worst', 'Worst Negative', 'Worst Combined', 'Worst Negative Combined')
+
+
+class SpeculativePruner:
+    """
+    Stops leave-one-out refinements that can no longer change which candidate is excluded.
+
+    candidates maps each candidate structure to the .inp file refining it; combine()
+    returns the combined data of the refinements finished so far, which exclusion_task
+    (an RWPExclusionTask) screens with a Worst criterion. After every finished refinement
+    the pruner bounds what the unfinished ones can still report. All of them must be
+    running: TOPAS only lowers the Rwp it streams, the percentage weight lies between 0
+    and 100 and the crystallite size within the limits of the structure's .str.
+
+    Queued refinements, and running ones that have not reported an Rwp yet, are not
+    bounded: nothing limits the Rwp a refinement ends with before it streams its first
+    cycle, and a candidate that could still end up worst keeps any decision open. Nothing
+    is stopped while there are any. With more candidates than the process budget allows
+    at once, pruning therefore only starts once the last of them is running and can only
+    shorten that last wave of refinements.
+
+    scoring.certain_lowest then bounds the score of every structure over all the values
+    the unfinished refinements can end with, including how these move the means and
+    standard deviations of the z-scores. When one structure is certain to score lowest,
+    both with the unfinished candidates evaluated and with them left out, it is excluded
+    whatever they report and the other unfinished refinements are stopped. They are
+    reported as not evaluated, so the decision is the one a full run makes.
+    """
+
+    def __init__(self, task, candidates, combine, exclusion_task):
+        self.task = task
+        self.candidates = set(candidates.values())
+        self.names = {input_file: structure for structure, input_file in candidates.items()}
+        self.combine = combine
+        self.exclusion_task = exclusion_task
+        self.criterion = exclusion_task.exclusion_criteria_classes[exclusion_task.parameters.get('exclusion_criteria', 'Worst')]
+        self.crystallite_size_limits = {}  # .inp path -> (min, max) of the candidate's crystallite size
+
+    def __call__(self, unfinished):
+        """Input files among ``unfinished`` to stop."""
+        if any(input_file not in self.candidates for input_file in unfinished):
+            # The baseline is still refining
+            return []
+        rwp_bounds = {}
+        for input_file in unfinished:
+            rwp = self.task.refinement_progress.get(os.path.basename(input_file)[:-4], {}).get('rwp')
+            if rwp is None:
+                # Not started or no Rwp reported yet, nothing bounds what it will report
+                self.task.logger.debug(f"Not pruning while {os.path.basename(input_file)} has not reported an Rwp")
+                return []
+            rwp_bounds[input_file] = rwp
+
+        try:
+            lower, upper = self.bounded_data(rwp_bounds)
+        except (IndexError, KeyError, TypeError, ValueError, OSError) as e:
+            self.task.logger.debug(f"Cannot bound the unfinished refinements yet: {e}")
+            return []
+        if lower is None:
+            return []
+
+        decision = self.certain_worst(lower, upper, ())
+        if decision is None or decision not in lower:
+            return []
+        pruned = [input_file for input_file in unfinished if self.names[input_file] != decision]
+        if not pruned or self.certain_worst(lower, upper, {self.names[f] for f in pruned}) != decision:
+            return []
+        self.task.logger.info(f"{decision} is excluded whatever the {len(unfinished)} unfinished refinements report, "
+                              f"stopping {len(pruned)} of them")
+        return pruned
+
+    def bounded_data(self, rwp_bounds):
+        """
+        The refinements screened by exclusion_task, once with the unfinished candidates
+        (.inp path -> Rwp they reported last) at the lowest values they can end with and once
+        at the highest. (None, None) when the screening fails, or, for Worst Negative, when
+        it is not certain which structures are valid and therefore left out of the ranking.
+        """
+        combined_data = self.combine()
+        bounds = []
+        for end in (0, 1):
+            data = copy.deepcopy(combined_data)
+            for input_file, rwp in rwp_bounds.items():
+                structure = self.names[input_file]
+                limits = self.crystallite_size_limits.get(input_file)
+                if limits is None:
+                    limits = self.crystallite_size_limits[input_file] = self.read_crystallite_size_limits(
+                        input_file, structure)
+                data[structure] = {'RWP': (0.0, rwp)[end], 'percentage_weight': (0.0, 100.0)[end],
+                                   'crystallite_size': limits[end]}
+            screened = self.exclusion_task.run(data)
+            if not isinstance(screened, dict):
+                return None, None
+            bounds.append(screened)
+        lower, upper = bounds
+        if issubclass(self.criterion, WorstNegativeExclusionCriteriaTask):
+            # Only structures that are not valid are ranked; the bounds must agree on which
+            if set(lower['valid_structures']) != set(upper['valid_structures']):
+                return None, None
+        return lower, upper
+
+    def read_crystallite_size_limits(self, input_file, structure):
+        with open(input_file, 'r') as f:
+            content = f.read()
+        sections = index_structure_sections(content)
+        span = sections.get(f"{structure}.str") or sections.get(structure)
+        return parse_crystallite_size_limits(content[span[0]:span[1]]) if span else (0.0, float('inf'))
+
+    def certain_worst(self, lower, upper, left_out):
+        """The structure certain to score lowest with ``left_out`` not evaluated, else None."""
+        names = [name for name in lower if name not in left_out and name not in lower['valid_structures']] \
+            if issubclass(self.criterion, WorstNegativeExclusionCriteriaTask) else \
+            [name for name in lower if name not in left_out]
+        lower_table = ScoreTable.from_parsed_data(lower, names)
+        upper_table = ScoreTable.from_parsed_data(upper, names)
+        if len(lower_table) < 2 or lower_table.names != upper_table.names:
+            return None
+        criterion = self.criterion(parameters=self.exclusion_task.parameters, logger=self.task.logger)
+        worst = certain_lowest(
+            lower_table, upper_table, separate_distributions=criterion.separate_distributions,
+            all_metrics=criterion.all_metrics, rwp_sign=criterion.rwp_sign())
+        return None if worst is None else lower_table.names[worst]
 
 class BaseTask:
-    def __init__(self, node_id, parameters, data, output_directory, db_conn=None):
+    def __init__(self, node_id, parameters, data, output_directory, db_conn=None, workspace_dir=None,
+                 run_control=None, progress_callback=None, refinement_archive=None):
         self.node_id = node_id
         self.parameters = parameters  # Parameters defined in the node
         self.data = data              # Data from previous nodes
@@ -26,11 +164,35 @@ class BaseTask:
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.input_directory = data.get('input_directory', os.getcwd())
         self.input_file = data.get('input_file')
-        self.input_dir = os.path.join(self.script_dir, 'input_files')
-        self.output_dir = os.path.join(self.script_dir, 'output_files')
+        self.run_id = data.get('run_id')
+        self.iteration = data.get('iteration')
+        # Each execution gets its own scratch workspace when the caller provides one,
+        # otherwise fall back to the shared folders next to the scripts
+        self.workspace_dir = workspace_dir or self.script_dir
+        self.input_dir = os.path.join(self.workspace_dir, 'input_files')
+        self.output_dir = os.path.join(self.workspace_dir, 'output_files')
         self.output_data = {}         # Output data to be saved
         self.root_dir = os.getcwd()
         self.db_conn = db_conn
+        self.refinement_cache = None  # Set up from config.txt in run_simulation
+        self.refinement_timeout = None  # Seconds, set up from config.txt in run_simulation
+        self.runtime_history = None  # Set up from config.txt in run_simulation
+        self.refinement_features = {}  # .inp path -> features its runtime is predicted from
+        self.refinement_started = {}  # .inp path -> time its tc.exe process started
+        self.refinement_processes = {}  # .inp path -> its running tc.exe process
+        self.pruned_refinements = set()  # .inp paths stopped by a speculative_pruner
+        self.refinement_progress = {}  # scenario -> last {'cycle', 'rwp'} reported by its running tc.exe
+        self.output_records = {}  # .out path -> OutputFileRecord, each file is parsed once
+        # Shared with the engine so that cancelling the analysis kills the running tc.exe processes
+        self.run_control = run_control or RunControl()
+        # progress_callback(input_file, record, done, total, eta_seconds) after every refinement
+        self.progress_callback = progress_callback
+        # Set when replaying a flowchart offline: refinements come from a previous run's
+        # results.db (see replay.RefinementArchive) instead of tc.exe
+        self.refinement_archive = refinement_archive
+        self.scenarios = {}  # .inp file name -> structures written into it
+        # {'header', 'sections'} of a refined baseline while warm started scenarios are written
+        self.warm_start = None
         
         self.exclusion_classes = {
             'Crystallite Size': CrystalliteSizeExclusionTask,
@@ -42,13 +204,16 @@ class BaseTask:
         """Return (weight_percent, cryst_size) for a phase from the database."""
         if not self.db_conn:
             return None, None
-        cursor = self.db_conn.cursor()
-        cursor.execute(
-            "SELECT weight_percent, cryst_size FROM phase_results "
-            "WHERE phase_name=? ORDER BY id DESC LIMIT 1",
-            (phase_name,),
-        )
-        row = cursor.fetchone()
+        with reading(self.db_conn) as conn:
+            cursor = conn.cursor()
+            # Several runs (e.g. a parameter sweep) can share one results.db
+            cursor.execute(
+                "SELECT phase_results.weight_percent, phase_results.cryst_size FROM phase_results "
+                "JOIN results ON results.id = phase_results.result_id "
+                "WHERE phase_results.phase_name=? AND results.run_id=? ORDER BY phase_results.id DESC LIMIT 1",
+                (phase_name, self.run_id),
+            )
+            row = cursor.fetchone()
         if row:
             return row[0], row[1]
         return None, None
@@ -64,71 +229,63 @@ class BaseTask:
             else:
                 os.makedirs(dir_path)
 
-    def move_output_files(self):
-        #move output files to output directory from input directory
-        logging.info("Moving .out files to output directory")
-        for file in os.listdir(self.input_dir):
-            if file.endswith('.out'):
-                logging.info(f"Moving file {file}")
-                file_path = os.path.join(self.input_dir, file)
-                logging.info(f"File path: {file_path}")
-                if os.path.isfile(file_path):
-                    logging.info(f"Moving file {file} to {self.output_dir}")
-                    shutil.move(file_path, self.output_dir)
-                    logging.info(f"File moved to {self.output_dir}")
-                    #os.remove(file_path)
+    def get_output_record(self, out_file):
+        """Return the parsed record of an .out file, scanning each file only once per task."""
+        record = self.output_records.get(out_file)
+        if record is None:
+            record = parse_output_file(out_file)
+            if record is not None:
+                self.output_records[out_file] = record
+        return record
+
+    def list_output_files(self):
+        """Paths of the .out files of this task, including records restored by a replay or resume."""
+        output_files = [os.path.join(self.output_dir, f) for f in os.listdir(self.output_dir) if f.endswith('.out')]
+        output_files += [path for path in self.output_records
+                         if os.path.dirname(path) == self.output_dir and path not in output_files]
+        return output_files
 
     def parse_output_crystallite_size(self, structures_list):
         self.logger.info("Parsing output files for Crystallite Size")
 
-        output_files = [os.path.join(self.output_dir, f) for f in os.listdir(self.output_dir) if f.endswith('.out')]
+        output_files = self.list_output_files()
         parsed_data = {}
 
         for output_file in output_files:
-            # Read the content of the output file
             logging.info(f"Reading output file: {output_file}")
-            with open(output_file, 'r') as f:
-                content = f.read()
+            record = self.get_output_record(output_file)
             for structure in structures_list:
-                logging.info(f"Parsing structure: {structure}")
                 #return a dictionary with the structure name as the key and the crystallite size as the value
-                subcontent = get_structure_content_in_content(content, structure)
-                crystallite_size = parse_crystallite_size(subcontent)
-                if crystallite_size is None:
-                    _, crystallite_size = self._fetch_phase_result(os.path.splitext(os.path.basename(structure))[0])
-                logging.info(f"Crystallite size: {crystallite_size}")
                 structure_name = os.path.splitext(os.path.basename(structure))[0]
-                logging.info(f"Structure name: {structure_name}")
+                structure_record = record.structure(structure) if record else None
+                crystallite_size = structure_record.crystallite_size if structure_record else None
+                if crystallite_size is None:
+                    _, crystallite_size = self._fetch_phase_result(structure_name)
                 parsed_data[structure_name] = crystallite_size
-                logging.info(f"Parsed data: {parsed_data}")
+            logging.info(f"Parsed data: {parsed_data}")
         return parsed_data
 
     def parse_output_percentage_weight(self, structures_list):
-        self.logger.info("Parsing output files for Crystallite Size")
+        self.logger.info("Parsing output files for Percentage Weight")
 
-        output_files = [os.path.join(self.output_dir, f) for f in os.listdir(self.output_dir) if f.endswith('.out')]
+        output_files = self.list_output_files()
         parsed_data = {}
 
         for output_file in output_files:
-            # Read the content of the output file
             logging.info(f"Reading output file: {output_file}")
-            with open(output_file, 'r') as f:
-                content = f.read()
+            record = self.get_output_record(output_file)
             for structure in structures_list:
-                logging.info(f"Parsing structure: {structure}")
-                #return a dictionary with the structure name as the key and the crystallite size as the value
-                subcontent = get_structure_content_in_content(content, structure)
-                percentage_weight = parse_percentage_weight(subcontent)
-                if percentage_weight is None:
-                    percentage_weight, _ = self._fetch_phase_result(os.path.splitext(os.path.basename(structure))[0])
-                logging.info(f"Percentage weight: {percentage_weight}")
+                #return a dictionary with the structure name as the key and the percentage weight as the value
                 structure_name = os.path.splitext(os.path.basename(structure))[0]
-                logging.info(f"Structure name: {structure_name}")
+                structure_record = record.structure(structure) if record else None
+                percentage_weight = structure_record.percentage_weight if structure_record else None
+                if percentage_weight is None:
+                    percentage_weight, _ = self._fetch_phase_result(structure_name)
                 parsed_data[structure_name] = percentage_weight
-                logging.info(f"Parsed data: {parsed_data}")
+            logging.info(f"Parsed data: {parsed_data}")
         return parsed_data
 
-    def parse_output_RWP(self, structures_list, excluded_structure_list):
+    def _parse_rwp_with_exclusions(self, structures_list, excluded_structure_list):
         """
         Parse RWP values for included and excluded structures.
 
@@ -141,25 +298,20 @@ class BaseTask:
                       ...
                   }
         """
-
         parsed_data_RWP = {}
 
         # 1. Parse the all_structures.out file
         all_structures_out_file = os.path.join(self.output_dir, "all_structures.out")
-        if os.path.exists(all_structures_out_file):
-            with open(all_structures_out_file, 'r') as out_file:
-                all_content = out_file.read()
-            # Extract RWP
-            rwp_match = re.search(r'r_wp\s+([\d.]+)', all_content)
-            if rwp_match:
-                rwp_all = float(rwp_match.group(1))
-                logging.info(f"RWP (all structures): {rwp_all}")
-            else:
-                logging.warning("RWP value not found in all_structures.out.")
-                rwp_all = None
-        else:
+        all_record = self.get_output_record(all_structures_out_file)
+        if all_record is None:
             logging.warning(f"all_structures.out file not found: {all_structures_out_file}")
             rwp_all = None
+        elif all_record.rwp is None:
+            logging.warning("RWP value not found in all_structures.out.")
+            rwp_all = None
+        else:
+            rwp_all = all_record.rwp
+            logging.info(f"RWP (all structures): {rwp_all}")
 
         # 2. Set rwp_all in parsed_data_RWP as a dict
         parsed_data_RWP["rwp_all"] = {"RWP": rwp_all}
@@ -181,160 +333,75 @@ class BaseTask:
         # 4. For excluded structures, parse from all_structures_{excluded_structure}.out
         for excluded_structure in excluded_set:
             excluded_out_file = os.path.join(self.output_dir, f"all_structures_{excluded_structure}.out")
+            excluded_record = self.get_output_record(excluded_out_file)
 
-            if os.path.exists(excluded_out_file):
-                with open(excluded_out_file, 'r') as out_file:
-                    excluded_content = out_file.read()
-                rwp_match = re.search(r'r_wp\s+([\d.]+)', excluded_content)
-                if rwp_match:
-                    rwp_excluded = float(rwp_match.group(1))
-                    logging.info(f"RWP for excluded structure {excluded_structure}: {rwp_excluded}")
-                    parsed_data_RWP[excluded_structure] = {"RWP": rwp_excluded}
-                else:
-                    logging.warning(f"RWP value not found in {excluded_out_file}.")
-                    parsed_data_RWP[excluded_structure] = {"RWP": None}
-            else:
+            if excluded_record is None:
                 logging.warning(f"Excluded structure output file not found: {excluded_out_file}")
                 parsed_data_RWP[excluded_structure] = {"RWP": None}
-
-        return parsed_data_RWP
-
-    def parse_output_RWP_negative(self, structures_list, excluded_structure_list):
-        """
-        Parse RWP values for included and excluded structures.
-
-        Returns:
-            dict: A dictionary of the form:
-                  {
-                      "rwp_all": {"RWP": <float or None>},
-                      "StructureName1": {"RWP": <float or None>},
-                      "StructureName2": {"RWP": <float or None>},
-                      ...
-                  }
-        """
-
-        parsed_data_RWP = {}
-
-        # 1. Parse the all_structures.out file
-        all_structures_out_file = os.path.join(self.output_dir, "all_structures.out")
-        if os.path.exists(all_structures_out_file):
-            with open(all_structures_out_file, 'r') as out_file:
-                all_content = out_file.read()
-            # Extract RWP
-            rwp_match = re.search(r'r_wp\s+([\d.]+)', all_content)
-            if rwp_match:
-                rwp_all = float(rwp_match.group(1))
-                logging.info(f"RWP (all structures): {rwp_all}")
+            elif excluded_record.rwp is None:
+                logging.warning(f"RWP value not found in {excluded_out_file}.")
+                parsed_data_RWP[excluded_structure] = {"RWP": None}
             else:
-                logging.warning("RWP value not found in all_structures.out.")
-                rwp_all = None
-        else:
-            logging.warning(f"all_structures.out file not found: {all_structures_out_file}")
-            rwp_all = None
-
-
-
-        # 2. Set rwp_all in parsed_data_RWP as a dict
-        parsed_data_RWP["rwp_all"] = {"RWP": rwp_all}
-
-        # Convert to sets
-        excluded_set = {
-            os.path.splitext(os.path.basename(s))[0] for s in excluded_structure_list
-        }
-        included_set = {
-            os.path.splitext(os.path.basename(s))[0]
-            for s in structures_list
-            if os.path.splitext(os.path.basename(s))[0] not in excluded_set
-        }
+                logging.info(f"RWP for excluded structure {excluded_structure}: {excluded_record.rwp}")
+                parsed_data_RWP[excluded_structure] = {"RWP": excluded_record.rwp}
 
-        # 3. For included structures, store {"RWP": rwp_all}
-        for included_structure in included_set:
-            parsed_data_RWP[included_structure] = {"RWP": rwp_all}
-
-        # 4. For excluded structures, parse from all_structures_{excluded_structure}.out
-        for excluded_structure in excluded_set:
-            excluded_out_file = os.path.join(self.output_dir, f"all_structures_{excluded_structure}.out")
+        return parsed_data_RWP
 
-            if os.path.exists(excluded_out_file):
-                with open(excluded_out_file, 'r') as out_file:
-                    excluded_content = out_file.read()
-                rwp_match = re.search(r'r_wp\s+([\d.]+)', excluded_content)
-                if rwp_match:
-                    rwp_excluded = float(rwp_match.group(1))
-                    logging.info(f"RWP for excluded structure {excluded_structure}: {rwp_excluded}")
-                    parsed_data_RWP[excluded_structure] = {"RWP": rwp_excluded}
-                else:
-                    logging.warning(f"RWP value not found in {excluded_out_file}.")
-                    parsed_data_RWP[excluded_structure] = {"RWP": None}
-            else:
-                logging.warning(f"Excluded structure output file not found: {excluded_out_file}")
-                parsed_data_RWP[excluded_structure] = {"RWP": None}
+    def parse_output_RWP(self, structures_list, excluded_structure_list):
+        return self._parse_rwp_with_exclusions(structures_list, excluded_structure_list)
 
-        return parsed_data_RWP
+    def parse_output_RWP_negative(self, structures_list, excluded_structure_list):
+        return self._parse_rwp_with_exclusions(structures_list, excluded_structure_list)
 
-    def parse_output_RWP_percentage_weight(self, structures_list, excluded_structure_list):
+    def _parse_structure_value_with_exclusions(self, structures_list, excluded_structure_list, value_name):
         """
-        Parse percentage weights from output files.
+        Parse one refined value (e.g. 'percentage_weight' or 'crystallite_size') per structure.
 
         For included structures (those in structures_list but not in excluded_structure_list),
         parse from 'all_structures.out'.
 
         For excluded structures, parse from 'all_structures_{structure_name}.out'.
-        """
 
-        # Convert lists to sets for easier operations
+        Returns:
+            dict: A dictionary with structure_name (no extension) as keys and the values as floats.
+        """
+        # Convert lists to sets without extensions
         excluded_set = {os.path.splitext(os.path.basename(s))[0] for s in excluded_structure_list}
         included_set = {os.path.splitext(os.path.basename(s))[0] for s in structures_list if
                         os.path.splitext(os.path.basename(s))[0] not in excluded_set}
 
         parsed_data = {}
 
-        # 1. Parse percentage weight for included structures from all_structures.out
+        # 1. Parse included structures from all_structures.out
         all_structures_out_file = os.path.join(self.output_dir, "all_structures.out")
-
-        if not os.path.exists(all_structures_out_file):
+        all_record = self.get_output_record(all_structures_out_file)
+        if all_record is None:
             self.logger.warning(f"all_structures.out file not found: {all_structures_out_file}")
         else:
-            self.logger.info("Parsing percentage weights from all_structures.out for included structures.")
-            with open(all_structures_out_file, 'r') as f:
-                all_content = f.read()
-
             for structure_name in included_set:
-                # The original structure list might have ".str" so we reconstruct it if needed
-                # But get_structure_content_in_content should just need the base name without extension
-                full_structure_name = structure_name + '.str'
-
-                subcontent = get_structure_content_in_content(all_content, full_structure_name)
-                if subcontent:
-                    percentage_weight = parse_percentage_weight(subcontent)
-                    parsed_data[structure_name] = percentage_weight
-                    self.logger.info(f"Parsed percentage weight for {structure_name}: {percentage_weight}")
+                # The markers in the output file carry the .str extension
+                structure_record = all_record.structure(structure_name + '.str')
+                if structure_record:
+                    parsed_data[structure_name] = getattr(structure_record, value_name)
+                    self.logger.info(f"Parsed {value_name} for {structure_name}: {parsed_data[structure_name]}")
                 else:
                     self.logger.warning(f"Content for {structure_name} not found in all_structures.out.")
                     parsed_data[structure_name] = None
 
-        # 2. Parse percentage weight for excluded structures from their respective all_structures_{excluded_structure}.out
+        # 2. Parse excluded structures from their respective all_structures_{excluded_structure}.out
         for excluded_structure in excluded_set:
             excluded_out_file = os.path.join(self.output_dir, f"all_structures_{excluded_structure}.out")
-            if not os.path.exists(excluded_out_file):
+            excluded_record = self.get_output_record(excluded_out_file)
+            if excluded_record is None:
                 self.logger.warning(f"Output file for excluded structure not found: {excluded_out_file}")
                 parsed_data[excluded_structure] = None
                 continue
 
-            self.logger.info(
-                f"Parsing percentage weight for excluded structure {excluded_structure} from {excluded_out_file}.")
-            with open(excluded_out_file, 'r') as f:
-                excluded_content = f.read()
-
-            # The excluded structure name with extension for subcontent parsing
-            full_excluded_name = excluded_structure + '.str'
-            subcontent = get_structure_content_in_content(excluded_content, full_excluded_name)
-
-            if subcontent:
-                percentage_weight = parse_percentage_weight(subcontent)
-                parsed_data[excluded_structure] = percentage_weight
+            structure_record = excluded_record.structure(excluded_structure + '.str')
+            if structure_record:
+                parsed_data[excluded_structure] = getattr(structure_record, value_name)
                 self.logger.info(
-                    f"Parsed percentage weight for excluded structure {excluded_structure}: {percentage_weight}")
+                    f"Parsed {value_name} for excluded structure {excluded_structure}: {parsed_data[excluded_structure]}")
             else:
                 self.logger.warning(
                     f"Content for excluded structure {excluded_structure} not found in {excluded_out_file}.")
@@ -342,68 +409,39 @@ class BaseTask:
 
         return parsed_data
 
-    def parse_output_crystallite_size_with_exclusions(self, structures_list, excluded_structure_list):
-        """
-        Parse crystallite size values for included and excluded structures.
-
-        For included structures (those in structures_list but not in excluded_structure_list),
-        parse from 'all_structures.out'.
-
-        For excluded structures, parse from 'all_structures_{structure_name}.out'.
+    def parse_output_RWP_percentage_weight(self, structures_list, excluded_structure_list):
+        """Parse percentage weights, see _parse_structure_value_with_exclusions."""
+        return self._parse_structure_value_with_exclusions(
+            structures_list, excluded_structure_list, 'percentage_weight')
 
-        Returns:
-            dict: A dictionary with structure_name (no extension) as keys and crystallite size values as floats.
-        """
+    def parse_output_crystallite_size_with_exclusions(self, structures_list, excluded_structure_list):
+        """Parse crystallite sizes, see _parse_structure_value_with_exclusions."""
         self.logger.info("Parsing output files for Crystallite Size with exclusions logic.")
+        return self._parse_structure_value_with_exclusions(
+            structures_list, excluded_structure_list, 'crystallite_size')
 
-        # Convert to sets without extensions
-        excluded_set = {os.path.splitext(os.path.basename(s))[0] for s in excluded_structure_list}
-        included_set = {os.path.splitext(os.path.basename(s))[0] for s in structures_list if
-                        os.path.splitext(os.path.basename(s))[0] not in excluded_set}
-
-        parsed_data_crystallite = {}
-
-        # 1. Parse crystallite from all_structures.out for included structures
-        all_structures_out_file = os.path.join(self.output_dir, "all_structures.out")
-        if os.path.exists(all_structures_out_file):
-            with open(all_structures_out_file, 'r') as f:
-                all_content = f.read()
-
-            for included_structure in included_set:
-                # Reconstruct full name with extension
-                full_structure_name = included_structure + '.str'
-                subcontent = get_structure_content_in_content(all_content, full_structure_name)
-                if subcontent:
-                    crystallite_size = parse_crystallite_size(subcontent)
-                    parsed_data_crystallite[included_structure] = crystallite_size
-                    self.logger.info(f"Crystallite size for included structure {included_structure}: {crystallite_size}")
-                else:
-                    self.logger.warning(f"No crystallite data found for included structure {included_structure} in all_structures.out.")
-                    parsed_data_crystallite[included_structure] = None
-        else:
-            self.logger.warning(f"all_structures.out file not found at {all_structures_out_file}. No included structures will have crystallite values from this file.")
-
-        # 2. Parse crystallite from individual all_structures_{excluded_structure}.out for excluded structures
-        for excluded_structure in excluded_set:
-            excluded_out_file = os.path.join(self.output_dir, f"all_structures_{excluded_structure}.out")
-            if os.path.exists(excluded_out_file):
-                with open(excluded_out_file, 'r') as f:
-                    excluded_content = f.read()
-                full_excluded_name = excluded_structure + '.str'
-                subcontent = get_structure_content_in_content(excluded_content, full_excluded_name)
-                if subcontent:
-                    crystallite_size = parse_crystallite_size(subcontent)
-                    parsed_data_crystallite[excluded_structure] = crystallite_size
-                    self.logger.info(f"Crystallite size for excluded structure {excluded_structure}: {crystallite_size}")
-                else:
-                    self.logger.warning(f"No crystallite data found for excluded structure {excluded_structure} in {excluded_out_file}.")
-                    parsed_data_crystallite[excluded_structure] = None
-            else:
-                self.logger.warning(f"{excluded_out_file} for excluded structure {excluded_structure} not found.")
-                parsed_data_crystallite[excluded_structure] = None
-
-        return parsed_data_crystallite
+    def scenario_candidates(self, excluded_structure_list):
+        """{structure: .inp file} of the all_structures_<structure> scenario of every excluded structure."""
+        candidates = {}
+        for excluded_structure in excluded_structure_list:
+            structure_name = os.path.splitext(excluded_structure)[0]
+            candidates[structure_name] = os.path.join(self.input_dir, f"all_structures_{structure_name}.inp")
+        return candidates
 
+    def combine_scenario_results(self, structures_list, excluded_structure_list):
+        """
+        RWP, percentage weight and crystallite size of every structure, the excluded ones
+        taken from their own scenario (see _parse_structure_value_with_exclusions).
+        """
+        parsed_data_RWP = self.parse_output_RWP(structures_list, excluded_structure_list)
+        logging.info(f"RWP data: {parsed_data_RWP}")
+        parsed_data_RWP_percentage_weight = self.parse_output_RWP_percentage_weight(structures_list, excluded_structure_list)
+        parsed_data_RWP_crystallite_size = self.parse_output_crystallite_size_with_exclusions(structures_list, excluded_structure_list)
+        return self.combine_parsed_data(
+            RWP=parsed_data_RWP,
+            percentage_weight=parsed_data_RWP_percentage_weight,
+            crystallite_size=parsed_data_RWP_crystallite_size
+        )
 
     def combine_parsed_data(self, **data_dicts):
         """
@@ -428,25 +466,122 @@ class BaseTask:
                 combined_data[structure_name][data_label] = data_dict.get(structure_name)
         return combined_data
 
-    def run_topas_simulation(self, tc_executable, input_file, output_dir):
+    async def run_topas_simulation(self, tc_executable, input_file, output_dir):
+        """
+        Refine one .inp file. Runs on the shared event loop (topas_runner.event_loop), so a
+        refinement waiting for its turn or for tc.exe holds no thread.
+        """
+        # Refinements still queued when the analysis is cancelled never start
+        self.run_control.check()
+        if input_file in self.pruned_refinements:
+            raise RefinementPruned(input_file)
+
         # Build the command to execute TOPAS
         output_file_name = f"{os.path.basename(input_file)[:-4]}.out"
         output_file_path = os.path.join(output_dir, output_file_name)
 
-        # TOPAS execution command
-        cmd_command = f'"{tc_executable}" "{input_file}"'
+        if self.refinement_cache is None:
+            await self.run_topas_command(tc_executable, input_file)
+            return
 
-        self.logger.info(f"Running command: {cmd_command}")
+        # Reuse a previous refinement of the exact same input if we have one, waiting for
+        # it if another task of this process is refining it right now
+        cache_key = await asyncio.to_thread(self.refinement_cache.key_for, input_file)
+        async with self.refinement_cache.claim(cache_key):
+            if await asyncio.to_thread(self.refinement_cache.restore, cache_key, output_file_path):
+                self.logger.info(f"Refinement cache hit for {input_file}, skipping TOPAS")
+                return
+            await self.run_topas_command(tc_executable, input_file)
+            # TOPAS writes the .out file next to the .inp file
+            await asyncio.to_thread(self.refinement_cache.store, cache_key,
+                                    os.path.join(os.path.dirname(input_file), output_file_name))
+
+    async def run_topas_command(self, tc_executable, input_file):
+        # TOPAS is started directly, without a shell, and its output streamed as it refines
+        self.logger.info(f"Running command: {tc_executable} {input_file}")
+        scenario = os.path.basename(input_file)[:-4]
+
+        def on_line(line):
+            progress = parse_progress_line(line)
+            if progress:
+                self.refinement_progress[scenario] = progress
+                self.logger.debug(f"{scenario}: {progress}")
+
+        def on_start(process):
+            self.refinement_processes[input_file] = process
+            # Pruned while it was starting up
+            if input_file in self.pruned_refinements:
+                kill_process_tree(process)
 
         try:
-            # Execute the command and capture output
-            result = subprocess.run(cmd_command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            async with process_slot():
+                if input_file in self.pruned_refinements:
+                    raise RefinementPruned(input_file)
+                started = self.refinement_started[input_file] = time.time()
+                try:
+                    result = await self.run_control.exec_async([tc_executable, input_file], self.refinement_timeout,
+                                                               on_line, on_start)
+                finally:
+                    self.refinement_processes.pop(input_file, None)
+            features = self.refinement_features.get(input_file)
+            if self.runtime_history is not None and features is not None:
+                await asyncio.to_thread(self.runtime_history.record, features, time.time() - started)
             self.logger.info(f"Command output: {result.stdout}")
+        except RefinementTimeout as e:
+            self.logger.error(f"{scenario} was killed after running for {e.timeout} s")
+            raise
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Command failed with error: {e.stderr}")
+            if input_file in self.pruned_refinements:
+                raise RefinementPruned(input_file) from None
+            self.logger.error(f"Command failed with error: {e.stdout}")
             raise
 
-    def run_simulation(self):
+    def prune_refinement(self, input_file):
+        """Stop one refinement: it will not start if it is still queued and is killed if it is running."""
+        self.pruned_refinements.add(input_file)
+        process = self.refinement_processes.get(input_file)
+        if process is not None:
+            kill_process_tree(process)
+
+    def collect_refinement(self, input_file):
+        """
+        Move the .out file of a finished refinement to the output directory, parse it and
+        record it in results.db straight away, while the other refinements keep running.
+        """
+        output_file_name = f"{os.path.basename(input_file)[:-4]}.out"
+        produced_path = os.path.join(os.path.dirname(input_file), output_file_name)
+        output_path = os.path.join(self.output_dir, output_file_name)
+        if os.path.isfile(produced_path):
+            shutil.move(produced_path, output_path)
+
+        record = self.get_output_record(output_path)
+        if record is None:
+            self.logger.warning(f"No output produced for {input_file}")
+            return None
+
+        if self.db_conn is not None:
+            save_refinement_record(self.db_conn, self.run_id, self.node_id, self.iteration,
+                                   output_file_name[:-4], record)
+        return record
+
+    def run_simulation(self, on_refinement_complete=None, prune=None, input_files=None):
+        """
+        Refine every .inp file in the input directory, or the ones named in input_files.
+
+        Each refinement is collected (moved, parsed and stored) as soon as its tc.exe
+        process exits; ``on_refinement_complete(input_file, record)`` is then called
+        with the parsed OutputFileRecord (None if the refinement failed).
+
+        ``prune`` (a SpeculativePruner) is asked after every collected refinement which of
+        the unfinished ones are no longer needed; those are stopped and produce no output.
+
+        Raises RunCancelled once the running refinements are stopped if the analysis
+        is cancelled.
+        """
+        if self.refinement_archive is not None:
+            self.replay_refinements(on_refinement_complete)
+            return
+
         self.logger.info("Running simulations")
         config_path = os.path.join(self.root_dir, 'config.txt')
         self.logger.info(f"Reading config file from {config_path}")
@@ -472,30 +607,216 @@ class BaseTask:
             self.logger.error(f"TOPAS executable not found at {tc_executable}")
             return
 
-        # Limit the number of parallel processes
-        max_parallel_processes = 10
-
-        # Use a ThreadPoolExecutor for parallel execution with a limit on concurrent processes
-        input_files = [os.path.join(self.input_dir, f) for f in os.listdir(self.input_dir) if f.endswith('.inp')]
-        with ThreadPoolExecutor(max_workers=max_parallel_processes) as executor:
-            futures = []
-            for input_file in input_files:
-                future = executor.submit(self.run_topas_simulation, tc_executable, input_file, self.output_dir)
-                futures.append(future)
-
-            # Wait for all futures to complete
-            for future in futures:
+        self.refinement_cache = refinement_cache_from_config(config, self.root_dir, tc_executable)
+        # Wall-clock limit of one refinement, hung tc.exe processes are killed after it
+        try:
+            self.refinement_timeout = float(config.get('refinement_timeout', 3600)) or None
+        except ValueError:
+            self.refinement_timeout = 3600.0
+
+        self.runtime_history = runtime_history_from_config(config, self.root_dir)
+
+        if input_files is None:
+            input_files = [f for f in os.listdir(self.input_dir) if f.endswith('.inp')]
+        input_files = [os.path.join(self.input_dir, f) for f in input_files]
+        started = time.time()
+        done = 0
+
+        # A resumed node keeps the refinements it finished before the analysis was interrupted
+        stored = self.stored_refinements()
+        if stored:
+            self.logger.info(f"Reusing {len(stored)} refinements stored before the analysis was interrupted")
+        for input_file in [f for f in input_files if os.path.basename(f)[:-4] in stored]:
+            input_files.remove(input_file)
+            scenario = os.path.basename(input_file)[:-4]
+            record = stored[scenario]
+            self.output_records[os.path.join(self.output_dir, f"{scenario}.out")] = record
+            if on_refinement_complete is not None:
+                on_refinement_complete(input_file, record)
+
+        # Longest refinements first, so that a slow one does not start last and run alone
+        predicted = self.order_refinements(input_files)
+        if prune is not None:
+            # The pruner's decisions build on the other refinements (the baseline), start those first
+            input_files.sort(key=lambda f: f in prune.candidates)
+        # Every refinement is queued on the shared event loop at once; the global process
+        # budget decides how many of them run, adapting to cores, load and free memory
+        loop = event_loop()
+        futures = {}
+        for input_file in input_files:
+            future = asyncio.run_coroutine_threadsafe(
+                self.run_topas_simulation(tc_executable, input_file, self.output_dir), loop)
+            futures[future] = input_file
+
+        # Parse and store each refinement as soon as it completes
+        try:
+            for future in as_completed(futures):
+                input_file = futures[future]
+                record = None
                 try:
                     future.result()
+                    record = self.collect_refinement(input_file)
+                except RunCancelled:
+                    continue
+                except RefinementPruned:
+                    self.logger.info(f"Stopped {os.path.basename(input_file)}, it can no longer change the result")
                 except Exception as e:
                     self.logger.error(f"Simulation failed with error: {e}")
                     # Handle the exception as needed (e.g., continue or abort)
+                if on_refinement_complete is not None:
+                    on_refinement_complete(input_file, record)
+                done += 1
+                if self.progress_callback is not None:
+                    eta_seconds = self.estimate_remaining(futures, predicted)
+                    if eta_seconds is None:
+                        # Refinements of one task take similar times, so extrapolate from the finished ones
+                        eta_seconds = (time.time() - started) / done * (len(input_files) - done)
+                    self.progress_callback(input_file, record, done, len(input_files), eta_seconds)
+                if prune is not None and record is not None:
+                    unfinished = [f for future, f in futures.items()
+                                  if not future.done() and f not in self.pruned_refinements]
+                    for pruned_file in (prune(unfinished) if unfinished else []):
+                        self.prune_refinement(pruned_file)
+        finally:
+            # Nothing keeps running behind the task's back if it fails half-way
+            for future in futures:
+                future.cancel()
+
+        self.run_control.check()
 
+        if self.refinement_cache is not None:
+            self.logger.info(f"Refinement cache stats: {self.refinement_cache.stats()}")
         self.logger.info("All simulations completed successfully.")
 
-    def screen_data(self, parsed_data, task_type):
+    def order_refinements(self, input_files):
+        """
+        Sort input_files longest refinement first, in place, and return {input_file: predicted
+        seconds} (empty until the runtime history can predict). Without a prediction the
+        files are ordered by structure count and input size.
+        """
+        self.refinement_features = {}
+        self.refinement_started = {}
+        if self.runtime_history is None or len(input_files) < 2:
+            return {}
+        for input_file in input_files:
+            structures = self.scenarios.get(os.path.basename(input_file))
+            try:
+                self.refinement_features[input_file] = refinement_features(
+                    input_file, len(structures) if structures is not None else None)
+            except OSError as e:
+                self.logger.warning(f"Could not read {input_file} to estimate its runtime: {e}")
+                return {}
+        predicted = {}
+        for input_file, features in self.refinement_features.items():
+            seconds = self.runtime_history.predict(features)
+            if seconds is None:
+                predicted = {}
+                break
+            predicted[input_file] = seconds
+        if predicted:
+            input_files.sort(key=predicted.get, reverse=True)
+            self.logger.info(f"Predicted refinement times {min(predicted.values()):.1f}-"
+                             f"{max(predicted.values()):.1f} s, {sum(predicted.values()):.1f} s in total")
+        else:
+            input_files.sort(key=lambda f: relative_cost(self.refinement_features[f]), reverse=True)
+        return predicted
+
+    def estimate_remaining(self, futures, predicted):
+        """
+        Seconds until the refinements of futures are done, from their predicted runtimes and
+        the current process limit; None without predictions.
+        """
+        if not predicted:
+            return None
+        now = time.time()
+        remaining = []
+        for future, input_file in futures.items():
+            if future.done():
+                continue
+            seconds = predicted[input_file]
+            started = self.refinement_started.get(input_file)
+            if started is not None:
+                # Running ones may outlive their prediction, they still take a moment
+                seconds = max(seconds - (now - started), 1.0)
+            remaining.append(seconds)
+        if not remaining:
+            return 0.0
+        slots = min(process_budget().limit, len(remaining))
+        return max(max(remaining), sum(remaining) / slots)
+
+    def stored_refinements(self):
+        """
+        Refinements this node already stored in results.db for the current iteration, as
+        {scenario: OutputFileRecord}. Only scenarios refining the same structures as now count.
+        """
+        if self.db_conn is None:
+            return {}
+        with reading(self.db_conn) as conn:
+            rows = conn.execute(
+                "SELECT scenario, structures, record FROM refinements WHERE run_id=? AND node_id=? AND iteration=?",
+                (self.run_id, self.node_id, self.iteration),
+            ).fetchall()
+
+        def names(structures):
+            return {remove_suffix(os.path.basename(s), '.str') for s in structures}
+
+        stored = {}
+        for scenario, structures, record in rows:
+            expected = self.scenarios.get(f"{scenario}.inp")
+            if expected is not None and names(expected) != names(json.loads(structures)):
+                continue
+            stored[scenario] = OutputFileRecord.from_dict(json.loads(record))
+        return stored
+
+    def replay_refinements(self, on_refinement_complete=None):
+        """
+        Take the result of every scenario written by this task from the refinement archive
+        instead of running TOPAS. Scenarios without a stored refinement parse as if their
+        refinement had failed; the archive keeps track of them.
+        """
+        total = len(self.scenarios)
+        for done, (file_name, structures) in enumerate(self.scenarios.items(), start=1):
+            self.run_control.check()
+            input_file = os.path.join(self.input_dir, file_name)
+            record = self.refinement_archive.lookup(self.node_id, self.iteration, file_name[:-4], structures)
+            if record is None:
+                self.logger.warning(f"No stored refinement for {file_name} with structures {structures}")
+            else:
+                self.output_records[os.path.join(self.output_dir, f"{file_name[:-4]}.out")] = record
+            if on_refinement_complete is not None:
+                on_refinement_complete(input_file, record)
+            if self.progress_callback is not None:
+                self.progress_callback(input_file, record, done, total, 0.0)
+
+    def speculative_pruner(self, candidates, combine, task_type):
+        """
+        SpeculativePruner for run_simulation when the node's speculative_cancel parameter is
+        on and it screens RWP with a criterion excluding a single candidate
+        (SPECULATIVE_CRITERIA), else None.
+        """
+        if str(self.parameters.get('speculative_cancel', 'false')).strip().lower() not in ('true', '1', 'yes'):
+            return None
+        exclusion_criteria = self.parameters.get('exclusion_criteria', 'Worst')
+        if exclusion_criteria not in SPECULATIVE_CRITERIA:
+            self.logger.info(f"Speculative cancelling does not apply to the '{exclusion_criteria}' criteria")
+            return None
+        if self.exclusion_classes.get(self.parameters.get('exclusion_variable')) is not RWPExclusionTask:
+            self.logger.info("Speculative cancelling only applies to RWP screening")
+            return None
+        exclusion_task = RWPExclusionTask(parameters=dict(self.parameters, task_type=task_type),
+                                          logger=logging.getLogger(f'{self.logger.name}.speculative'))
+        return SpeculativePruner(self, candidates, combine, exclusion_task)
+
+    def not_evaluated(self, candidates):
+        """Candidates whose refinement a speculative pruner stopped, see SpeculativePruner."""
+        return [structure for structure, input_file in candidates.items() if input_file in self.pruned_refinements]
+
+    def screen_data(self, parsed_data, task_type, not_evaluated=()):
         """
         Screen parsed data using the appropriate exclusion task.
+
+        not_evaluated names structures whose refinement was stopped on purpose; they are
+        reported as such instead of as invalid.
         """
         self.logger.info(f"Screening data {parsed_data}")
         self.logger.info(f"Screening data (Task Type: {task_type}): {parsed_data}")
@@ -509,7 +830,8 @@ class BaseTask:
 
         # 2) Instantiate the exclusion task and pass task_type
         exclusion_task = exclusion_task_class(
-            parameters=self.parameters
+            parameters=dict(self.parameters, not_evaluated_structures=list(not_evaluated)) if not_evaluated
+            else self.parameters
         )
 
         # 3) Run the exclusion logic
@@ -533,71 +855,172 @@ class BaseTask:
         self.output_data['invalid_structures'] = data['invalid_structures']
         self.output_data['structures_list'] = data['structures_list']
         self.output_data['excluded_structure_list'] = data['excluded_structure_list']
+        if not_evaluated:
+            self.output_data['not_evaluated_structures'] = list(not_evaluated)
 
 
 
 
-    def create_all_structures_inp_file(self, structures_list, input_file_name, structures_dir):
+    def read_inp_header(self, fill_in=True):
         """
-        Creates a single .inp file that includes the modified start.inp header and all the structures from structures_list.
+        Return the start.inp text used as the header of every generated .inp file.
 
-        :param structures_list: List of structure file names.
-        :param input_file_name: Name of the input file to be processed (e.g., 'all_structures.inp').
-        :param structures_dir: Directory where structure files are located.
+        With ``fill_in`` the xdd line is pointed at the sample and the background line
+        gets the polynomial order of the node (lines 0 and 3 of start.inp).
+        """
+        start_inp_path = os.path.join(self.script_dir, 'start.inp')
+        if not os.path.exists(start_inp_path):
+            self.logger.error(f"Template file {start_inp_path} not found.")
+            return None
+
+        with open(start_inp_path, 'r') as start_inp_file:
+            start_inp_lines = start_inp_file.readlines()
+
+        if fill_in:
+            input_file = self.data.get('input_file', 'default_input.xdd')
+            start_inp_lines[0] = f'   xdd "{input_file}"\n'
+            polynomial_number = self.parameters.get('polynomial', '3')
+            start_inp_lines[3] = f'   bkg @ {"0 " * int(polynomial_number)}\n'
+        return ''.join(start_inp_lines)
+
+    def load_structure_contents(self, structure_names, structures_dir):
+        """Read each structure file once. Returns {structure name: content}, missing files are skipped."""
+        structure_contents = get_structure_library(structures_dir).contents(structure_names)
+        for structure_name in dict.fromkeys(structure_names):
+            if structure_name not in structure_contents:
+                self.logger.error(f"Structure file {structure_name} not found in {structures_dir}.")
+        return structure_contents
+
+    def config_flag(self, key):
+        """Whether an on/off option of config.txt is on; options are off by default."""
+        config_path = os.path.join(self.root_dir, 'config.txt')
+        if not os.path.exists(config_path):
+            return False
+        config = parse_config(config_path)
+        return str(config.get(key, 'false')).strip().lower() in ('true', '1', 'yes')
+
+    def load_warm_start(self, out_file, input_file):
         """
-        # Paths for start.inp and the new all_structures.inp
-        original_start_inp_path = os.path.join(self.script_dir, 'start.inp')
-        all_structures_inp_path = os.path.join(self.input_dir, 'all_structures.inp')
+        {'header', 'sections'} of a refined .out file: the text before its first structure and
+        every structure section, as written by write_scenario_files but holding the refined
+        values. None when the refinement produced no output.
 
-        # Copy start.inp to input directory and rename it to input_file_name (e.g., 'all_structures.inp')
-        shutil.copy(original_start_inp_path, all_structures_inp_path)
-        self.logger.info(f"Copied start.inp to {all_structures_inp_path}")
+        A refinement reused from results.db on resume has a record but no .out file; its
+        refined values are then put into input_file, the .inp it was refined from.
+        """
+        if os.path.isfile(out_file):
+            with open(out_file, 'r') as f:
+                content = f.read()
+        else:
+            record = self.output_records.get(out_file)
+            if record is None or not os.path.isfile(input_file):
+                return None
+            with open(input_file, 'r') as f:
+                content = apply_output_record(f.read(), record)
+        first_marker = SECTION_MARKER_REGEX.search(content)
+        if first_marker is None:
+            return None
+        # write_scenario_files puts a newline around the header and every section's content
+        header = remove_suffix(content[:first_marker.start()], '\n')
+        sections = {}
+        for structure_name, (start, end) in index_structure_sections(content).items():
+            section = content[start:end]
+            section = section[1:] if section.startswith('\n') else section
+            sections[structure_name] = remove_suffix(section, '\n')
+        return {'header': header, 'sections': sections}
+
+    def refine_scenarios(self, write_baseline, write_scenarios, baseline_file='all_structures.inp', prune=None):
+        """
+        Write and refine a baseline and the leave-one-out scenarios derived from it.
+
+        With warm_start_scenarios in config.txt the baseline is refined first and the
+        scenarios are written from its .out, so they start from the lattice parameters,
+        scales, crystallite sizes, zero error and background the baseline refined instead
+        of the starting values in structure_database. Structures the baseline does not
+        contain (e.g. the one an addition scenario adds) start from structure_database, as
+        do all of them if the baseline produced no output.
 
-        # Verify that the copied file exists
-        if not os.path.exists(all_structures_inp_path):
-            self.logger.error(f"Template file {all_structures_inp_path} not found.")
+        prune is passed on to run_simulation for the scenarios.
+        """
+        write_baseline()
+        if self.refinement_archive is not None or not self.config_flag('warm_start_scenarios'):
+            write_scenarios()
+            self.run_simulation(prune=prune)
             return
 
-        # Read the copied start.inp file
-        with open(all_structures_inp_path, 'r') as start_inp_file:
-            start_inp_lines = start_inp_file.readlines()
+        self.run_simulation(input_files=[baseline_file])
+        self.warm_start = self.load_warm_start(os.path.join(self.output_dir, f"{baseline_file[:-4]}.out"),
+                                               os.path.join(self.input_dir, baseline_file))
+        if self.warm_start is None:
+            self.logger.warning(f"{baseline_file} produced no output, scenarios start from structure_database")
+        try:
+            write_scenarios()
+        finally:
+            self.warm_start = None
+        self.run_simulation(input_files=[f for f in os.listdir(self.input_dir)
+                                         if f.endswith('.inp') and f != baseline_file], prune=prune)
 
-        # Modify the first line with input file name
-        input_file = self.data.get('input_file', 'default_input.xdd')
-        start_inp_lines[0] = f'   xdd "{input_file}"\n'
-
-        # Modify the line for polynomial number (assuming it's line index 3)
-        polynomial_number = self.parameters.get('polynomial', '3')
-        start_inp_lines[3] = f'   bkg @ {"0 " * int(polynomial_number)}\n'
-
-        # Open the all_structures.inp file for writing (overwrite the existing content)
-        with open(all_structures_inp_path, 'w') as inp_file:
-            # Write the modified header
-            inp_file.writelines(start_inp_lines)
-            self.logger.info(f"Modified header in {all_structures_inp_path}")
-
-            # Iterate over all structures and append their content
-            for structure_name in structures_list:
-                # Find the structure file
-                structure_file_path = None
-                for root, dirs, files in os.walk(structures_dir):
-                    if structure_name in files:
-                        structure_file_path = os.path.join(root, structure_name)
-                        break
-
-                if not structure_file_path:
-                    self.logger.error(f"Structure file {structure_name} not found in {structures_dir}.")
-                    continue  # Skip to the next structure
-
-                # Read the structure file content
-                with open(structure_file_path, 'r') as structure_file:
-                    structure_content = structure_file.read()
-
-                # Append the structure content to the input file
-                inp_file.write(f"\n/*{structure_name}_START*/\n")
-                inp_file.write(structure_content)
-                inp_file.write(f"\n/*{structure_name}_END*/\n")
-                self.logger.info(f"Appended structure {structure_name} to {input_file_name}")
+    def write_scenario_files(self, scenarios, structures_dir, header=None, structure_contents=None):
+        """
+        Write one .inp file per refinement scenario.
+
+        :param scenarios: Dict of .inp file name -> list of structure file names it contains.
+        :param structures_dir: Directory where structure files are located.
+        :param header: start.inp text to use, defaults to the filled in header of this node.
+        :param structure_contents: Already loaded {structure name: content}, read from structures_dir if None.
+
+        The header is built once and every structure is read once, however many scenarios
+        contain it; each scenario is then assembled in memory and written with a single
+        call, with the files written in parallel.
+        """
+        if not scenarios:
+            return
+        if header is None:
+            header = self.read_inp_header()
+        if header is None:
+            return
+
+        if structure_contents is None:
+            structure_names = [structure for structures in scenarios.values() for structure in structures]
+            structure_contents = self.load_structure_contents(structure_names, structures_dir)
+        if self.warm_start is not None:
+            # Start from the values refined by the baseline (see refine_scenarios)
+            header = self.warm_start['header']
+            structure_contents = {name: self.warm_start['sections'].get(name, content)
+                                  for name, content in structure_contents.items()}
+
+        for file_name, structures in scenarios.items():
+            self.scenarios[file_name] = [s for s in structures if s in structure_contents]
+        if self.refinement_archive is not None:
+            # Replays only need to know what each scenario contains
+            return
+
+        sections = {
+            structure_name: f"\n/*{structure_name}_START*/\n{content}\n/*{structure_name}_END*/\n"
+            for structure_name, content in structure_contents.items()
+        }
+
+        def write_scenario(file_name, structures):
+            inp_path = os.path.join(self.input_dir, file_name)
+            with open(inp_path, 'w') as inp_file:
+                inp_file.write(header + ''.join(sections[s] for s in structures if s in sections))
+            self.logger.info(f"Created {file_name} with structures {structures}")
+
+        with ThreadPoolExecutor(max_workers=min(SCENARIO_WRITE_WORKERS, len(scenarios))) as executor:
+            futures = [executor.submit(write_scenario, file_name, structures)
+                       for file_name, structures in scenarios.items()]
+            for future in futures:
+                future.result()
+
+    def create_all_structures_inp_file(self, structures_list, input_file_name, structures_dir):
+        """
+        Creates a single .inp file that includes the modified start.inp header and all the structures from structures_list.
+
+        :param structures_list: List of structure file names.
+        :param input_file_name: Name of the input file to be processed (e.g., 'all_structures.inp').
+        :param structures_dir: Directory where structure files are located.
+        """
+        self.write_scenario_files({'all_structures.inp': structures_list}, structures_dir)
 
 class StartTask(BaseTask):
     def run(self):
@@ -655,7 +1078,6 @@ class CrystalliteSizeTask(BaseTask):
 
         # Run simulations
         self.run_simulation()
-        self.move_output_files()
         # Parse output files
         logging.info("Parsing output files")
         parsed_data_crystallite_size = self.parse_output_crystallite_size(structures_list)
@@ -708,11 +1130,12 @@ class RWPTask(BaseTask):
         # Prepare input files:
         #   - one all_structures.inp (with everything)
         #   - for each structure in structures_list, create a scenario excluding that one structure
-        self.prepare_removal_RWP_input_file(structures_list, input_file)
-
-        # Run simulations & move output files
-        self.run_simulation()
-        self.move_output_files()
+        # and run simulations, each output file is collected as soon as it is produced
+        structures_dir = os.path.join(self.script_dir, 'structure_database')
+        self.refine_scenarios(
+            lambda: self.prepare_removal_RWP_input_file(structures_list, input_file),
+            lambda: self.create_all_structures_removal_inp_file(structures_list, input_file, structures_dir),
+        )
 
         # Parsing stage
         self.logger.info("Parsing output files")
@@ -752,62 +1175,27 @@ class RWPTask(BaseTask):
 
         structures_dir = os.path.join(self.script_dir, 'structure_database')
 
-        # 1) Create the baseline input file (includes ALL structures)
+        # Create the baseline input file (includes ALL structures); the scenarios that each
+        # exclude one structure are written by create_all_structures_removal_inp_file
         self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
 
-        # 2) For each structure in structures_list, create a scenario that excludes it
-        self.create_all_structures_removal_inp_file(structures_list, input_file, structures_dir)
-
     def create_all_structures_removal_inp_file(self, structures_list, input_file, structures_dir):
         """
         For each structure in structures_list, produce an input file that excludes that single structure.
         """
+        scenarios = {}
         for structure in structures_list:
             structure_name = os.path.splitext(structure)[0]
             # Exclude exactly this structure from the scenario
-            scenario_list = [s for s in structures_list if s != structure]
-
             self.logger.info(f"Creating scenario excluding: {structure_name}")
-            self.create_all_structures_inp_file(scenario_list, input_file, structures_dir)
-
-            # Rename the newly created file from all_structures.inp to all_structures_<structure_name>.inp
-            old_path = os.path.join(self.input_dir, 'all_structures.inp')
-            new_path = os.path.join(self.input_dir, f'all_structures_{structure_name}.inp')
-
-            if os.path.exists(old_path):
-                os.rename(old_path, new_path)
-                self.logger.info(f"Created {new_path} (excluded {structure_name})")
-            else:
-                self.logger.warning(f"Expected file {old_path} not found.")
+            scenarios[f'all_structures_{structure_name}.inp'] = [s for s in structures_list if s != structure]
+        self.write_scenario_files(scenarios, structures_dir, header=self.read_inp_header(fill_in=False))
 
     def create_all_structures_inp_file(self, structures_list, input_file, structures_dir):
-        original_start_inp_path = os.path.join(self.script_dir, 'start.inp')
-        output_inp_path = os.path.join(self.input_dir, 'all_structures.inp')
-
-        if not os.path.exists(original_start_inp_path):
-            self.logger.error(f"start.inp file not found at {original_start_inp_path}")
-            return
-
-        with open(original_start_inp_path, 'r') as f:
-            start_inp_lines = f.readlines()
-
-        # Optionally modify first line with the input_file
+        # The basic removal task keeps start.inp as it is
         # start_inp_lines[0] = f'   xdd "{input_file}"\n'
-
-        with open(output_inp_path, 'w') as out_f:
-            out_f.writelines(start_inp_lines)
-
-            for structure in structures_list:
-                structure_path = os.path.join(structures_dir, structure)
-                if not os.path.exists(structure_path):
-                    self.logger.warning(f"Structure {structure} not found in {structures_dir}")
-                    continue
-
-                out_f.write(f"\n/*{structure}_START*/\n")
-                with open(structure_path, 'r') as sf:
-                    out_f.write(sf.read())
-                out_f.write(f"\n/*{structure}_END*/\n")
-
+        self.write_scenario_files({'all_structures.inp': structures_list}, structures_dir,
+                                  header=self.read_inp_header(fill_in=False))
         self.logger.info(f"Created all_structures.inp with {len(structures_list)} structures.")
 
     # ------------------ Parsing Helper Methods ------------------
@@ -835,21 +1223,13 @@ class RWPTask(BaseTask):
         return parsed_data_RWP
 
     def extract_rwp_from_file(self, filepath):
-        if not os.path.exists(filepath):
+        record = self.get_output_record(filepath)
+        if record is None:
             self.logger.warning(f"{filepath} not found.")
             return None
-        with open(filepath, 'r') as f:
-            content = f.read()
-        match = re.search(r'r_wp\s+([\d.]+)', content)
-        if match:
-            try:
-                return float(match.group(1))
-            except ValueError:
-                self.logger.warning(f"Could not convert RWP to float in {filepath}")
-                return None
-        else:
+        if record.rwp is None:
             self.logger.warning(f"RWP value not found in {filepath}")
-            return None
+        return record.rwp
 
     def parse_output_RWP_percentage_weight(self, structures_list):
         """
@@ -861,20 +1241,14 @@ class RWPTask(BaseTask):
 
         # 1. Baseline parse from all_structures.out
         all_out_file = os.path.join(self.output_dir, "all_structures.out")
-        if os.path.exists(all_out_file):
-            with open(all_out_file, 'r') as f:
-                all_content = f.read()
-
+        all_record = self.get_output_record(all_out_file)
+        if all_record is not None:
             # Store a dict of structure -> weight for baseline
-            baseline_weights = {}
-            for structure in structures_list:
-                subcontent = get_structure_content_in_content(all_content, structure)
-                if subcontent:
-                    baseline_weights[structure] = parse_percentage_weight(subcontent)
-                else:
-                    baseline_weights[structure] = None
-
-            parsed_data["all"] = baseline_weights
+            parsed_data["all"] = {
+                structure: (all_record.structure(structure).percentage_weight
+                            if all_record.structure(structure) else None)
+                for structure in structures_list
+            }
         else:
             self.logger.warning(f"{all_out_file} not found.")
             parsed_data["all"] = None
@@ -883,23 +1257,19 @@ class RWPTask(BaseTask):
         for structure in structures_list:
             struct_name_no_ext = os.path.splitext(structure)[0]
             scenario_out_file = os.path.join(self.output_dir, f"all_structures_{struct_name_no_ext}.out")
+            scenario_record = self.get_output_record(scenario_out_file)
 
-            if not os.path.exists(scenario_out_file):
+            if scenario_record is None:
                 self.logger.warning(f"{scenario_out_file} not found.")
                 parsed_data[struct_name_no_ext] = None
                 continue
 
-            with open(scenario_out_file, 'r') as f:
-                scenario_content = f.read()
-
-            scenario_weights = {}
             # We can parse *all* structures from the scenario content if we want to
             # see which remain or get partial data. Here, we'll still attempt them all:
-            for s in structures_list:
-                subcontent = get_structure_content_in_content(scenario_content, s)
-                scenario_weights[s] = parse_percentage_weight(subcontent) if subcontent else None
-
-            parsed_data[struct_name_no_ext] = scenario_weights
+            parsed_data[struct_name_no_ext] = {
+                s: (scenario_record.structure(s).percentage_weight if scenario_record.structure(s) else None)
+                for s in structures_list
+            }
 
         return parsed_data
 
@@ -907,46 +1277,8 @@ class RWPTask(BaseTask):
         """
         Similar to percentage weight parsing, but here for crystallite size.
         """
-        parsed_data_crystallite = {}
-
-        excluded_set = {os.path.splitext(os.path.basename(s))[0] for s in excluded_structure_list}
-        included_set = {os.path.splitext(os.path.basename(s))[0] for s in structures_list if
-                        os.path.splitext(os.path.basename(s))[0] not in excluded_set}
-
-        # Parse from all_structures.out for included structures
-        all_out_file = os.path.join(self.output_dir, "all_structures.out")
-        if os.path.exists(all_out_file):
-            with open(all_out_file, 'r') as f:
-                all_content = f.read()
-            for included_structure in included_set:
-                full_structure_name = included_structure + '.str'
-                subcontent = get_structure_content_in_content(all_content, full_structure_name)
-                if subcontent:
-                    crystallite_size = parse_crystallite_size(subcontent)
-                    parsed_data_crystallite[included_structure] = crystallite_size
-                else:
-                    parsed_data_crystallite[included_structure] = None
-        else:
-            self.logger.warning(f"{all_out_file} not found. No included crystallite data.")
-
-        # Parse from all_structures_{excluded_structure}.out for excluded structures
-        for excluded_structure in excluded_set:
-            excluded_out_file = os.path.join(self.output_dir, f"all_structures_{excluded_structure}.out")
-            if os.path.exists(excluded_out_file):
-                with open(excluded_out_file, 'r') as f:
-                    excluded_content = f.read()
-                full_excluded_name = excluded_structure + '.str'
-                subcontent = get_structure_content_in_content(excluded_content, full_excluded_name)
-                if subcontent:
-                    crystallite_size = parse_crystallite_size(subcontent)
-                    parsed_data_crystallite[excluded_structure] = crystallite_size
-                else:
-                    parsed_data_crystallite[excluded_structure] = None
-            else:
-                self.logger.warning(f"{excluded_out_file} not found.")
-                parsed_data_crystallite[excluded_structure] = None
-
-        return parsed_data_crystallite
+        return self._parse_structure_value_with_exclusions(
+            structures_list, excluded_structure_list, 'crystallite_size')
 
 class RWPAdditionTask(BaseTask):
     def run(self):
@@ -978,34 +1310,28 @@ class RWPAdditionTask(BaseTask):
             self.logger.error("No 'structures_list' found in input data")
             return
 
-        # Prepare input files
-        self.prepare_RWP_input_file(structures_list, excluded_structure_list, input_file)
-
-
-        # Run simulations
-        self.run_simulation()
-        self.move_output_files()
+        # Prepare input files and run simulations, in speculative mode stopping those that
+        # can no longer change the result
+        structures_dir = os.path.join(self.script_dir, 'structure_database')
+        candidates = self.scenario_candidates(excluded_structure_list)
+        self.refine_scenarios(
+            lambda: self.prepare_RWP_input_file(structures_list, input_file),
+            lambda: self.create_all_structures_addition_inp_file(structures_list, excluded_structure_list, input_file,
+                                                                 structures_dir),
+            prune=self.speculative_pruner(
+                candidates, lambda: self.combine_scenario_results(structures_list, excluded_structure_list), "RWPAddition"),
+        )
         # Parse output files
         logging.info("Parsing output files")
-        parsed_data_RWP = self.parse_output_RWP(structures_list, excluded_structure_list)
-        logging.info(f"RWP data: {parsed_data_RWP}")
-        parsed_data_RWP_percentage_weight = self.parse_output_RWP_percentage_weight(structures_list, excluded_structure_list)
-        parsed_data_RWP_crystallite_size = self.parse_output_crystallite_size_with_exclusions(structures_list, excluded_structure_list)
-
-
-        combined_data = self.combine_parsed_data(
-            RWP=parsed_data_RWP,
-            percentage_weight=parsed_data_RWP_percentage_weight,
-            crystallite_size=parsed_data_RWP_crystallite_size
-        )
+        combined_data = self.combine_scenario_results(structures_list, excluded_structure_list)
 
         logging.info(f"Combined data: {combined_data}")
         # Collate data
-        self.screen_data(combined_data, task_type="RWPAddition")
+        self.screen_data(combined_data, task_type="RWPAddition", not_evaluated=self.not_evaluated(candidates))
         self.clear_input_output_files()
 
 
-    def prepare_RWP_input_file(self, structures_list, excluded_structure_list, input_file):
+    def prepare_RWP_input_file(self, structures_list, input_file):
         self.logger.info("Preparing input files for Addition RWP Task")
 
         # Ensure input directory exists
@@ -1014,30 +1340,22 @@ class RWPAdditionTask(BaseTask):
         # Path to the structures directory (assuming it's in the script directory)
         structures_dir = os.path.join(self.script_dir, 'structure_database')
 
-        self.create_all_structures_addition_inp_file(structures_list, excluded_structure_list, input_file, structures_dir)
+        # Create the baseline input file; the scenarios that each add one excluded structure
+        # are written by create_all_structures_addition_inp_file
         self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
 
     def create_all_structures_addition_inp_file(self, structures_list, excluded_structure_list, input_file, structures_dir):
 
         #for each excluded structure in the excluded_structure_list
-        #add the structure to the structures_list
+        #create a scenario with the structure added back to the structures_list
+        scenarios = {}
         for excluded_structure in excluded_structure_list:
             #get the structure name without the .str extension
             structure_name = os.path.splitext(excluded_structure)[0]
-            #add the structure to the structures_list
-
-            #append .str to each excluded_structure
-            excluded_structure = excluded_structure+'.str'
-
-            structures_list.append(excluded_structure)
-            logging.info(f"Structure list: {structures_list} with excluded structure {excluded_structure}")
-            #create the input file for the structure list
-            self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
-            #rename the input file to the all_structures_{structure_name}.inp
-            os.rename(os.path.join(self.input_dir, 'all_structures.inp'), os.path.join(self.input_dir, f'all_structures_{structure_name}.inp'))
-            #remove the structure from the structures_list
-            structures_list.remove(excluded_structure)
-            logging.info(f"Structure list: {structures_list} without excluded structure {excluded_structure}")
+            scenario_list = structures_list + [excluded_structure + '.str']
+            scenarios[f'all_structures_{structure_name}.inp'] = scenario_list
+            logging.info(f"Structure list: {scenario_list} with excluded structure {excluded_structure}")
+        self.write_scenario_files(scenarios, structures_dir)
 
 class RWPMissingTask(BaseTask):
     def run(self):
@@ -1067,18 +1385,18 @@ class RWPMissingTask(BaseTask):
             self.logger.error("No 'structures_list' found in input data")
             return
 
-        # Prepare input files
-        self.prepare_all_structures_input_file(structures_list, input_file)
+        # Prepare input files and run simulations
+        structures_dir = os.path.join(self.script_dir, 'structure_database')
+        self.refine_scenarios(
+            lambda: self.prepare_all_structures_input_file(structures_list, input_file),
+            lambda: self.create_all_structures_missing_inp_files(structures_list, structures_dir),
+        )
 
         for structure in structures_list:
             logging.info(f"Adding Structure to excluded list: {structure}")
             structure_name = remove_suffix(structure, '.str')
             logging.info(f"Structure name: {structure_name}")
             excluded_structure_list.append(structure_name)
-
-        # Run simulations
-        self.run_simulation()
-        self.move_output_files()
         # Parse output files
         logging.info("Parsing output files")
         parsed_data_RWP = self.parse_output_RWP_negative(structures_list, excluded_structure_list)
@@ -1115,8 +1433,8 @@ class RWPMissingTask(BaseTask):
         # Path to the structures directory (assuming it's in the script directory)
         structures_dir = os.path.join(self.script_dir, 'structure_database')
 
+        # The scenarios that each leave one structure out are written by create_all_structures_missing_inp_files
         self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
-        self.create_all_structures_missing_inp_files(structures_list, structures_dir)
 
 
 
@@ -1129,69 +1447,18 @@ class RWPMissingTask(BaseTask):
         :param structures_list: List of structure file names.
         :param structures_dir: Directory where structure files are located.
         """
-        original_start_inp_path = os.path.join(self.script_dir, 'start.inp')
-        if not os.path.exists(original_start_inp_path):
-            self.logger.error(f"Template file {original_start_inp_path} not found.")
-            return
-
-        # Read the original 'start.inp' file lines
-        with open(original_start_inp_path, 'r') as start_inp_file:
-            start_inp_lines = start_inp_file.readlines()
-
-        # Modify the first line with your XDD input file name
-        input_file = self.data.get('input_file', 'default_input.xdd')
-        start_inp_lines[0] = f'   xdd "{input_file}"\n'
-
-        # Modify the polynomial line (assuming it is line index 3 in 'start.inp')
-        polynomial_number = self.parameters.get('polynomial', '3')
-        start_inp_lines[3] = f'   bkg @ {"0 " * int(polynomial_number)}\n'
-
-        # Load all structure contents into a dictionary {structure_name: file_content}
-        structure_files_content = {}
-        for structure_name in structures_list:
-            structure_file_path = None
-            # Search for the structure file
-            for root, dirs, files in os.walk(structures_dir):
-                if structure_name in files:
-                    structure_file_path = os.path.join(root, structure_name)
-                    break
-
-            if not structure_file_path:
-                self.logger.error(f"Structure file {structure_name} not found in {structures_dir}.")
-                # You can skip or raise an exception; this code skips.
-                continue
-
-            with open(structure_file_path, 'r') as structure_file:
-                structure_files_content[structure_name] = structure_file.read()
+        # Each structure is read once and shared by every scenario it appears in
+        structure_files_content = self.load_structure_contents(structures_list, structures_dir)
+        loaded_structures = list(structure_files_content)
 
         # Create a separate file for each structure, omitting that structure
-        for exclude_structure in structures_list:
-            # If we never loaded it (file not found earlier), skip
-            if exclude_structure not in structure_files_content:
-                continue
-
+        scenarios = {}
+        for exclude_structure in loaded_structures:
             exclude_structure_name = os.path.splitext(exclude_structure)[0]
-
-            # Destination file path
-            out_file_name = f"all_structures_{exclude_structure_name}.inp"
-            all_structures_inp_path = os.path.join(self.input_dir, out_file_name)
-
-            # Write the modified 'start.inp' lines plus all structures except `exclude_structure`
-            with open(all_structures_inp_path, 'w') as inp_file:
-                # Write the modified header
-                inp_file.writelines(start_inp_lines)
-
-                # Write the content for every structure except the excluded one
-                for structure_name, content in structure_files_content.items():
-                    if structure_name == exclude_structure:
-                        continue
-                    inp_file.write(f"\n/*{structure_name}_START*/\n")
-                    inp_file.write(content)
-                    inp_file.write(f"\n/*{structure_name}_END*/\n")
-
-            self.logger.info(
-                f"Created {out_file_name} with all structures except '{exclude_structure}'."
-            )
+            scenarios[f"all_structures_{exclude_structure_name}.inp"] = [
+                s for s in loaded_structures if s != exclude_structure
+            ]
+        self.write_scenario_files(scenarios, structures_dir, structure_contents=structure_files_content)
 
 
 class RWPRemovalTask(BaseTask):
@@ -1224,30 +1491,24 @@ class RWPRemovalTask(BaseTask):
             self.logger.error("No 'structures_list' found in input data")
             return
 
-        # Prepare input files
-        self.prepare_removal_RWP_input_file(structures_list, excluded_structure_list, input_file)
-
-
-        # Run simulations
-        self.run_simulation()
-        self.move_output_files()
+        # Prepare input files and run simulations, in speculative mode stopping those that
+        # can no longer change the result
+        structures_dir = os.path.join(self.script_dir, 'structure_database')
+        candidates = self.scenario_candidates(excluded_structure_list)
+        self.refine_scenarios(
+            lambda: self.prepare_removal_RWP_input_file(structures_list, input_file),
+            lambda: self.create_all_structures_addition_inp_file(structures_list, excluded_structure_list, input_file,
+                                                                 structures_dir),
+            prune=self.speculative_pruner(
+                candidates, lambda: self.combine_scenario_results(structures_list, excluded_structure_list), "RWPRemoval"),
+        )
         # Parse output files
         logging.info("Parsing output files")
-        parsed_data_RWP = self.parse_output_RWP(structures_list, excluded_structure_list)
-        logging.info(f"RWP data: {parsed_data_RWP}")
-        parsed_data_RWP_percentage_weight = self.parse_output_RWP_percentage_weight(structures_list, excluded_structure_list)
-        parsed_data_RWP_crystallite_size = self.parse_output_crystallite_size_with_exclusions(structures_list, excluded_structure_list)
-
-
-        combined_data = self.combine_parsed_data(
-            RWP=parsed_data_RWP,
-            percentage_weight=parsed_data_RWP_percentage_weight,
-            crystallite_size=parsed_data_RWP_crystallite_size
-        )
+        combined_data = self.combine_scenario_results(structures_list, excluded_structure_list)
 
         logging.info(f"Combined data: {combined_data}")
         # Collate data
-        self.screen_data(combined_data, task_type="RWPRemoval")
+        self.screen_data(combined_data, task_type="RWPRemoval", not_evaluated=self.not_evaluated(candidates))
         self.clear_input_output_files()
 
 
@@ -1263,7 +1524,7 @@ class RWPRemovalTask(BaseTask):
         self.create_all_structures_addition_inp_file(structures_list, excluded_structure_list, input_file, structures_dir)
         self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
 
-    def prepare_removal_RWP_input_file(self, structures_list, excluded_structure_list, input_file):
+    def prepare_removal_RWP_input_file(self, structures_list, input_file):
         self.logger.info("Preparing input files for Addition RWP Task")
 
         # Ensure input directory exists
@@ -1272,55 +1533,38 @@ class RWPRemovalTask(BaseTask):
         # Path to the structures directory (assuming it's in the script directory)
         structures_dir = os.path.join(self.script_dir, 'structure_database')
 
-        self.create_all_structures_addition_inp_file(structures_list, excluded_structure_list, input_file,
-                                                     structures_dir)
+        # Create the baseline input file; the scenarios are written by
+        # create_all_structures_addition_inp_file
         self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
 
     def create_all_structures_addition_inp_file(self, structures_list, excluded_structure_list, input_file, structures_dir):
 
         #for each excluded structure in the excluded_structure_list
-        #add the structure to the structures_list
+        #create a scenario with the structure added back to the structures_list
+        scenarios = {}
         for excluded_structure in excluded_structure_list:
             #get the structure name without the .str extension
             structure_name = os.path.splitext(excluded_structure)[0]
-            #add the structure to the structures_list
-
-            #append .str to each excluded_structure
-            excluded_structure = excluded_structure+'.str'
-
-            structures_list.append(excluded_structure)
-            logging.info(f"Structure list: {structures_list} with excluded structure {excluded_structure}")
-            #create the input file for the structure list
-            self.create_all_structures_inp_file(structures_list, input_file, structures_dir)
-            #rename the input file to the all_structures_{structure_name}.inp
-            os.rename(os.path.join(self.input_dir, 'all_structures.inp'), os.path.join(self.input_dir, f'all_structures_{structure_name}.inp'))
-            #remove the structure from the structures_list
-            structures_list.remove(excluded_structure)
-            logging.info(f"Structure list: {structures_list} without excluded structure {excluded_structure}")
+            scenario_list = structures_list + [excluded_structure + '.str']
+            scenarios[f'all_structures_{structure_name}.inp'] = scenario_list
+            logging.info(f"Structure list: {scenario_list} with excluded structure {excluded_structure}")
+        self.write_scenario_files(scenarios, structures_dir)
 
     def create_all_structures_removal_inp_file(self, structures_list, excluded_structure_list, input_file, structures_dir):
 
         total_structures_list = [structure + '.str' for structure in excluded_structure_list] + structures_list
 
         #for each excluded structure in the excluded_structure_list
-        #add the structure to the structures_list
+        #create a scenario with the structure removed from the total list
+        scenarios = {}
         for excluded_structure in excluded_structure_list:
             #get the structure name without the .str extension
             structure_name = os.path.splitext(excluded_structure)[0]
-            #add the structure to the structures_list
-
-            #append .str to each excluded_structure
-            excluded_structure = excluded_structure+'.str'
-
-            total_structures_list.remove(excluded_structure)
-            logging.info(f"Structure list: {total_structures_list} without excluded structure {excluded_structure}")
-            #create the input file for the structure list
-            self.create_all_structures_inp_file(total_structures_list, input_file, structures_dir)
-            #rename the input file to the all_structures_{structure_name}.inp
-            os.rename(os.path.join(self.input_dir, 'all_structures.inp'), os.path.join(self.input_dir, f'all_structures_{structure_name}.inp'))
-            #remove the structure from the structures_list
-            total_structures_list.append(excluded_structure)
-            logging.info(f"Structure list: {structures_list} with excluded structure {excluded_structure}")
+            scenario_list = list(total_structures_list)
+            scenario_list.remove(excluded_structure + '.str')
+            scenarios[f'all_structures_{structure_name}.inp'] = scenario_list
+            logging.info(f"Structure list: {scenario_list} without excluded structure {excluded_structure}")
+        self.write_scenario_files(scenarios, structures_dir)
 
 class CombineListsTask(BaseTask):
     def run(self):
@@ -689,6 +689,11 @@ class NodeCustomizationDialog(QDialog):
         self.list2_entry = None
         self.structure_list_entry = None
         self.external_list_entry = None
+        self.worst_batch_widget = None
+        self.batch_fraction_entry = None
+        self.batch_min_candidates_entry = None
+        self.confidence_gap_entry = None
+        self.speculative_cancel_checkbox = None
 
 
 
@@ -732,7 +737,7 @@ class NodeCustomizationDialog(QDialog):
             # Exclusion Criteria
             exclusion_criteria_label = QLabel("Exclusion Criteria:")
             self.parameters_frame.addWidget(exclusion_criteria_label)
-            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined']
+            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined', 'Worst Batch']
             self.exclusion_criteria_combobox = QComboBox()
             self.exclusion_criteria_combobox.addItems(exclusion_criteria)
             current_criteria = parameters.get('exclusion_criteria', exclusion_criteria[0])
@@ -744,6 +749,7 @@ class NodeCustomizationDialog(QDialog):
             self.parameters_frame.addWidget(confidence_label)
             self.confidence_entry = QLineEdit(parameters.get('confidence', '0.5'))
             self.parameters_frame.addWidget(self.confidence_entry)
+            self.create_worst_batch_widgets(parameters)
 
         elif task_type == 'RWP Addition':
             # Parameters common to Crystallite Size and RWP
@@ -780,7 +786,7 @@ class NodeCustomizationDialog(QDialog):
             # Exclusion Criteria
             exclusion_criteria_label = QLabel("Exclusion Criteria:")
             self.parameters_frame.addWidget(exclusion_criteria_label)
-            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined']
+            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined', 'Worst Batch']
             self.exclusion_criteria_combobox = QComboBox()
             self.exclusion_criteria_combobox.addItems(exclusion_criteria)
             current_criteria = parameters.get('exclusion_criteria', exclusion_criteria[0])
@@ -792,6 +798,8 @@ class NodeCustomizationDialog(QDialog):
             self.parameters_frame.addWidget(confidence_label)
             self.confidence_entry = QLineEdit(parameters.get('confidence', '0.95'))
             self.parameters_frame.addWidget(self.confidence_entry)
+            self.create_worst_batch_widgets(parameters)
+            self.create_speculative_cancel_widget(parameters)
 
         elif task_type == 'RWP Missing':
             # Parameters common to Crystallite Size and RWP
@@ -828,7 +836,7 @@ class NodeCustomizationDialog(QDialog):
             # Exclusion Criteria
             exclusion_criteria_label = QLabel("Exclusion Criteria:")
             self.parameters_frame.addWidget(exclusion_criteria_label)
-            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined']
+            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined', 'Worst Batch']
             self.exclusion_criteria_combobox = QComboBox()
             self.exclusion_criteria_combobox.addItems(exclusion_criteria)
             current_criteria = parameters.get('exclusion_criteria', exclusion_criteria[0])
@@ -840,6 +848,7 @@ class NodeCustomizationDialog(QDialog):
             self.parameters_frame.addWidget(confidence_label)
             self.confidence_entry = QLineEdit(parameters.get('confidence', '0.95'))
             self.parameters_frame.addWidget(self.confidence_entry)
+            self.create_worst_batch_widgets(parameters)
 
         elif task_type == 'RWP Removal':
             # Parameters common to Crystallite Size and RWP
@@ -876,7 +885,7 @@ class NodeCustomizationDialog(QDialog):
             # Exclusion Criteria
             exclusion_criteria_label = QLabel("Exclusion Criteria:")
             self.parameters_frame.addWidget(exclusion_criteria_label)
-            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined']
+            exclusion_criteria = ['Worst', 'Failing', 'Worst Negative', 'Failing Z-Score', 'All Failing Except Best','Worst Combined', 'Failing Combined', 'Worst Negative Combined', 'Failing Z-Score Combined', 'All Failing Except Best Combined', 'Worst Batch']
             self.exclusion_criteria_combobox = QComboBox()
             self.exclusion_criteria_combobox.addItems(exclusion_criteria)
             current_criteria = parameters.get('exclusion_criteria', exclusion_criteria[0])
@@ -888,6 +897,8 @@ class NodeCustomizationDialog(QDialog):
             self.parameters_frame.addWidget(confidence_label)
             self.confidence_entry = QLineEdit(parameters.get('confidence', '0.95'))
             self.parameters_frame.addWidget(self.confidence_entry)
+            self.create_worst_batch_widgets(parameters)
+            self.create_speculative_cancel_widget(parameters)
 
         elif task_type == 'Compare':
             # Parameters for Compare
@@ -951,6 +962,46 @@ class NodeCustomizationDialog(QDialog):
 
             self.parameters_frame.addWidget(self.structurelist1_combobox)
 
+    def create_worst_batch_widgets(self, parameters):
+        # Settings of the 'Worst Batch' criteria, only shown while it is selected
+        self.worst_batch_widget = QWidget()
+        worst_batch_layout = QVBoxLayout(self.worst_batch_widget)
+        worst_batch_layout.setContentsMargins(0, 0, 0, 0)
+
+        worst_batch_layout.addWidget(QLabel("Batch Fraction (share of candidates removed per iteration):"))
+        self.batch_fraction_entry = QLineEdit(str(parameters.get('batch_fraction', '0.25')))
+        worst_batch_layout.addWidget(self.batch_fraction_entry)
+
+        worst_batch_layout.addWidget(QLabel("Batch Min. Candidates (remove one at a time from here on):"))
+        self.batch_min_candidates_entry = QLineEdit(str(parameters.get('batch_min_candidates', '4')))
+        worst_batch_layout.addWidget(self.batch_min_candidates_entry)
+
+        worst_batch_layout.addWidget(QLabel("Confidence Gap (fraction of the median score, 0 = off):"))
+        self.confidence_gap_entry = QLineEdit(str(parameters.get('confidence_gap', '0.0')))
+        worst_batch_layout.addWidget(self.confidence_gap_entry)
+
+        self.parameters_frame.addWidget(self.worst_batch_widget)
+        self.exclusion_criteria_combobox.currentTextChanged.connect(self.toggle_worst_batch_widgets)
+        self.toggle_worst_batch_widgets(self.exclusion_criteria_combobox.currentText())
+
+    def toggle_worst_batch_widgets(self, exclusion_criteria):
+        if self.worst_batch_widget is not None:
+            self.worst_batch_widget.setVisible(exclusion_criteria == 'Worst Batch')
+
+    def save_worst_batch_parameters(self, parameters):
+        if self.exclusion_criteria_combobox.currentText() == 'Worst Batch':
+            parameters['batch_fraction'] = self.batch_fraction_entry.text()
+            parameters['batch_min_candidates'] = self.batch_min_candidates_entry.text()
+            parameters['confidence_gap'] = self.confidence_gap_entry.text()
+
+    def create_speculative_cancel_widget(self, parameters):
+        # Stop leave-one-out refinements once they can no longer change the excluded structure
+        # ('Worst' criteria with RWP screening only, see tasks.SpeculativePruner)
+        self.speculative_cancel_checkbox = QCheckBox("Stop refinements that cannot change the excluded structure")
+        self.speculative_cancel_checkbox.setChecked(
+            str(parameters.get('speculative_cancel', 'false')).strip().lower() in ('true', '1', 'yes'))
+        self.parameters_frame.addWidget(self.speculative_cancel_checkbox)
+
     def create_incoming_connections_widgets(self):
         incoming_edges = list(self.G.in_edges(self.node['id']))
         self.incoming_params_checkboxes = []
@@ -1153,6 +1204,7 @@ class NodeCustomizationDialog(QDialog):
             parameters['exclusion_variable'] = self.exclusion_variable_combobox.currentText()
             parameters['exclusion_criteria'] = self.exclusion_criteria_combobox.currentText()
             parameters['confidence'] = self.confidence_entry.text() if self.confidence_entry else '0.50'
+            self.save_worst_batch_parameters(parameters)
             self.node['parameters'] = parameters
             self.logger.debug(f"Node updated with parameters: {parameters}")
         elif task_type == 'RWP Addition':
@@ -1163,6 +1215,8 @@ class NodeCustomizationDialog(QDialog):
             parameters['exclusion_variable'] = self.exclusion_variable_combobox.currentText()
             parameters['exclusion_criteria'] = self.exclusion_criteria_combobox.currentText()
             parameters['confidence'] = self.confidence_entry.text() if self.confidence_entry else '0.50'
+            self.save_worst_batch_parameters(parameters)
+            parameters['speculative_cancel'] = 'true' if self.speculative_cancel_checkbox.isChecked() else 'false'
             self.node['parameters'] = parameters
             self.logger.debug(f"Node updated with parameters: {parameters}")
         elif task_type == 'RWP Missing':
@@ -1173,6 +1227,7 @@ class NodeCustomizationDialog(QDialog):
             parameters['exclusion_variable'] = self.exclusion_variable_combobox.currentText()
             parameters['exclusion_criteria'] = self.exclusion_criteria_combobox.currentText()
             parameters['confidence'] = self.confidence_entry.text() if self.confidence_entry else '0.50'
+            self.save_worst_batch_parameters(parameters)
             self.node['parameters'] = parameters
             self.logger.debug(f"Node updated with parameters: {parameters}")
         elif task_type == 'RWP Removal':
@@ -1183,6 +1238,8 @@ class NodeCustomizationDialog(QDialog):
             parameters['exclusion_variable'] = self.exclusion_variable_combobox.currentText()
             parameters['exclusion_criteria'] = self.exclusion_criteria_combobox.currentText()
             parameters['confidence'] = self.confidence_entry.text() if self.confidence_entry else '0.50'
+            self.save_worst_batch_parameters(parameters)
+            parameters['speculative_cancel'] = 'true' if self.speculative_cancel_checkbox.isChecked() else 'false'
             self.node['parameters'] = parameters
             self.logger.debug(f"Node updated with parameters: {parameters}")
         elif task_type == 'Compare':
@@ -0,0 +1,171 @@
+import copy
+import os
+import sys
+
+import numpy as np
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import tasks  # noqa: F401  (exclusion_tasks imports tasks, which must be loaded first)
+import exclusion_criteria_tasks
+from exclusion_tasks import CrystalliteSizeExclusionTask
+from scoring import SampleTable
+
+
+def structure(pw, rwp, cs):
+    return {'percentage_weight': pw, 'RWP': rwp, 'crystallite_size': cs}
+
+
+# parsed_data as the exclusion tasks hand it to a criterion: every refined structure plus
+# the valid and invalid lists of the screening
+FIXTURES = {
+    'rwp_and_cs': {
+        'Quartz': structure(42.1, 0.012, 850.0),
+        'Calcite': structure(3.4, 0.031, 120.0),
+        'Dolomite': structure(0.8, 0.047, 60.0),
+        'Gypsum': structure(12.9, -0.004, 1400.0),
+        'Anhydrite': structure(1.7, 0.022, 310.0),
+        'valid_structures': ['Quartz', 'Gypsum'],
+        'invalid_structures': ['Calcite', 'Dolomite', 'Anhydrite'],
+    },
+    'cs_only': {
+        'Alite': structure(61.0, None, 180.0),
+        'Belite': structure(18.5, None, 95.0),
+        'C3A': structure(6.2, None, 55.0),
+        'C4AF': structure(11.3, None, 140.0),
+        'valid_structures': ['Alite', 'C4AF'],
+        'invalid_structures': ['Belite', 'C3A'],
+    },
+    'mixed_metrics': {
+        'Quartz': structure(35.0, 0.015, 900.0),
+        'Calcite': structure(9.8, None, 210.0),
+        'Dolomite': structure(2.1, 0.041, None),
+        'Gypsum': structure(0.4, 0.008, 45.0),
+        'Periclase': structure(4.6, None, 75.0),
+        'Lime': structure(None, 0.05, 300.0),
+        'valid_structures': ['Quartz', 'Calcite'],
+        'invalid_structures': ['Dolomite', 'Gypsum', 'Periclase', 'Lime'],
+    },
+}
+
+# What the per-structure criteria decided before their ranking moved to scoring.py
+# (commit 17e82d5): {criteria: {fixture: (excluded structures, structures kept)}}
+EXPECTED = {
+    'WorstExclusionCriteriaTask': {
+        'rwp_and_cs': ('Anhydrite', ['Quartz', 'Calcite', 'Dolomite', 'Gypsum']),
+        'cs_only': ('C3A', ['Alite', 'Belite', 'C4AF']),
+        'mixed_metrics': ('Quartz', ['Calcite', 'Dolomite', 'Gypsum', 'Periclase', 'Lime']),
+    },
+    'WorstCombinedExclusionCriteriaTask': {
+        'rwp_and_cs': ('Dolomite', ['Quartz', 'Calcite', 'Gypsum', 'Anhydrite']),
+        'cs_only': ('C3A', ['Alite', 'Belite', 'C4AF']),
+        'mixed_metrics': ('Dolomite', ['Quartz', 'Calcite', 'Gypsum', 'Periclase', 'Lime']),
+    },
+    'WorstNegativeExclusionCriteriaTask': {
+        'rwp_and_cs': ('Dolomite', ['Calcite', 'Anhydrite', 'Quartz', 'Gypsum']),
+        'cs_only': ('C3A', ['Belite', 'Alite', 'C4AF']),
+        'mixed_metrics': ('Gypsum', ['Dolomite', 'Periclase', 'Lime', 'Quartz', 'Calcite']),
+    },
+    'WorstNegativeCombinedExclusionCriteriaTask': {
+        'rwp_and_cs': ('Dolomite', ['Calcite', 'Anhydrite', 'Quartz', 'Gypsum']),
+        'cs_only': ('C3A', ['Belite', 'Alite', 'C4AF']),
+        'mixed_metrics': ('Gypsum', ['Dolomite', 'Periclase', 'Lime', 'Quartz', 'Calcite']),
+    },
+    'FailingExclusionCriteriaTask': {
+        'rwp_and_cs': (['Calcite', 'Dolomite', 'Anhydrite'], ['Quartz', 'Gypsum']),
+        'cs_only': (['Belite', 'C3A'], ['Alite', 'C4AF']),
+        'mixed_metrics': (['Dolomite', 'Gypsum', 'Periclase', 'Lime'], ['Quartz', 'Calcite']),
+    },
+}
+
+# Failing Z-Score with a confidence of 0.5: {task type: {fixture: excluded structures}}
+EXPECTED_FAILING_Z_SCORE = {
+    'RWPAddition': {
+        'rwp_and_cs': ['Dolomite'],
+        'cs_only': ['C3A'],
+        'mixed_metrics': ['Periclase', 'Gypsum'],
+    },
+    'RWPRemoval': {
+        'rwp_and_cs': ['Anhydrite'],
+        'cs_only': ['C3A'],
+        'mixed_metrics': ['Periclase', 'Dolomite', 'Gypsum'],
+    },
+}
+
+
+def run_criterion(class_name, parameters, parsed_data):
+    return getattr(exclusion_criteria_tasks, class_name)(parameters=parameters).run(copy.deepcopy(parsed_data))
+
+
+@pytest.mark.parametrize('fixture', FIXTURES)
+@pytest.mark.parametrize('class_name', EXPECTED)
+def test_criteria_match_baseline(class_name, fixture):
+    excluded, kept = EXPECTED[class_name][fixture]
+    screened = run_criterion(class_name, {}, FIXTURES[fixture])
+    assert screened['excluded_structure_list'] == excluded
+    assert screened['structures_list'] == [name + '.str' for name in kept]
+    assert screened['valid_structures'] == FIXTURES[fixture]['valid_structures']
+    assert screened['invalid_structures'] == FIXTURES[fixture]['invalid_structures']
+
+
+@pytest.mark.parametrize('fixture', FIXTURES)
+@pytest.mark.parametrize('task_type', EXPECTED_FAILING_Z_SCORE)
+def test_failing_z_score_matches_baseline(task_type, fixture):
+    parameters = {'confidence': 0.5, 'task_type': task_type}
+    screened = run_criterion('FailingZScoreExclusionCriteriaTask', parameters, FIXTURES[fixture])
+    excluded = EXPECTED_FAILING_Z_SCORE[task_type][fixture]
+    parsed_data = FIXTURES[fixture]
+    assert screened['excluded_structure_list'] == excluded
+    assert screened['structures_list'] == [
+        name + '.str' for name in parsed_data['valid_structures'] + parsed_data['invalid_structures']
+        if name not in excluded]
+
+
+def production_day(sample_count=12, seed=7):
+    """Samples of one production day as {sample name: parsed_data} of refined structures."""
+    rng = np.random.default_rng(seed)
+    names = ['Alite', 'Belite', 'C3A', 'C4AF', 'Periclase', 'Lime', 'Gypsum']
+    samples = {}
+    for sample in range(sample_count):
+        parsed_data = {}
+        for name in names:
+            if rng.random() < 0.15:
+                continue
+            parsed_data[name] = structure(
+                round(float(rng.uniform(0.0, 20.0)), 3),
+                round(float(rng.uniform(0.005, 0.08)), 4) if rng.random() < 0.8 else None,
+                round(float(rng.uniform(10.0, 1800.0)), 1) if rng.random() < 0.9 else None)
+        samples[f'Sample_{sample:02d}'] = parsed_data
+    return samples
+
+
+@pytest.mark.parametrize('exclusion_criteria', ['Worst', 'Failing', 'Worst Negative', 'Worst Combined'])
+def test_run_batch_matches_per_sample_run(exclusion_criteria):
+    parameters = {'exclusion_criteria': exclusion_criteria}
+    samples = production_day()
+    batch = CrystalliteSizeExclusionTask(parameters).run_batch(SampleTable.from_samples(samples))
+
+    assert list(batch) == list(samples)
+    for sample_name, parsed_data in samples.items():
+        result = batch[sample_name]
+        try:
+            screened = CrystalliteSizeExclusionTask(parameters).run(copy.deepcopy(parsed_data))
+        except IndexError:
+            # Nothing the criterion ranks; the batch leaves the sample unchanged
+            assert result['excluded_structure_list'] == [], sample_name
+            assert sorted(result['structures_list']) == sorted(name + '.str' for name in parsed_data), sample_name
+            continue
+        assert set(result['valid_structures']) == set(screened['valid_structures']), sample_name
+        assert set(result['invalid_structures']) == set(screened['invalid_structures']), sample_name
+        assert sorted(result['excluded_structure_list']) == sorted(screened['excluded_structure_list']), sample_name
+        assert sorted(result['structures_list']) == sorted(screened['structures_list']), sample_name
+
+
+@pytest.mark.parametrize('exclusion_criteria', ['Worst', 'Worst Batch', 'Failing'])
+def test_exclusion_task_reports_excluded_structures_as_a_list(exclusion_criteria):
+    parsed_data = production_day(sample_count=1)['Sample_00']
+    screened = CrystalliteSizeExclusionTask({'exclusion_criteria': exclusion_criteria}).run(parsed_data)
+    assert isinstance(screened['excluded_structure_list'], list)
+    assert all(name in parsed_data for name in screened['excluded_structure_list'])
@@ -0,0 +1,139 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tasks  # noqa: F401  (exclusion_tasks imports tasks, which must be loaded first)
+import exclusion_criteria_tasks
+from scoring import SCORE_DTYPE, ScoreBounds, ScoreTable, certain_lowest
+
+CRITERIA = ['WorstExclusionCriteriaTask', 'WorstNegativeExclusionCriteriaTask', 'WorstCombinedExclusionCriteriaTask']
+
+
+def criterion_options(class_name):
+    criterion = getattr(exclusion_criteria_tasks, class_name)(parameters={})
+    return {'separate_distributions': criterion.separate_distributions,
+            'all_metrics': criterion.all_metrics, 'rwp_sign': criterion.rwp_sign()}
+
+
+def excluded_by_criterion(class_name, names, values):
+    """The structure the full criteria task excludes with these values."""
+    parsed_data = {}
+    for name, (pw, rwp, cs) in zip(names, values.tolist()):
+        parsed_data[name] = {'percentage_weight': pw,
+                             'RWP': None if np.isnan(rwp) else rwp,
+                             'crystallite_size': None if np.isnan(cs) else cs}
+    parsed_data['valid_structures'] = []
+    parsed_data['invalid_structures'] = list(names)
+    screened = getattr(exclusion_criteria_tasks, class_name)(parameters={}).run(parsed_data)
+    return screened['excluded_structure_list']
+
+
+def bounded_scenario(rng):
+    """
+    Structures of which some are only known to lie in a box, as for the speculative pruner:
+    (names, lower, upper, indices of the unknown structures). Half of the scenarios have no
+    crystallite sizes; standardised against the RWP distribution these push most scores
+    to where norm.cdf saturates and nothing is certain.
+    """
+    count = int(rng.integers(3, 9))
+    names = [f'Phase{index}' for index in range(count)]
+    values = np.zeros(count, dtype=SCORE_DTYPE)
+    values['pw'] = rng.uniform(0.0, 30.0, count)
+    values['rwp'] = rng.uniform(-0.2, 0.3, count)
+    values['cs'] = rng.uniform(50.0, 2000.0, count) if rng.random() < 0.5 else np.nan
+    # Structures missing one of the metrics, never both (those are not scored)
+    if rng.random() < 0.3 and not np.isnan(values['cs']).all():
+        values['rwp'][rng.integers(count)] = np.nan
+    lower, upper = values.copy(), values.copy()
+    unknown = rng.choice(count, size=int(rng.integers(1, 3)), replace=False)
+    for index in unknown:
+        # From the full range the pruner uses down to a narrow box
+        pw_width, rwp_width = (100.0, 1.0) if rng.random() < 0.3 else (rng.uniform(0.0, 5.0), rng.uniform(0.0, 0.05))
+        pw = rng.uniform(0.0, 30.0)
+        rwp = rng.uniform(-0.2, 0.3)
+        lower['pw'][index], upper['pw'][index] = max(pw - pw_width, 0.0), pw + pw_width
+        lower['rwp'][index], upper['rwp'][index] = rwp - rwp_width, rwp
+        if not np.isnan(values['cs']).all():
+            lower['cs'][index], upper['cs'][index] = 50.0, 2000.0
+    return names, lower, upper, unknown
+
+
+def draw_inside(rng, lower, upper, unknown, sample):
+    values = lower.copy()
+    for index in unknown:
+        for field in ('pw', 'rwp', 'cs'):
+            low, high = lower[field][index], upper[field][index]
+            if np.isnan(low):
+                continue
+            # Alternate between the corners of the box, where the bounds are tightest, and its inside
+            values[field][index] = rng.choice([low, high]) if sample % 2 else rng.uniform(low, high)
+    return values
+
+
+@pytest.mark.parametrize('class_name', CRITERIA)
+def test_certain_lowest_is_what_the_criterion_excludes(class_name):
+    rng = np.random.default_rng(24)
+    options = criterion_options(class_name)
+    claims = 0
+    for _ in range(400):
+        names, lower, upper, unknown = bounded_scenario(rng)
+        lowest = certain_lowest(ScoreTable(names, lower), ScoreTable(names, upper), **options)
+        if lowest is None:
+            continue
+        claims += 1
+        for sample in range(20):
+            values = draw_inside(rng, lower, upper, unknown, sample)
+            assert excluded_by_criterion(class_name, names, values) == names[lowest]
+    # The bounds must decide often enough for the comparison above to mean something
+    assert claims >= 20
+
+
+@pytest.mark.parametrize('class_name', CRITERIA)
+def test_score_bounds_hold_inside_the_box(class_name):
+    from scoring import combined_z_scores
+
+    rng = np.random.default_rng(7)
+    options = criterion_options(class_name)
+    for _ in range(200):
+        names, lower, upper, unknown = bounded_scenario(rng)
+        bounds = ScoreBounds(ScoreTable(names, lower), ScoreTable(names, upper), **options)
+        z_lower, z_upper = bounds.z_scores()
+        worst = int(np.argmin(z_upper))
+        margins = bounds.margins(worst)
+        for sample in range(10):
+            z = combined_z_scores(ScoreTable(names, draw_inside(rng, lower, upper, unknown, sample)), **options)
+            tolerance = 1e-9 + 1e-9 * np.abs(z)
+            assert np.all((z >= z_lower - tolerance) & (z <= z_upper + tolerance))
+            differences = np.delete(z - z[worst], worst)
+            assert np.all(differences >= np.delete(margins, worst) - tolerance[0])
+
+
+def test_certain_lowest_is_none_when_the_intervals_overlap():
+    names = ['Quartz', 'Calcite', 'Dolomite', 'Gypsum']
+    known = np.array([(30.0, 0.02, np.nan), (12.0, 0.03, np.nan), (2.0, 0.06, np.nan), (8.0, 0.025, np.nan)],
+                     dtype=SCORE_DTYPE)
+    assert certain_lowest(ScoreTable(names, known), ScoreTable(names, known)) == 2
+
+    # Gypsum is still refining and could still end up below Dolomite
+    lower, upper = known.copy(), known.copy()
+    lower[3] = (0.0, 0.0, np.nan)
+    upper[3] = (100.0, 0.08, np.nan)
+    assert certain_lowest(ScoreTable(names, lower), ScoreTable(names, upper)) is None
+
+
+def test_certain_lowest_is_none_for_ties():
+    names = ['Quartz', 'Calcite', 'Dolomite']
+    values = np.array([(30.0, 0.02, np.nan), (5.0, 0.05, np.nan), (5.0, 0.05, np.nan)], dtype=SCORE_DTYPE)
+    assert certain_lowest(ScoreTable(names, values), ScoreTable(names, values)) is None
+
+
+def test_certain_lowest_is_none_where_confidences_saturate():
+    # Crystallite sizes standardised against the RWP distribution push every score far
+    # below -30, where norm.cdf cannot tell them apart
+    names = ['Quartz', 'Calcite', 'Dolomite']
+    values = np.array([(30.0, 0.02, 900.0), (5.0, 0.021, 1500.0), (6.0, 0.03, 1200.0)], dtype=SCORE_DTYPE)
+    assert certain_lowest(ScoreTable(names, values), ScoreTable(names, values)) is None
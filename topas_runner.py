@@ -0,0 +1,408 @@
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+
+
+# Memory one tc.exe refinement is assumed to need, used to size the process limit
+DEFAULT_MEMORY_PER_PROCESS_MB = 512
+
+
+def cpu_count():
+    """Cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def available_memory_mb():
+    """Memory available to new processes in MB, None where it cannot be determined."""
+    if os.name == 'nt':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+        return status.ullAvailPhys / (1024 * 1024)
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def load_average():
+    """One-minute load average, None where the platform has none (Windows)."""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+class ProcessLimiter:
+    """
+    Limit on the tc.exe processes running at once, shared by every task, run and sample
+    in this process.
+
+    The limit starts at ``max_processes`` (one per core by default). When adaptive, it is
+    lowered while the machine is busy with other work (the cores left after the load that
+    is not ours) or short of memory for another refinement, and raised again once the
+    pressure is gone. It never drops below one, so analyses
+    always make progress.
+    """
+
+    SAMPLE_INTERVAL = 2.0  # Seconds between load and memory readings
+
+    def __init__(self, max_processes=None, memory_per_process_mb=DEFAULT_MEMORY_PER_PROCESS_MB, adaptive=True):
+        self.cores = cpu_count()
+        self.max_processes = max(1, int(max_processes or self.cores))
+        self.memory_per_process_mb = memory_per_process_mb
+        self.adaptive = adaptive
+        self.running = 0
+        self.limit = self.max_processes
+        self.peak = 0
+        self._sampled_at = 0.0
+        self._history = []  # (time, running) at every reading over the last minute
+        self.condition = threading.Condition()
+        self._waiters = []  # (loop, future) of every coroutine waiting in acquire_async
+
+    def _wake_waiters(self):
+        """Let coroutines waiting for a slot check again; caller holds the condition."""
+        for loop, waiter in self._waiters:
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def set_max_processes(self, max_processes):
+        """Change the limit while refinements are running; waiting ones start if it went up."""
+        with self.condition:
+            self.max_processes = max(1, int(max_processes or self.cores))
+            self._sampled_at = 0.0
+            self.condition.notify_all()
+            self._wake_waiters()
+
+    def _sample(self):
+        """Recompute the limit from the current load and free memory; caller holds the condition."""
+        now = time.monotonic()
+        if now - self._sampled_at < self.SAMPLE_INTERVAL:
+            return
+        self._sampled_at = now
+        limit = self.max_processes
+        # The load average trails by about a minute, so our own refinements count with
+        # the most that ran over that minute
+        self._history = [(t, n) for t, n in self._history if now - t < 60] + [(now, self.running)]
+        if self.adaptive:
+            load = load_average()
+            if load is not None:
+                # Only back off for work that is not ours
+                other_load = max(0.0, load - max(n for t, n in self._history))
+                if other_load >= 1:
+                    limit = min(limit, int(self.cores - other_load))
+            memory_mb = available_memory_mb()
+            if memory_mb is not None and self.memory_per_process_mb:
+                limit = min(limit, self.running + int(memory_mb // self.memory_per_process_mb))
+        self.limit = max(1, limit)
+
+    def acquire(self):
+        with self.condition:
+            self._sample()
+            while self.running >= self.limit:
+                # Wake up now and then to notice pressure going away
+                self.condition.wait(self.SAMPLE_INTERVAL)
+                self._sample()
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    async def acquire_async(self):
+        """``acquire`` for coroutines: waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                self._sample()
+                if self.running < self.limit:
+                    self.running += 1
+                    self.peak = max(self.peak, self.running)
+                    return
+                entry = (loop, loop.create_future())
+                self._waiters.append(entry)
+            try:
+                # Wake up now and then to notice pressure going away
+                await asyncio.wait([entry[1]], timeout=self.SAMPLE_INTERVAL)
+            finally:
+                with self.condition:
+                    self._waiters.remove(entry)
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+            self._wake_waiters()
+
+    def stats(self):
+        with self.condition:
+            return {'running': self.running, 'limit': self.limit, 'max_processes': self.max_processes,
+                    'peak': self.peak, 'cores': self.cores}
+
+
+_process_budget = None
+_budget_lock = threading.Lock()
+
+
+def process_budget_settings(config):
+    """ProcessLimiter arguments from config.txt (max_parallel_processes may be 'auto')."""
+    settings = {'max_processes': None, 'memory_per_process_mb': DEFAULT_MEMORY_PER_PROCESS_MB, 'adaptive': True}
+    try:
+        value = str(config.get('max_parallel_processes', 'auto')).strip().lower()
+        settings['max_processes'] = None if value in ('', 'auto') else int(value)
+    except ValueError:
+        pass
+    try:
+        settings['memory_per_process_mb'] = float(config.get('memory_per_process_mb', DEFAULT_MEMORY_PER_PROCESS_MB))
+    except ValueError:
+        pass
+    settings['adaptive'] = str(config.get('adaptive_concurrency', 'true')).strip().lower() in ('true', '1', 'yes')
+    return settings
+
+
+def set_process_budget(max_processes=None, **settings):
+    """
+    Limit the number of tc.exe processes running at once across the whole process; None
+    sizes it from the core count. Can be called while refinements are running.
+    """
+    global _process_budget
+    with _budget_lock:
+        if _process_budget is None:
+            _process_budget = ProcessLimiter(max_processes, **settings)
+        else:
+            for name, value in settings.items():
+                setattr(_process_budget, name, value)
+            _process_budget.set_max_processes(max_processes)
+        return _process_budget
+
+
+def ensure_process_budget(max_processes=None, **settings):
+    """Set the global tc.exe budget unless a caller (e.g. the batch CLI) already chose one."""
+    global _process_budget
+    with _budget_lock:
+        if _process_budget is None:
+            _process_budget = ProcessLimiter(max_processes, **settings)
+        return _process_budget
+
+
+def process_budget():
+    """The global ProcessLimiter, created with the defaults if nobody set one up."""
+    return ensure_process_budget()
+
+
+@asynccontextmanager
+async def process_slot():
+    """
+    Hold one slot of the global tc.exe budget for the duration of a refinement. Used by
+    coroutines on the shared event loop, so queued refinements take no thread.
+    """
+    budget = process_budget()
+    await budget.acquire_async()
+    try:
+        yield
+    finally:
+        budget.release()
+
+
+class RunCancelled(Exception):
+    """Raised when a refinement or task is stopped because its analysis was cancelled."""
+
+
+class RefinementPruned(Exception):
+    """Raised when a refinement is stopped because its result can no longer change the task's decision."""
+
+
+class RefinementTimeout(subprocess.TimeoutExpired):
+    """Raised when tc.exe runs longer than its wall-clock limit; the process has been killed."""
+
+
+def kill_process_tree(process):
+    """Kill a process (Popen or asyncio) together with any process it started."""
+    if process.returncode is not None or (isinstance(process, subprocess.Popen) and process.poll() is not None):
+        return
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            if isinstance(process, subprocess.Popen):
+                _kill(process)
+            else:
+                # asyncio processes belong to the shared event loop and may only be touched there
+                event_loop().call_soon_threadsafe(_kill, process)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+# Lines of tc.exe output worth reporting, e.g. "Cycle 12 ... Rwp 10.532"
+_CYCLE_PATTERN = re.compile(r'\b(?:cycle|iter(?:ation)?)\s*[:=]?\s*(\d+)', re.IGNORECASE)
+_RWP_PATTERN = re.compile(r'\br_?wp\s*[:=]?\s*(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)', re.IGNORECASE)
+
+
+def parse_progress_line(line):
+    """{'cycle': int, 'rwp': float} as far as a line of tc.exe output tells, None if it tells nothing."""
+    progress = {}
+    match = _CYCLE_PATTERN.search(line)
+    if match:
+        progress['cycle'] = int(match.group(1))
+    match = _RWP_PATTERN.search(line)
+    if match:
+        progress['rwp'] = float(match.group(1))
+    return progress or None
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """
+    The event loop all tc.exe processes are run on, started on a daemon thread on first use.
+
+    Waiting for a process, or for a slot of the process budget, costs no thread of its
+    own, so any number of refinements can be queued and run at once; threads only block
+    on the futures they submit.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            if os.name != 'nt' and sys.version_info < (3, 12) and hasattr(os, 'pidfd_open'):
+                # Older Pythons wait for every child on a thread of its own unless told to use pidfds
+                try:
+                    os.close(os.pidfd_open(os.getpid()))
+                    watcher = asyncio.PidfdChildWatcher()
+                    watcher.attach_loop(_loop)
+                    asyncio.set_child_watcher(watcher)
+                except OSError:
+                    pass
+            threading.Thread(target=_loop.run_forever, name='tc-runner', daemon=True).start()
+        return _loop
+
+
+async def run_process(args, timeout=None, on_line=None, on_start=None):
+    """
+    Run a program without a shell, streaming its output (stderr merged into stdout) line
+    by line to ``on_line`` as it is written.
+
+    Returns a CompletedProcess with the whole output. A process still running after
+    ``timeout`` seconds is killed and RefinementTimeout raised; ``on_start(process)`` is
+    called once the process exists, e.g. to make it cancellable.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        start_new_session=(os.name != 'nt'),
+    )
+    if on_start is not None:
+        on_start(process)
+    lines = []
+
+    async def read_output():
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            lines.append(line)
+            if on_line is not None:
+                on_line(line)
+        return await process.wait()
+
+    try:
+        returncode = await asyncio.wait_for(read_output(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_tree(process)
+        await process.wait()
+        raise RefinementTimeout(list(args), timeout, output='\n'.join(lines)) from None
+    except asyncio.CancelledError:
+        kill_process_tree(process)
+        raise
+    return subprocess.CompletedProcess(list(args), returncode, '\n'.join(lines), '')
+
+
+class RunControl:
+    """
+    Cancellation token shared by an analysis and all of its tasks.
+
+    Every tc.exe started through ``run_exec`` is tracked so that ``cancel`` can kill the
+    refinements that are still running instead of waiting for them to finish.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise RunCancelled()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_tree(process)
+
+    def run_exec(self, args, timeout=None, on_line=None, on_start=None):
+        """
+        Run a program without a shell on the shared event loop, like ``subprocess.run(args, check=True)``
+        but streaming its output to ``on_line`` and killing it after ``timeout`` seconds.
+        ``on_start(process)`` is called once it runs, e.g. to stop this one process later.
+        """
+        return asyncio.run_coroutine_threadsafe(self.exec_async(args, timeout, on_line, on_start),
+                                                event_loop()).result()
+
+    async def exec_async(self, args, timeout=None, on_line=None, on_start=None):
+        """``run_exec`` for coroutines on the shared event loop."""
+        self.check()
+        started = []
+
+        def track(process):
+            with self._lock:
+                self._processes.add(process)
+            started.append(process)
+            if on_start is not None:
+                on_start(process)
+            # Cancelled while it was starting up
+            if self.cancelled:
+                kill_process_tree(process)
+
+        try:
+            result = await run_process(args, timeout, on_line, track)
+        finally:
+            with self._lock:
+                self._processes.difference_update(started)
+        self.check()
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, args, result.stdout, result.stderr)
+        return result
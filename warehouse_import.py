@@ -0,0 +1,284 @@
+"""
+Consolidate the node outputs of every analysis under results/ into one SQLite warehouse.
+
+Three layouts are absorbed:
+    <analysis>/run_*/node_*/iter_*.json     analyses stored as JSON files (or node_*_iter_*.json);
+                                            index.json lists them with absolute paths of the
+                                            machine that ran them, so the folder is walked instead
+    <analysis>/results.db                   analyses stored in SQLite by newer versions
+    node_results/node_X_result_Y.json       the flat layout of the earliest versions
+
+Folders are parsed in a process pool and written by this process, one transaction per
+folder. Every folder is fingerprinted by the names, sizes and modification times of its
+files, so a re-import skips folders it already loaded and re-imports the ones that changed,
+e.g. a results.db whose analysis was resumed.
+
+Example:
+    python warehouse_import.py results --warehouse warehouse.db --workers 8
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from results_store import create_node_output_tables, insert_node_output_rows, read_node_output_rows, transaction
+
+
+FLAT_RESULTS_DIR = 'node_results'
+ITERATION_FILE = re.compile(r'^(?:node_.+_)?iter_(\d+)\.json$')
+FLAT_RESULT_FILE = re.compile(r'^(.+)_result_(\d+)\.json$')
+FOLDER_NAME = re.compile(r'^(.*)_(\d{8})_(\d{6})$')
+
+
+def init_warehouse(warehouse_path):
+    """Open (and create if needed) the warehouse database."""
+    db_conn = sqlite3.connect(warehouse_path)
+    db_conn.execute("PRAGMA journal_mode=WAL;")
+    db_conn.execute("PRAGMA synchronous=NORMAL;")
+    cursor = db_conn.cursor()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            outputs INTEGER,
+            errors TEXT,
+            imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analyses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL UNIQUE,
+            sample TEXT,
+            started DATETIME
+        );
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS node_outputs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            analysis_id INTEGER NOT NULL,
+            run_id TEXT,
+            node_id TEXT,
+            iteration INTEGER,
+            UNIQUE(analysis_id, run_id, node_id, iteration),
+            FOREIGN KEY(analysis_id) REFERENCES analyses(id)
+        );
+        """
+    )
+    create_node_output_tables(cursor, parent_table='node_outputs')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analyses_sample ON analyses(sample, started);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_outputs_node ON node_outputs(node_id, iteration);")
+    # Questions across analyses: which kept a structure, how did one structure's metric vary
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_lists_value ON node_lists(key, value);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_metrics_structure ON node_metrics(structure, metric);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_phase_results_phase ON phase_results(phase_name);")
+    db_conn.commit()
+    return db_conn
+
+
+def source_files(source_path):
+    """The files of a source that are imported, relative to it."""
+    if os.path.basename(source_path) == FLAT_RESULTS_DIR:
+        return sorted(name for name in os.listdir(source_path) if FLAT_RESULT_FILE.match(name))
+    files = [os.path.relpath(path, source_path)
+             for path in glob.glob(os.path.join(source_path, 'run_*', 'node_*', '*iter_*.json'))
+             if ITERATION_FILE.match(os.path.basename(path))]
+    if os.path.isfile(os.path.join(source_path, 'results.db')):
+        files += [name for name in ('results.db', 'results.db-wal') if os.path.isfile(os.path.join(source_path, name))]
+    return sorted(files)
+
+
+def fingerprint(source_path, files):
+    digest = hashlib.sha1()
+    for name in files:
+        stat = os.stat(os.path.join(source_path, name))
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def find_sources(results_root):
+    """[(path, files)] of every analysis folder (and the flat layout) under results_root."""
+    sources = []
+    for name in sorted(os.listdir(results_root)):
+        path = os.path.join(results_root, name)
+        if not os.path.isdir(path):
+            continue
+        files = source_files(path)
+        if files:
+            sources.append((path, files))
+    return sources
+
+
+def _read_results_db(db_path):
+    """(run_id, node_id, iteration, output_data) of every node output in a per-analysis results.db."""
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in db_conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if 'results' not in tables:
+            return []
+        typed = 'node_scalars' in tables
+        outputs = []
+        # Older databases have no id column, the rowid is the same thing
+        rows = db_conn.execute(
+            "SELECT rowid, run_id, node_id, iteration, result_data FROM results ORDER BY rowid"
+        ).fetchall()
+        for result_id, run_id, node_id, iteration, result_data in rows:
+            if result_data is not None:
+                output_data = json.loads(result_data)
+            elif typed:
+                output_data = read_node_output_rows(db_conn, result_id)
+            else:
+                continue
+            outputs.append((run_id, node_id, iteration, output_data))
+        return outputs
+    finally:
+        db_conn.close()
+
+
+def parse_source(source_path, files):
+    """
+    Read every node output of one source; runs in a worker process.
+
+    Returns {'outputs': [(run_id, node_id, iteration, output_data)], 'errors': [...]}.
+    Files that cannot be read are reported and skipped, the rest is still imported.
+    """
+    outputs = {}
+    errors = []
+    flat = os.path.basename(source_path) == FLAT_RESULTS_DIR
+    for name in files:
+        path = os.path.join(source_path, name)
+        try:
+            if name == 'results.db':
+                # Outputs of the database win over JSON files of the same node and iteration
+                for run_id, node_id, iteration, output_data in _read_results_db(path):
+                    outputs[(run_id, node_id, iteration)] = output_data
+                continue
+            if name.endswith('.json'):
+                with open(path, 'r') as f:
+                    document = json.load(f)
+            else:
+                continue
+            if flat:
+                node_id, iteration = FLAT_RESULT_FILE.match(name).groups()
+                document.pop('node_id', None)
+                outputs.setdefault(('legacy', node_id, int(iteration)), document)
+            else:
+                run_id, node_id, file_name = name.split(os.sep)
+                iteration = int(ITERATION_FILE.match(file_name).group(1))
+                outputs.setdefault((run_id, node_id, iteration), document)
+        except (OSError, ValueError, AttributeError, sqlite3.Error) as e:
+            errors.append(f"{name}: {e}")
+    return {
+        'outputs': [(run_id, node_id, iteration, output_data)
+                    for (run_id, node_id, iteration), output_data in outputs.items()],
+        'errors': errors,
+    }
+
+
+def analysis_name(source_path):
+    """(sample, started) from a folder name such as 'LIS 176 Mix 12_20250312_105621'."""
+    name = os.path.basename(source_path)
+    match = FOLDER_NAME.match(name)
+    if not match:
+        return name, None
+    sample, day, clock = match.groups()
+    started = f"{day[:4]}-{day[4:6]}-{day[6:]} {clock[:2]}:{clock[2:4]}:{clock[4:]}"
+    return sample, started
+
+
+def store_source(db_conn, source, source_fingerprint, parsed):
+    """Replace everything imported from ``source`` by the parsed outputs, in one transaction."""
+    sample, started = analysis_name(source)
+    with transaction(db_conn):
+        row = db_conn.execute("SELECT id FROM analyses WHERE source=?", (source,)).fetchone()
+        if row:
+            stale = "SELECT id FROM node_outputs WHERE analysis_id=?"
+            for table in ('node_lists', 'node_metrics', 'node_scalars', 'phase_results'):
+                db_conn.execute(f"DELETE FROM {table} WHERE result_id IN ({stale})", (row[0],))
+            db_conn.execute("DELETE FROM node_outputs WHERE analysis_id=?", (row[0],))
+            db_conn.execute("DELETE FROM analyses WHERE id=?", (row[0],))
+        analysis_id = db_conn.execute(
+            "INSERT INTO analyses (source, sample, started) VALUES (?, ?, ?);", (source, sample, started)
+        ).lastrowid
+        for run_id, node_id, iteration, output_data in parsed['outputs']:
+            output_id = db_conn.execute(
+                "INSERT INTO node_outputs (analysis_id, run_id, node_id, iteration) VALUES (?, ?, ?, ?);",
+                (analysis_id, run_id, node_id, iteration),
+            ).lastrowid
+            if isinstance(output_data, dict):
+                insert_node_output_rows(db_conn, output_id, output_data)
+        db_conn.execute(
+            "INSERT OR REPLACE INTO sources (path, fingerprint, outputs, errors, imported_at) "
+            "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP);",
+            (source, source_fingerprint, len(parsed['outputs']), json.dumps(parsed['errors'])),
+        )
+
+
+def import_results(results_root, warehouse_path, workers=None, force=False, logger=None):
+    """Import every new or changed source under results_root; returns a summary dict."""
+    logger = logger or logging.getLogger('WarehouseImport')
+    results_root = os.path.abspath(results_root)
+    db_conn = init_warehouse(warehouse_path)
+    summary = {'sources': 0, 'imported': 0, 'skipped': 0, 'outputs': 0, 'errors': 0}
+    try:
+        known = dict(db_conn.execute("SELECT path, fingerprint FROM sources"))
+        pending = []
+        for path, files in find_sources(results_root):
+            summary['sources'] += 1
+            source = os.path.relpath(path, results_root)
+            source_fingerprint = fingerprint(path, files)
+            if not force and known.get(source) == source_fingerprint:
+                summary['skipped'] += 1
+                continue
+            pending.append((source, source_fingerprint, path, files))
+        logger.info(f"{len(pending)} of {summary['sources']} sources to import from {results_root}")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(parse_source, path, files): (source, source_fingerprint)
+                       for source, source_fingerprint, path, files in pending}
+            for future in as_completed(futures):
+                source, source_fingerprint = futures[future]
+                parsed = future.result()
+                store_source(db_conn, source, source_fingerprint, parsed)
+                summary['imported'] += 1
+                summary['outputs'] += len(parsed['outputs'])
+                summary['errors'] += len(parsed['errors'])
+                for error in parsed['errors']:
+                    logger.warning(f"{source}: {error}")
+    finally:
+        db_conn.close()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import the node outputs of all analyses into one SQLite warehouse.')
+    parser.add_argument('results_root', nargs='?', default=os.path.join(os.getcwd(), 'results'),
+                        help='Directory holding the results directories of the analyses')
+    parser.add_argument('--warehouse', default=os.path.join(os.getcwd(), 'warehouse.db'),
+                        help='Warehouse database to create or update')
+    parser.add_argument('--workers', type=int, default=None, help='Parsing processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='Re-import sources that did not change')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    started = time.time()
+    summary = import_results(args.results_root, args.warehouse, args.workers, args.force)
+    print(f"{summary['imported']} sources imported ({summary['outputs']} node outputs), {summary['skipped']} "
+          f"unchanged, {summary['errors']} unreadable files, in {time.time() - started:.1f} s -> {args.warehouse}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,75 @@
+"""
+Scratch workspaces of task executions, see create_workspace.
+
+Workspaces kept with keep_workspaces = true, or left behind by analyses that crashed, can
+be removed from every analysis under a results directory with:
+    python workspace.py results
+"""
+
+import argparse
+import logging
+import os
+import shutil
+
+
+WORKSPACES_DIR = 'workspaces'
+
+
+def workspace_path(root_dir, run_id, node_id, iteration):
+    """Return the scratch directory of one task execution."""
+    return os.path.join(root_dir, WORKSPACES_DIR, str(run_id), str(node_id), f"iter_{iteration}")
+
+
+def create_workspace(root_dir, run_id, node_id, iteration):
+    """
+    Create an isolated scratch workspace for one task execution.
+
+    Each workspace has its own input_files and output_files folders so that tasks,
+    runs and samples never clear or overwrite each other's TOPAS files.
+    """
+    path = workspace_path(root_dir, run_id, node_id, iteration)
+    # A leftover workspace from an interrupted execution must not leak stale .out files
+    if os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.join(path, 'input_files'))
+    os.makedirs(os.path.join(path, 'output_files'))
+    return path
+
+
+def remove_workspace(path):
+    if path and os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+        logging.info(f"Removed workspace {path}")
+
+
+def collect_workspaces(root_dir, run_id=None):
+    """Garbage-collect the workspaces of one run below ``root_dir``, or all of them."""
+    path = os.path.join(root_dir, WORKSPACES_DIR)
+    if run_id is not None:
+        path = os.path.join(path, str(run_id))
+    remove_workspace(path)
+
+
+def keep_workspaces(config):
+    """Whether config.txt asks for workspaces to be kept after a task finishes."""
+    return str(config.get('keep_workspaces', 'false')).strip().lower() in ('true', '1', 'yes')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Remove the scratch workspaces of every analysis in a results directory.')
+    parser.add_argument('results_root', nargs='?', default=os.path.join(os.getcwd(), 'results'),
+                        help='Directory holding the results directories of the analyses')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    removed = 0
+    for name in sorted(os.listdir(args.results_root)):
+        if os.path.isdir(os.path.join(args.results_root, name, WORKSPACES_DIR)):
+            collect_workspaces(os.path.join(args.results_root, name))
+            removed += 1
+    print(f"Removed the workspaces of {removed} analyses in {args.results_root}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())